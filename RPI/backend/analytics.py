@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+WineFridge Operation Analytics
+
+Lifecycle timings of guided operations (load, unload, swap, rearrange,
+batch load / unload), per operation type and drawer:
+
+  start ── LED lit ── first bottle event ── completed / timeout / cancelled
+                         (wrong placements counted on the way)
+
+Durations from the start go into LogHistogram's: fixed log-spaced buckets
+(GROWTH apart, i.e. ~5 % relative error) between MIN_SECONDS and
+MAX_SECONDS, so memory does not grow with the number of operations and
+p50/p95/p99 are read straight from the bucket counts. Histograms of
+several drawers merge by adding counts.
+
+All times are time.monotonic(). Stats are saved as JSON at most every
+SAVE_INTERVAL seconds (on operation end) and at shutdown.
+"""
+
+import json
+import math
+import threading
+import time
+from array import array
+
+ANALYTICS_PATH = '/home/plasticlab/WineFridge/RPI/database/operation-stats.json'
+
+MIN_SECONDS = 0.05
+MAX_SECONDS = 3600
+GROWTH = 1.1
+BUCKETS = int(math.ceil(math.log(MAX_SECONDS / MIN_SECONDS) / math.log(GROWTH))) + 1
+
+SAVE_INTERVAL = 300
+
+# Durations measured from the start of an operation
+METRICS = ('led', 'first_event', 'complete')
+OUTCOMES = ('completed', 'timeout', 'cancelled')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LogHistogram:
+    def __init__(self, counts=None):
+        self.counts = array('d', counts or [0] * BUCKETS)
+
+    @staticmethod
+    def bucket(value):
+        if value <= MIN_SECONDS:
+            return 0
+        return min(BUCKETS - 1, int(math.log(value / MIN_SECONDS) / math.log(GROWTH)) + 1)
+
+    @staticmethod
+    def value(bucket):
+        """Representative value of a bucket (geometric middle)"""
+        if bucket == 0:
+            return MIN_SECONDS
+        return MIN_SECONDS * GROWTH ** (bucket - 0.5)
+
+    def add(self, value, weight=1):
+        self.counts[self.bucket(value)] += weight
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        total = self.count
+        if total <= 0:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.value(i)
+        return self.value(BUCKETS - 1)
+
+    def to_json(self):
+        # Sparse: {bucket: count}
+        return {str(i): round(c, 3) for i, c in enumerate(self.counts) if c}
+
+    @classmethod
+    def from_json(cls, data):
+        histogram = cls()
+        for i, count in data.items():
+            if 0 <= int(i) < BUCKETS:
+                histogram.counts[int(i)] = count
+        return histogram
+
+
+class OperationStats:
+    """Histograms + counters for one (operation type, drawer)"""
+
+    def __init__(self):
+        self.histograms = {metric: LogHistogram() for metric in METRICS}
+        self.outcomes = {outcome: 0 for outcome in OUTCOMES}
+        self.wrong = 0              # wrong placements / removals
+        self.with_wrong = 0         # operations with at least one
+
+    def merge(self, other):
+        for metric in METRICS:
+            self.histograms[metric].merge(other.histograms[metric])
+        for outcome in OUTCOMES:
+            self.outcomes[outcome] += other.outcomes[outcome]
+        self.wrong += other.wrong
+        self.with_wrong += other.with_wrong
+
+    def summary(self):
+        finished = sum(self.outcomes.values())
+        rate = lambda n: round(n / finished, 3) if finished else None
+        seconds = {}
+        for metric, histogram in self.histograms.items():
+            seconds[metric] = {"count": int(histogram.count)}
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                seconds[metric][f"p{int(q * 100)}"] = None if value is None else round(value, 2)
+        return {
+            "operations": finished,
+            **self.outcomes,
+            "wrong_placements": self.wrong,
+            "wrong_placement_rate": rate(self.with_wrong),
+            "timeout_rate": rate(self.outcomes['timeout']),
+            "seconds": seconds
+        }
+
+    def to_json(self):
+        return {"histograms": {m: h.to_json() for m, h in self.histograms.items()},
+                "outcomes": self.outcomes, "wrong": self.wrong, "with_wrong": self.with_wrong}
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        for metric, histogram in data.get('histograms', {}).items():
+            if metric in stats.histograms:
+                stats.histograms[metric] = LogHistogram.from_json(histogram)
+        for outcome, count in data.get('outcomes', {}).items():
+            if outcome in stats.outcomes:
+                stats.outcomes[outcome] = count
+        stats.wrong = data.get('wrong', 0)
+        stats.with_wrong = data.get('with_wrong', 0)
+        return stats
+
+
+class OperationAnalytics:
+    def __init__(self, filepath=ANALYTICS_PATH):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.stats = {}             # (op type, drawer) -> OperationStats
+        self.active = {}            # op id -> lifecycle marks
+        self.last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, filepath=ANALYTICS_PATH):
+        analytics = cls(filepath)
+        try:
+            with open(filepath, 'r') as f:
+                for key, data in json.load(f).get('stats', {}).items():
+                    op_type, drawer_id = key.split('|', 1)
+                    analytics.stats[(op_type, drawer_id)] = OperationStats.from_json(data)
+            print(f"[STATS] ✔ Loaded {len(analytics.stats)} operation histograms")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[STATS] ✗ Error loading {filepath}: {e}")
+        return analytics
+
+    def save(self):
+        with self.lock:
+            stats = {f"{op_type}|{drawer_id}": s.to_json() for (op_type, drawer_id), s in self.stats.items()}
+            self.last_save = time.monotonic()
+        try:
+            with open(self.filepath, 'w') as f:
+                json.dump({"version": 1, "stats": stats}, f, separators=(',', ':'))
+        except Exception as e:
+            print(f"[STATS] ✗ Error saving {self.filepath}: {e}")
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def begin(self, op_id, op_type, drawer_id=None):
+        """drawer_id None = operation over several drawers"""
+        with self.lock:
+            self.active[op_id] = {'type': op_type, 'drawer': drawer_id, 'start': time.monotonic(),
+                                  'led': None, 'first_event': None, 'wrong': 0}
+
+    def mark(self, drawer_id, mark):
+        """First LED frame / bottle event on a drawer, for the operations on it"""
+        now = time.monotonic()
+        with self.lock:
+            for op in self.active.values():
+                if op[mark] is None and op['drawer'] in (drawer_id, None):
+                    op[mark] = now
+
+    def wrong(self, op_id):
+        with self.lock:
+            if op_id in self.active:
+                self.active[op_id]['wrong'] += 1
+
+    def end(self, op_id, outcome):
+        """Close an operation: outcome 'completed' / 'timeout' / 'cancelled'"""
+        now = time.monotonic()
+        with self.lock:
+            op = self.active.pop(op_id, None)
+            if op is None:
+                return
+            stats = self.stats.setdefault((op['type'], op['drawer'] or 'all'), OperationStats())
+            for mark in ('led', 'first_event'):
+                if op[mark] is not None:
+                    stats.histograms[mark].add(op[mark] - op['start'])
+            if outcome == 'completed':
+                stats.histograms['complete'].add(now - op['start'])
+            stats.outcomes[outcome] += 1
+            stats.wrong += op['wrong']
+            stats.with_wrong += 1 if op['wrong'] else 0
+            due = now - self.last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    def merged(self, op_type=None, drawer_id=None):
+        """OperationStats of every (type, drawer) matching the filters"""
+        total = OperationStats()
+        with self.lock:
+            for (t, d), stats in self.stats.items():
+                if (op_type is None or t == op_type) and (drawer_id is None or d == drawer_id):
+                    total.merge(stats)
+        return total
+
+    def summary(self, op_type=None, drawer_id=None):
+        """{op type: {drawer: summary}} plus the per-type totals under 'all'"""
+        with self.lock:
+            keys = sorted(k for k in self.stats
+                          if (op_type is None or k[0] == op_type) and (drawer_id is None or k[1] == drawer_id))
+        result = {}
+        for t, d in keys:
+            result.setdefault(t, {})[d] = self.merged(t, d).summary()
+        for t in result:
+            if len(result[t]) > 1:
+                result[t]['total'] = self.merged(t, drawer_id).summary()
+        return result
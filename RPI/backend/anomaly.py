@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+WineFridge Climate Anomaly Detection
+
+Watches each drawer's temperature and humidity heartbeats with O(1) state
+per stream and raises alarms:
+
+  setpoint  smoothed value (EWMA) too far from the zone setpoint
+  rate      smoothed rate of change too fast (door left open, cooling fault)
+  stuck     no variance at all over STUCK_SAMPLES samples (Welford)
+
+Alarms have hysteresis: a condition must hold for RAISE_AFTER samples to
+raise, and the value must come back inside the (tighter) clear limit to
+clear, so a reading hovering on the limit does not flap.
+"""
+
+import threading
+
+EWMA_ALPHA = 0.3
+RATE_ALPHA = 0.5
+RAISE_AFTER = 2
+# 30 min of 60 s heartbeats
+STUCK_SAMPLES = 30
+
+# metric -> limits. deviation/rate: (raise, clear); rate per minute
+LIMITS = {
+    'temperature': {'deviation': (3.0, 2.0), 'rate': (1.0, 0.5)},
+    'humidity': {'deviation': (15.0, 10.0), 'rate': (5.0, 2.5)},
+}
+
+
+class Welford:
+    """Running mean / variance"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+
+class StreamMonitor:
+    def __init__(self, limits):
+        self.limits = limits
+        self.ewma = None
+        self.rate = 0.0         # EWMA of units per minute
+        self.last = None        # (t, value)
+        self.block = Welford()
+        self.active = {}        # alarm -> True while raised
+        self.pending = {}       # alarm -> consecutive samples over the limit
+
+    def update(self, t, value, setpoint=None):
+        """Feed one sample; returns [(alarm, raised, details)] transitions"""
+        self.ewma = value if self.ewma is None else self.ewma + EWMA_ALPHA * (value - self.ewma)
+        if self.last is not None and t > self.last[0]:
+            slope = (value - self.last[1]) / (t - self.last[0]) * 60
+            self.rate += RATE_ALPHA * (slope - self.rate)
+        self.last = (t, value)
+
+        transitions = []
+        if setpoint is not None:
+            deviation = self.ewma - setpoint
+            self._check('setpoint', abs(deviation), self.limits['deviation'], transitions,
+                        {"value": round(self.ewma, 2), "setpoint": setpoint,
+                         "deviation": round(deviation, 2)})
+        self._check('rate', abs(self.rate), self.limits['rate'], transitions,
+                    {"value": round(value, 2), "rate_per_min": round(self.rate, 3)})
+
+        self.block.add(value)
+        if self.block.n >= STUCK_SAMPLES:
+            stuck = self.block.variance == 0.0
+            if stuck != self.active.get('stuck', False):
+                self.active['stuck'] = stuck
+                transitions.append(('stuck', stuck, {"value": round(value, 2), "samples": self.block.n}))
+            self.block = Welford()
+        return transitions
+
+    def _check(self, alarm, magnitude, limits, transitions, details):
+        raise_at, clear_at = limits
+        if self.active.get(alarm):
+            if magnitude < clear_at:
+                self.active[alarm] = False
+                self.pending[alarm] = 0
+                transitions.append((alarm, False, details))
+            return
+        if magnitude > raise_at:
+            self.pending[alarm] = self.pending.get(alarm, 0) + 1
+            if self.pending[alarm] >= RAISE_AFTER:
+                self.active[alarm] = True
+                transitions.append((alarm, True, details))
+        else:
+            self.pending[alarm] = 0
+
+
+class AnomalyDetector:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}       # (device_id, metric) -> StreamMonitor
+
+    def update(self, device_id, metric, t, value, setpoint=None):
+        if metric not in LIMITS:
+            return []
+        with self.lock:
+            key = (device_id, metric)
+            stream = self.streams.get(key)
+            if stream is None:
+                stream = self.streams[key] = StreamMonitor(LIMITS[metric])
+            return stream.update(t, value, setpoint)
+
+    def active(self, device_id=None):
+        """[(device, metric, alarm)] currently raised"""
+        with self.lock:
+            return [(d, m, alarm) for (d, m), stream in self.streams.items()
+                    for alarm, on in stream.active.items()
+                    if on and (device_id is None or d == device_id)]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+WineFridge Batch Load
+
+Several scanned bottles placed in one guided session. Every bottle gets a
+target slot (zone optimizer) and an LED colour; all targets are lit at
+once and bottles may go in in any order.
+
+A 'placed' event is only accepted on a slot some pending bottle targets
+(anything else is a wrong position), and matched to:
+
+  - the bottle targeting that slot, if its weight fits (or is unknown)
+  - otherwise the pending bottle of the drawer whose learned full weight
+    fits closest, which takes the slot; the two bottles swap targets
+  - otherwise still the bottle targeting that slot
+
+so a bottle put in its neighbour's slot is recognised rather than
+rejected. Weights fit within WINDOW_SIGMAS of the learned full weight
+(same sigma as identify.py).
+"""
+
+from identify import MIN_SIGMA, REL_SIGMA, WINDOW_SIGMAS
+
+
+def weight_fits(weight, full):
+    if full is None or not weight:
+        return True
+    return abs(weight - full) <= max(MIN_SIGMA, full * REL_SIGMA) * WINDOW_SIGMAS
+
+
+class BatchLoadSession:
+    def __init__(self, bottles):
+        # bottles: [{'barcode', 'name', 'full' (None = never weighed),
+        #            'color', 'target': (drawer, position)}]
+        self.bottles = bottles
+        for bottle in bottles:
+            bottle['placed'] = None     # weight once in its slot
+
+    @property
+    def done(self):
+        return all(b['placed'] is not None for b in self.bottles)
+
+    def pending(self, drawer_id=None):
+        return [b for b in self.bottles if b['placed'] is None
+                and (drawer_id is None or b['target'][0] == drawer_id)]
+
+    def placed(self):
+        return [b for b in self.bottles if b['placed'] is not None]
+
+    def drawers(self):
+        return {b['target'][0] for b in self.bottles}
+
+    def targets(self):
+        return {b['target'] for b in self.bottles}
+
+    def place(self, slot, weight):
+        """
+        Bottle just placed at slot, or None when no pending bottle targets
+        it. The chosen bottle's target becomes `slot`.
+        """
+        candidates = self.pending(slot[0])
+        owner = next((b for b in candidates if b['target'] == slot), None)
+        if owner is None:
+            return None
+        bottle = owner
+        if not weight_fits(weight, owner['full']):
+            weighed = [b for b in candidates if b['full'] is not None and weight_fits(weight, b['full'])]
+            if weighed:
+                bottle = min(weighed, key=lambda b: abs(weight - b['full']))
+                owner['target'] = bottle['target']
+        bottle['target'] = slot
+        bottle['placed'] = weight
+        return bottle
+
+    def unplace(self, slot):
+        """A bottle placed during the session was taken out again"""
+        for bottle in self.bottles:
+            if bottle['placed'] is not None and bottle['target'] == slot:
+                bottle['placed'] = None
+                return bottle
+        return None
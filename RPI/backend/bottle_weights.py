@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+WineFridge Bottle Weight Model
+
+Learns, per SKU (barcode), the weight of the full bottle and of the empty
+glass instead of using one global threshold for every wine:
+
+  - wine mass prior from the catalog: volume x density(alcohol)
+  - full weight learned from the first placement of the SKU, then
+    averaged with later placements that look like a full bottle
+  - empty weight = full - wine mass, lowered if a lighter reading of the
+    same SKU is ever seen
+
+Rows live in flat arrays (index per barcode) and are saved to
+database/bottle-weights.json as {barcode: [full, empty, samples]}.
+percentages() computes every occupied position of a drawer in one call.
+"""
+
+import json
+import re
+import threading
+from array import array
+
+WEIGHTS_PATH = '/home/plasticlab/WineFridge/RPI/database/bottle-weights.json'
+
+# Fallbacks for SKUs never placed (same values as the old global constants)
+DEFAULT_FULL = 700.0
+DEFAULT_EMPTY = 300.0
+DEFAULT_VOLUME_ML = 750.0
+
+WATER_DENSITY = 0.998
+ETHANOL_DENSITY = 0.789
+# A placement within this fraction of the learned full weight is a full bottle
+FULL_TOLERANCE = 0.05
+
+VOLUME_PATTERN = re.compile(r'([\d.,]+)\s*(ml|cl|l)', re.IGNORECASE)
+
+
+def volume_ml(volume):
+    """'750ml' / '75cl' / '1.5L' -> millilitres"""
+    if isinstance(volume, (int, float)):
+        return float(volume)
+    match = VOLUME_PATTERN.search(volume or '')
+    if not match:
+        return DEFAULT_VOLUME_ML
+    value = float(match.group(1).replace(',', '.'))
+    return value * {'ml': 1, 'cl': 10, 'l': 1000}[match.group(2).lower()]
+
+
+def wine_mass(wine):
+    """Grams of wine in a full bottle of a catalog entry"""
+    alcohol = wine.get('alcohol')
+    alcohol = float(alcohol) / 100 if isinstance(alcohol, (int, float)) else 0.13
+    density = WATER_DENSITY * (1 - alcohol) + ETHANOL_DENSITY * alcohol
+    return volume_ml(wine.get('volume')) * density
+
+
+class BottleWeightModel:
+    def __init__(self, catalog, filepath=WEIGHTS_PATH):
+        self.catalog = catalog.get('wines', {})
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.index = {}             # barcode -> row
+        self.full = array('d')
+        self.empty = array('d')
+        self.samples = array('H')
+
+    @classmethod
+    def load(cls, catalog, filepath=WEIGHTS_PATH):
+        model = cls(catalog, filepath)
+        try:
+            with open(filepath, 'r') as f:
+                for barcode, (full, empty, samples) in json.load(f).get('skus', {}).items():
+                    model._row(barcode, full, empty, samples)
+            print(f"[WEIGHTS] ✔ Loaded {len(model.index)} bottle weight models")
+        except FileNotFoundError:
+            print(f"[WEIGHTS] No bottle weight models yet - learning from placements")
+        except Exception as e:
+            print(f"[WEIGHTS] ✗ Error loading {filepath}: {e}")
+        return model
+
+    def save(self):
+        with self.lock:
+            skus = {barcode: [round(self.full[i], 1), round(self.empty[i], 1), self.samples[i]]
+                    for barcode, i in self.index.items()}
+        try:
+            with open(self.filepath, 'w') as f:
+                json.dump({"version": 1, "skus": skus}, f, separators=(',', ':'))
+        except Exception as e:
+            print(f"[WEIGHTS] ✗ Error saving {self.filepath}: {e}")
+
+    def _row(self, barcode, full, empty, samples):
+        self.index[barcode] = len(self.full)
+        self.full.append(full)
+        self.empty.append(empty)
+        self.samples.append(min(samples, 65535))
+        return self.index[barcode]
+
+    # -------------------------------------------------------------------------
+    # Learning
+    # -------------------------------------------------------------------------
+    def observe_placement(self, barcode, weight):
+        """
+        A bottle of this SKU was placed. The first placement sets the full
+        weight; later ones refine it if they look like a full bottle.
+        Returns True if the model changed.
+        """
+        if not barcode or weight <= 0:
+            return False
+        mass = wine_mass(self.catalog.get(barcode, {}))
+        with self.lock:
+            i = self.index.get(barcode)
+            if i is None:
+                self._row(barcode, weight, max(weight - mass, 0.0), 1)
+                print(f"[WEIGHTS] ✔ Learned {barcode}: full {weight:.0f}g, empty {weight - mass:.0f}g")
+                return True
+
+            if abs(weight - self.full[i]) <= self.full[i] * FULL_TOLERANCE:
+                n = self.samples[i] + 1
+                self.full[i] += (weight - self.full[i]) / n
+                self.empty[i] = min(self.empty[i], max(self.full[i] - mass, 0.0))
+                self.samples[i] = min(n, 65535)
+                return True
+
+            if weight < self.empty[i]:
+                # Glass lighter than estimated
+                self.empty[i] = weight
+                return True
+            return False
+
+    # -------------------------------------------------------------------------
+    # Lookup
+    # -------------------------------------------------------------------------
+    def bounds(self, barcode):
+        """(full, empty) grams for a SKU (defaults if never seen)"""
+        with self.lock:
+            i = self.index.get(barcode)
+            if i is None:
+                return DEFAULT_FULL, DEFAULT_EMPTY
+            return self.full[i], self.empty[i]
+
+    def learned(self, barcode):
+        """True once the SKU has been weighed"""
+        with self.lock:
+            return barcode in self.index
+
+    def entries(self):
+        """[(barcode, full, empty)] of every learned SKU"""
+        with self.lock:
+            return [(barcode, self.full[i], self.empty[i]) for barcode, i in self.index.items()]
+
+    def percentages(self, barcodes, weights):
+        """Fill percentage (0-100 int) for parallel lists of barcodes and weights"""
+        with self.lock:
+            rows = [self.index.get(b, -1) for b in barcodes]
+            full = [self.full[r] if r >= 0 else DEFAULT_FULL for r in rows]
+            empty = [self.empty[r] if r >= 0 else DEFAULT_EMPTY for r in rows]
+        return [max(0, min(100, int((w - e) / (f - e) * 100))) if f > e else 0
+                for w, f, e in zip(weights, full, empty)]
+
+    def percentage(self, barcode, weight):
+        return self.percentages([barcode], [weight])[0]
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+WineFridge Zone Climate Control
+
+One control loop per zone, driven by the functional drawer heartbeats:
+
+  temperature  PID -> cooling duty 0-100 %
+  humidity     hysteresis -> humidifier on / off
+
+Loops run on their own thread at a fixed cadence (never on the MQTT
+thread). Each step publishes the actuation command and reports when the
+zone converges to its setpoint (or drifts away again).
+
+ZoneClimateLoop.step() takes the time as an argument and ThermalPlant
+simulates a zone, so the loop can be exercised without hardware:
+    python3 climate.py
+"""
+
+import threading
+import time
+
+CADENCE = 30            # seconds between control steps
+STALE_AFTER = 180       # ignore measurements older than this
+TEMP_TOLERANCE = 0.5    # °C
+HUMIDITY_TOLERANCE = 5  # %
+HUMIDITY_BAND = 3       # humidifier hysteresis (%)
+CONVERGE_STEPS = 3
+
+# Cooling duty (%) per °C, per °C*s, per °C/s
+PID_GAINS = (25.0, 0.02, 0.0)
+
+
+class PID:
+    def __init__(self, kp, ki, kd, out_min=0.0, out_max=100.0):
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.out_min, self.out_max = out_min, out_max
+        self.integral = 0.0
+        self.last_error = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, error, dt):
+        derivative = 0.0
+        if self.last_error is not None and dt > 0:
+            derivative = (error - self.last_error) / dt
+        self.last_error = error
+
+        integral = self.integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        # Anti-windup: only integrate while the output is not saturated
+        if self.out_min < output < self.out_max:
+            self.integral = integral
+        else:
+            output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        return max(self.out_min, min(self.out_max, output))
+
+
+class ZoneClimateLoop:
+    def __init__(self, zone):
+        self.zone = zone
+        self.target_temp = None
+        self.target_humidity = None
+        self.temperature = None     # (t, value)
+        self.humidity = None
+        self.pid = PID(*PID_GAINS)
+        self.humidifier = False
+        self.cooling = 0.0
+        self.last_step = None
+        self.in_band = 0
+        self.state = 'idle'         # idle / no_data / converging / converged
+
+    def set_target(self, temperature=None, humidity=None):
+        if temperature is not None and temperature != self.target_temp:
+            self.target_temp = temperature
+            self.pid.reset()
+            self.in_band = 0
+        if humidity is not None and humidity != self.target_humidity:
+            self.target_humidity = humidity
+            self.in_band = 0
+
+    def measure(self, t, temperature=None, humidity=None):
+        if temperature is not None:
+            self.temperature = (t, temperature)
+        if humidity is not None:
+            self.humidity = (t, humidity)
+
+    def step(self, now):
+        """
+        One control step. Returns (outputs, state change or None);
+        outputs is None when there is nothing to control.
+        """
+        previous = self.state
+        if self.target_temp is None:
+            self.state = 'idle'
+            return None, self._changed(previous)
+        if self.temperature is None or now - self.temperature[0] > STALE_AFTER:
+            # No fresh reading: stop actuating rather than act blind
+            self.state = 'no_data'
+            self.cooling, self.humidifier = 0.0, False
+            self.pid.reset()
+            self.last_step = None
+            return self.outputs(), self._changed(previous)
+
+        dt = now - self.last_step if self.last_step is not None else CADENCE
+        self.last_step = now
+        temp_error = self.temperature[1] - self.target_temp
+        self.cooling = self.pid.update(temp_error, dt)
+
+        humidity_ok = True
+        if self.target_humidity is not None and self.humidity and now - self.humidity[0] <= STALE_AFTER:
+            value = self.humidity[1]
+            if value < self.target_humidity - HUMIDITY_BAND:
+                self.humidifier = True
+            elif value > self.target_humidity + HUMIDITY_BAND:
+                self.humidifier = False
+            humidity_ok = abs(value - self.target_humidity) <= HUMIDITY_TOLERANCE
+
+        if abs(temp_error) <= TEMP_TOLERANCE and humidity_ok:
+            self.in_band += 1
+        else:
+            self.in_band = 0
+        self.state = 'converged' if self.in_band >= CONVERGE_STEPS else 'converging'
+        return self.outputs(), self._changed(previous)
+
+    def outputs(self):
+        return {"cooling": round(self.cooling, 1), "humidifier": self.humidifier}
+
+    def _changed(self, previous):
+        return self.state if self.state != previous else None
+
+    def report(self):
+        return {
+            "zone": self.zone,
+            "state": self.state,
+            "temperature": self.temperature[1] if self.temperature else None,
+            "humidity": self.humidity[1] if self.humidity else None,
+            "target_temperature": self.target_temp,
+            "target_humidity": self.target_humidity,
+            **self.outputs()
+        }
+
+
+class ClimateController:
+    def __init__(self, actuate, report, cadence=CADENCE):
+        # actuate(zone, outputs) every step, report(zone, report) on state changes
+        self.actuate = actuate
+        self.report = report
+        self.cadence = cadence
+        self.loops = {}
+        self.cond = threading.Condition()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def loop(self, zone):
+        if zone not in self.loops:
+            self.loops[zone] = ZoneClimateLoop(zone)
+        return self.loops[zone]
+
+    def set_target(self, zone, temperature=None, humidity=None):
+        with self.cond:
+            self.loop(zone).set_target(temperature, humidity)
+            self.cond.notify()   # Act on the new setpoint right away
+
+    def measure(self, zone, temperature=None, humidity=None, t=None):
+        with self.cond:
+            self.loop(zone).measure(time.time() if t is None else t, temperature, humidity)
+
+    def step_all(self, now=None):
+        now = time.time() if now is None else now
+        with self.cond:
+            results = [(zone, loop) + loop.step(now) for zone, loop in self.loops.items()]
+        for zone, loop, outputs, changed in results:
+            try:
+                if outputs is not None:
+                    self.actuate(zone, outputs)
+                if changed:
+                    self.report(zone, loop.report())
+            except Exception as e:
+                print(f"[CLIMATE] Error in {zone}: {e}")
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                self.cond.wait(self.cadence)
+                if not self.running:
+                    return
+            self.step_all()
+
+
+class ThermalPlant:
+    """
+    First-order simulated zone: heat leaks in from the room, the cooler
+    removes up to `cooling_power` °C/min at 100 % duty, the humidifier
+    adds `humidify_rate` %/min and humidity relaxes toward the room.
+    """
+
+    def __init__(self, ambient=25.0, temperature=25.0, humidity=45.0,
+                 leak_minutes=60.0, cooling_power=0.4, humidify_rate=1.0, ambient_humidity=45.0):
+        self.ambient = ambient
+        self.temperature = temperature
+        self.humidity = humidity
+        self.leak_minutes = leak_minutes
+        self.cooling_power = cooling_power
+        self.humidify_rate = humidify_rate
+        self.ambient_humidity = ambient_humidity
+
+    def advance(self, seconds, outputs):
+        minutes = seconds / 60
+        leak = (self.ambient - self.temperature) / self.leak_minutes
+        self.temperature += (leak - self.cooling_power * outputs["cooling"] / 100) * minutes
+        drift = (self.ambient_humidity - self.humidity) / self.leak_minutes
+        self.humidity += (drift + (self.humidify_rate if outputs["humidifier"] else 0)) * minutes
+
+
+if __name__ == '__main__':
+    # Simulate a zone cooling from room temperature to a red wine setpoint
+    plant = ThermalPlant()
+    loop = ZoneClimateLoop('upper')
+    loop.set_target(16, 65)
+    for n in range(int(6 * 3600 / CADENCE)):
+        now = n * CADENCE
+        loop.measure(now, round(plant.temperature, 1), round(plant.humidity, 1))
+        outputs, changed = loop.step(now)
+        if changed:
+            print(f"[SIM] {now / 60:6.1f} min  {changed:10s}  {plant.temperature:5.2f}°C "
+                  f"{plant.humidity:5.1f}%  cooling {outputs['cooling']}%")
+        plant.advance(CADENCE, outputs)
+    print(f"[SIM] after 6 h: {plant.temperature:.2f}°C {plant.humidity:.1f}% ({loop.state})")
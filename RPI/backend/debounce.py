@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+WineFridge Bottle Event Conditioning
+
+Load-cell noise can turn one bottle movement into removed → placed →
+removed within milliseconds. Events are held per (drawer, position) until
+the position has been quiet for the settle window and only the final
+state goes on:
+
+  - a burst ending where it started (removed → placed) is dropped
+  - a burst ending in a new state is delivered once, with its last weight
+  - an event repeating the last delivered state is dropped
+  - a placement with a weight no bottle can have (lighter than an empty
+    one, heavier than a full one) still goes through the window, flagged
+    data['implausible']; removals are never judged by weight (the
+    firmware resends the weight latched at placement)
+
+A position that never goes quiet is released MAX_HOLD after its first
+event. Settle 0 passes events straight through (duplicate check and
+flagging still apply).
+
+Deadlines live in a heap like liveness.py (stale entries are recognised
+by their stamp); one thread delivers, outside the lock.
+"""
+
+import heapq
+import threading
+import time
+
+SETTLE_SECONDS = 0.3
+MAX_HOLD = 1.5
+# Slack around the empty / full bottle weights
+WEIGHT_TOLERANCE = 0.2
+
+# Why events were suppressed
+REASONS = ('coalesced', 'duplicate')
+
+
+class EventConditioner:
+    def __init__(self, deliver, min_weight, max_weight, settle=SETTLE_SECONDS):
+        # deliver(drawer_id, message) for every stable transition
+        self.deliver = deliver
+        self.min_weight = min_weight * (1 - WEIGHT_TOLERANCE)
+        self.max_weight = max_weight * (1 + WEIGHT_TOLERANCE)
+        self.settle = settle
+        self.cond = threading.Condition()
+        self.pending = {}       # (drawer, position) -> held burst
+        self.stable = {}        # (drawer, position) -> last delivered event
+        self.heap = []          # (deadline, key, stamp)
+        self.stamp = 0
+        self.suppressed = {}    # drawer -> {reason: count}
+        self.unreported = {}    # drawer -> suppressed since the last take_suppressed()
+        self.delivered = {}     # drawer -> count
+        self.flagged = {}       # drawer -> implausible placements delivered
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def plausible(self, weight):
+        return not isinstance(weight, (int, float)) or not weight or \
+            self.min_weight <= weight <= self.max_weight
+
+    def feed(self, drawer_id, message, now=None):
+        """A bottle_event message; returns False when it was suppressed at once"""
+        data = message.get('data', {}) or {}
+        event, position = data.get('event'), data.get('position')
+        if event not in ('placed', 'removed') or not isinstance(position, int):
+            self.emit(drawer_id, message)
+            return True
+        now = time.monotonic() if now is None else now
+        key = (drawer_id, position)
+
+        deliver = False
+        with self.cond:
+            if event == 'placed' and not self.plausible(data.get('weight')):
+                self.flagged[drawer_id] = self.flagged.get(drawer_id, 0) + 1
+                message = {**message, 'data': {**data, 'implausible': True}}
+            burst = self.pending.get(key)
+            if burst is None:
+                if self.stable.get(key) == event:
+                    self.count(drawer_id, 'duplicate')
+                    return False
+                if self.settle <= 0:
+                    self.stable[key] = event
+                    deliver = True
+                else:
+                    burst = self.pending[key] = {'first': now, 'events': 0}
+            if burst is not None:
+                self.stamp += 1
+                burst.update(message=message, event=event, events=burst['events'] + 1, stamp=self.stamp)
+                deadline = min(now + self.settle, burst['first'] + MAX_HOLD)
+                heapq.heappush(self.heap, (deadline, key, self.stamp))
+                self.cond.notify()
+        if deliver:
+            self.emit(drawer_id, message)
+        return True
+
+    def count(self, drawer_id, reason, n=1):
+        counts = self.suppressed.setdefault(drawer_id, dict.fromkeys(REASONS, 0))
+        counts[reason] += n
+        self.unreported[drawer_id] = self.unreported.get(drawer_id, 0) + n
+
+    def emit(self, drawer_id, message):
+        self.delivered[drawer_id] = self.delivered.get(drawer_id, 0) + 1
+        try:
+            self.deliver(drawer_id, message)
+        except Exception as e:
+            print(f"[DEBOUNCE] ✗ Error delivering event: {e}")
+
+    def tick(self, now=None):
+        """Release bursts whose position went quiet; returns how many were delivered"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        with self.cond:
+            while self.heap and self.heap[0][0] <= now:
+                _, key, stamp = heapq.heappop(self.heap)
+                burst = self.pending.get(key)
+                if burst is None or burst['stamp'] != stamp:
+                    continue    # Superseded by a newer event
+                del self.pending[key]
+                if self.stable.get(key) == burst['event']:
+                    # Back where it started: nothing happened
+                    self.count(key[0], 'coalesced', burst['events'])
+                    continue
+                if burst['events'] > 1:
+                    self.count(key[0], 'coalesced', burst['events'] - 1)
+                self.stable[key] = burst['event']
+                ready.append((key[0], burst['message']))
+        for drawer_id, message in ready:
+            self.emit(drawer_id, message)
+        return len(ready)
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                delay = self.heap[0][0] - time.monotonic() if self.heap else None
+                if delay is None or delay > 0:
+                    self.cond.wait(delay)
+                    continue
+            self.tick()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def set_settle(self, seconds):
+        with self.cond:
+            self.settle = max(0.0, float(seconds))
+
+    def take_suppressed(self, drawer_id):
+        """Events suppressed on a drawer since the last call (heartbeat metric)"""
+        with self.cond:
+            return self.unreported.pop(drawer_id, 0)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "settle": self.settle,
+                "drawers": {d: {"delivered": self.delivered.get(d, 0), "implausible": self.flagged.get(d, 0),
+                                **self.suppressed.get(d, dict.fromkeys(REASONS, 0))}
+                            for d in sorted(set(self.delivered) | set(self.suppressed))}
+            }
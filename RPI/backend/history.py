@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+WineFridge Inventory History
+
+Every change of a slot is an immutable event appended to a JSON-lines log:
+
+  {"seq", "time" (epoch s), "kind", "changes": {"drawer_7/3": slot | null}}
+
+  kind  'placed' / 'removed' / 'moved' / 'swapped' / 'corrected'
+        (corrected = edits made outside an operation: web server,
+        weight relinks, drift found at startup)
+
+`changes` holds the new content of every slot the event touched, so
+events replay without looking at the previous state.
+
+Every SNAPSHOT_EVERY events the full state is appended to a snapshot log.
+at(t) bisects the snapshots (O(log n)), copies the last one taken before t
+and applies the k events between it and t (bisected as well), keeping only
+the drawer asked for.
+
+Bottle age is never stored: age_days() derives it from placed_at (or
+placed_date in older inventories) when a slot is read.
+"""
+
+import bisect
+import copy
+import json
+import threading
+import time
+from datetime import datetime
+
+EVENTS_PATH = '/home/plasticlab/WineFridge/RPI/database/inventory-events.jsonl'
+SNAPSHOTS_PATH = '/home/plasticlab/WineFridge/RPI/database/inventory-snapshots.jsonl'
+
+SNAPSHOT_EVERY = 500
+
+# Slot fields that describe the bottle (fill level and bookkeeping are not history)
+BOTTLE_FIELDS = ('barcode', 'name', 'weight', 'placed_at', 'placed_date')
+
+
+def slot_key(drawer_id, position):
+    return f"{drawer_id}/{position}"
+
+
+def parse_key(key):
+    drawer_id, position = key.rsplit('/', 1)
+    return drawer_id, position
+
+
+def bottle_record(slot):
+    """What an event keeps of an inventory slot (None = empty)"""
+    if not slot or not slot.get('occupied'):
+        return None
+    return {field: slot[field] for field in BOTTLE_FIELDS if slot.get(field) is not None}
+
+
+def parse_time(value):
+    """Epoch seconds from an epoch number or an ISO timestamp (JS 'Z' too)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def placed_time(slot):
+    """Epoch seconds the bottle was placed (placed_at, or placed_date of older writers)"""
+    return parse_time(slot.get('placed_at') or slot.get('placed_date'))
+
+
+def age_days(slot, now=None):
+    """Whole days since the bottle was placed, None when unknown"""
+    placed = placed_time(slot)
+    if placed is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0, int((now - placed) // 86400))
+
+
+def apply(state, changes, drawer_id=None):
+    for key, bottle in changes.items():
+        drawer, position = parse_key(key)
+        if drawer_id is not None and drawer != drawer_id:
+            continue
+        if bottle is None:
+            state.get(drawer, {}).pop(position, None)
+        else:
+            state.setdefault(drawer, {})[position] = dict(bottle)
+
+
+class InventoryHistory:
+    def __init__(self, events_path=EVENTS_PATH, snapshots_path=SNAPSHOTS_PATH):
+        self.events_path = events_path
+        self.snapshots_path = snapshots_path
+        self.lock = threading.Lock()
+        self.events = []
+        self.times = []             # event times, ascending (bisect index)
+        self.snapshots = []         # {'seq', 'time', 'drawers'}
+        self.snapshot_times = []
+        self.state = {}             # drawer -> {position: bottle} after the last event
+
+    @classmethod
+    def load(cls, events_path=EVENTS_PATH, snapshots_path=SNAPSHOTS_PATH):
+        history = cls(events_path, snapshots_path)
+        history.events = cls.read_lines(events_path)
+        history.times = [event['time'] for event in history.events]
+        for snapshot in cls.read_lines(snapshots_path):
+            if snapshot['seq'] <= len(history.events):
+                history.snapshots.append(snapshot)
+                history.snapshot_times.append(snapshot['time'])
+
+        # Head state: last snapshot plus the events after it
+        seq = 0
+        if history.snapshots:
+            seq = history.snapshots[-1]['seq']
+            history.state = copy.deepcopy(history.snapshots[-1]['drawers'])
+        for event in history.events[seq:]:
+            apply(history.state, event['changes'])
+            if (event['seq'] + 1) % SNAPSHOT_EVERY == 0:
+                history.take_snapshot(event['seq'] + 1, event['time'])
+        print(f"[HISTORY] ✔ {len(history.events)} inventory events, {len(history.snapshots)} snapshots")
+        return history
+
+    @staticmethod
+    def read_lines(filepath):
+        rows = []
+        try:
+            with open(filepath, 'r') as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        break   # Torn last line after a power cut
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[HISTORY] ✗ Error loading {filepath}: {e}")
+        return rows
+
+    def append_line(self, filepath, row):
+        try:
+            with open(filepath, 'a') as f:
+                f.write(json.dumps(row, separators=(',', ':')) + '\n')
+        except Exception as e:
+            print(f"[HISTORY] ✗ Error saving {filepath}: {e}")
+
+    def take_snapshot(self, seq, when):
+        """State after the first `seq` events, the last of them at `when`"""
+        snapshot = {'seq': seq, 'time': when, 'drawers': copy.deepcopy(self.state)}
+        self.snapshots.append(snapshot)
+        self.snapshot_times.append(snapshot['time'])
+        self.append_line(self.snapshots_path, snapshot)
+
+    # -------------------------------------------------------------------------
+    # Recording
+    # -------------------------------------------------------------------------
+
+    def record(self, kind, changes, **extra):
+        """
+        Append one event. changes: {(drawer_id, position): inventory slot or
+        None}; slots are reduced to their bottle fields.
+        """
+        changes = {slot_key(*slot): bottle_record(value) for slot, value in changes.items()}
+        with self.lock:
+            now = max(time.time(), self.times[-1]) if self.times else time.time()
+            event = {'seq': len(self.events), 'time': now, 'kind': kind, 'changes': changes, **extra}
+            self.events.append(event)
+            self.times.append(now)
+            self.append_line(self.events_path, event)
+            apply(self.state, changes)
+            if len(self.events) % SNAPSHOT_EVERY == 0:
+                self.take_snapshot(len(self.events), now)
+        return event
+
+    def sync(self, inventory, reason):
+        """
+        Record a 'corrected' event for every slot whose bottle differs from
+        the history (edits made while nobody was recording).
+        """
+        changes = {}
+        with self.lock:
+            seen = set()
+            for drawer_id, drawer in inventory.get('drawers', {}).items():
+                for position, slot in drawer.get('positions', {}).items():
+                    seen.add((drawer_id, position))
+                    known = self.state.get(drawer_id, {}).get(position)
+                    bottle = bottle_record(slot)
+                    if (known or {}).get('barcode') != (bottle or {}).get('barcode') or (known is None) != (bottle is None):
+                        changes[(drawer_id, position)] = slot
+            for drawer_id, positions in self.state.items():
+                for position in positions:
+                    if (drawer_id, position) not in seen:
+                        changes[(drawer_id, position)] = None
+        if not changes:
+            return None
+        print(f"[HISTORY] ⚠ {len(changes)} slots changed outside an operation ({reason})")
+        return self.record('corrected', changes, reason=reason)
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    def at(self, when, drawer_id=None):
+        """
+        Bottles in the fridge (or one drawer) at epoch `when`:
+        {drawer: {position: bottle}}
+        """
+        with self.lock:
+            i = bisect.bisect_right(self.snapshot_times, when) - 1
+            if i >= 0:
+                snapshot = self.snapshots[i]
+                drawers = snapshot['drawers']
+                if drawer_id is not None:
+                    drawers = {drawer_id: drawers.get(drawer_id, {})}
+                state = copy.deepcopy(drawers)
+                start = snapshot['seq']
+            else:
+                state, start = {}, 0
+            end = bisect.bisect_right(self.times, when)
+            for event in self.events[start:end]:
+                apply(state, event['changes'], drawer_id)
+        return state
+
+    def between(self, since, until, drawer_id=None):
+        """Events in [since, until], optionally only those touching a drawer"""
+        with self.lock:
+            events = self.events[bisect.bisect_left(self.times, since):bisect.bisect_right(self.times, until)]
+        if drawer_id is None:
+            return list(events)
+        return [e for e in events if any(parse_key(key)[0] == drawer_id for key in e['changes'])]
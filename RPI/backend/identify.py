@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+WineFridge Bottle Identification by Weight
+
+When a bottle shows up in a slot without a scan (unknown_bottle), its
+weight is matched against:
+
+  - bottles recently taken out (extracted.json + the weight they had in
+    the inventory when they left), measured weights score highest
+  - the learned full weight of every SKU (bottle_weights.py)
+
+Both sources are kept in weight-sorted indexes, so a match is a bisect
+plus a walk over the few entries inside the tolerance window.
+Confidence = score / (sum of scores + NO_MATCH), score being a gaussian of
+the weight difference times the prior of the source.
+"""
+
+import bisect
+import math
+import threading
+import time
+
+from history import parse_time
+
+# Same window as the web server's extracted list (EXPIRED_TIME)
+EXTRACTED_HOURS = 3
+MIN_SIGMA = 15.0        # grams
+REL_SIGMA = 0.02        # fraction of the weight
+WINDOW_SIGMAS = 3
+PRIOR = {'extracted': 1.0, 'extracted_estimate': 0.6, 'sku': 0.3}
+# Probability mass of "none of the candidates"
+NO_MATCH = 0.1
+
+
+class WeightIndex:
+    """Entries sorted by weight"""
+
+    def __init__(self):
+        self.weights = []
+        self.entries = []
+
+    def add(self, weight, entry):
+        i = bisect.bisect_right(self.weights, weight)
+        self.weights.insert(i, weight)
+        self.entries.insert(i, entry)
+
+    def clear(self):
+        self.weights = []
+        self.entries = []
+
+    def near(self, weight, tolerance):
+        lo = bisect.bisect_left(self.weights, weight - tolerance)
+        hi = bisect.bisect_right(self.weights, weight + tolerance)
+        return list(zip(self.weights[lo:hi], self.entries[lo:hi]))
+
+    def __len__(self):
+        return len(self.weights)
+
+
+class BottleMatcher:
+    def __init__(self, bottle_weights, catalog):
+        self.bottle_weights = bottle_weights
+        self.wines = catalog.get('wines', {})
+        self.lock = threading.Lock()
+        # (barcode, drawer, position) -> (weight, removed at)
+        self.recorded = {}
+        self.extracted = WeightIndex()
+        self.skus = WeightIndex()
+        # Set when the candidates changed since the last rebuild
+        self.dirty = True
+
+    def remember(self, barcode, drawer_id, position, weight):
+        """A bottle left the fridge weighing `weight`"""
+        if not barcode or not weight:
+            return
+        with self.lock:
+            self.recorded[(barcode, drawer_id, position)] = (float(weight), time.time())
+            self.dirty = True
+
+    def forget(self, barcode, drawer_id, position):
+        """The bottle taken from (drawer, position) is back"""
+        with self.lock:
+            self.recorded.pop((barcode, drawer_id, position), None)
+            self.dirty = True
+
+    def rebuild(self, extracted, now=None):
+        """
+        Re-index candidates from extracted.json ({barcode: {locations}}),
+        the recorded removals and the learned SKU weights.
+        """
+        now = time.time() if now is None else now
+        horizon = now - EXTRACTED_HOURS * 3600
+        with self.lock:
+            for key in [k for k, (_, t) in self.recorded.items() if t < horizon]:
+                del self.recorded[key]
+
+            self.extracted.clear()
+            seen = set()
+            for key, (weight, t) in self.recorded.items():
+                self.extracted.add(weight, {"barcode": key[0], "drawer": key[1], "position": key[2],
+                                            "source": 'extracted'})
+                seen.add(key)
+            for barcode, entry in (extracted or {}).items():
+                full, _ = self.bottle_weights.bounds(barcode)
+                for location in entry.get('locations', []):
+                    key = (barcode, location.get('drawer'), location.get('position'))
+                    t = parse_time(location.get('timestamp'))
+                    if key in seen or (t is not None and t < horizon):
+                        continue
+                    seen.add(key)
+                    # No weight on record: assume it left full
+                    self.extracted.add(full, {"barcode": barcode, "drawer": key[1], "position": key[2],
+                                              "source": 'extracted_estimate'})
+
+            self.skus.clear()
+            for barcode, full, _ in self.bottle_weights.entries():
+                self.skus.add(full, {"barcode": barcode, "source": 'sku'})
+            self.dirty = False
+
+    def match(self, weight, limit=3):
+        """Best candidates for a bottle weighing `weight`, most likely first"""
+        sigma = max(MIN_SIGMA, abs(weight) * REL_SIGMA)
+        window = sigma * WINDOW_SIGMAS
+        best = {}
+        with self.lock:
+            for index in (self.extracted, self.skus):
+                for w, entry in index.near(weight, window):
+                    score = PRIOR[entry['source']] * math.exp(-0.5 * ((w - weight) / sigma) ** 2)
+                    barcode = entry['barcode']
+                    if barcode not in best or score > best[barcode][0]:
+                        best[barcode] = (score, w, entry)
+
+        total = sum(score for score, _, _ in best.values()) + NO_MATCH
+        ranked = sorted(best.values(), key=lambda c: c[0], reverse=True)[:limit]
+        return [{
+            **entry,
+            "name": self.wines.get(entry['barcode'], {}).get('name'),
+            "weight": round(w, 1),
+            "confidence": round(score / total, 3)
+        } for score, w, entry in ranked]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+WineFridge LED Timeline Scheduler
+
+Handlers describe an LED effect as a list of steps, e.g.
+"green blink until the bottle arrives, then gray 2 s, then off", and hand
+it to a single scheduler thread instead of spawning a sleeping thread per
+effect.
+
+Timelines are keyed by (op_id, drawer_id). Every drawer shows the merge of
+all timelines currently running on it, so finishing one operation never
+blanks a position that another operation has lit in the same drawer.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+# LED colours used by the handler
+GREEN = "#00FF00"
+YELLOW = "#FFFF00"
+RED = "#FF0000"
+GRAY = "#808080"
+
+# One colour per bottle in a batch load (none of the status colours above)
+BATCH_COLORS = ["#0000FF", "#FF00FF", "#00FFFF", "#FF8000", "#8000FF", "#FFFFFF", "#FF0080", "#0080FF"]
+
+
+def led(color, brightness=100, blink=False):
+    """Single LED state for one drawer position"""
+    return {"color": color, "brightness": brightness, "blink": blink}
+
+
+def step(leds, duration=None):
+    """
+    One timeline step.
+
+    leds:     {position: led(...)} shown while the step is active
+    duration: seconds before moving to the next step, None = hold until
+              the timeline is replaced or cancelled
+    """
+    return {"leds": leds, "duration": duration}
+
+
+class LedScheduler:
+    def __init__(self, publish):
+        # publish(drawer_id, positions) sends one composed set_leds frame
+        self.publish = publish
+
+        self.cond = threading.Condition()
+        self.timelines = {}     # (op_id, drawer_id) -> timeline state
+        self.frames = {}        # drawer_id -> last published frame
+        self.queue = []         # heap of (due, seq, key, generation)
+        self.counter = itertools.count()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    def play(self, op_id, drawer_id, steps):
+        """Start (or replace) the timeline of an operation on one drawer"""
+        with self.cond:
+            self._set(op_id, drawer_id, steps)
+            self._render(drawer_id)
+
+    def replace(self, op_id, steps_by_drawer):
+        """
+        Replace every timeline of an operation at once.
+        Drawers not present in steps_by_drawer are released.
+        """
+        with self.cond:
+            touched = set(steps_by_drawer)
+            for key in [k for k in self.timelines if k[0] == op_id]:
+                if key[1] not in steps_by_drawer:
+                    del self.timelines[key]
+                    touched.add(key[1])
+            for drawer_id, steps in steps_by_drawer.items():
+                self._set(op_id, drawer_id, steps)
+            for drawer_id in touched:
+                self._render(drawer_id)
+
+    def cancel(self, op_id):
+        """Stop every timeline of an operation and repaint its drawers"""
+        with self.cond:
+            keys = [k for k in self.timelines if k[0] == op_id]
+            for key in keys:
+                del self.timelines[key]
+            for drawer_id in set(k[1] for k in keys):
+                self._render(drawer_id)
+
+    def clear(self, drawer_id):
+        """Drop all timelines on a drawer and force its LEDs off"""
+        with self.cond:
+            for key in [k for k in self.timelines if k[1] == drawer_id]:
+                del self.timelines[key]
+            self._render(drawer_id, force=True)
+
+    def show(self, drawer_id, frame):
+        """
+        Publish a frame outside any timeline (e.g. inventory sync).
+        It stays until the next timeline change on that drawer.
+        """
+        with self.cond:
+            self.frames[drawer_id] = frame
+            self.publish(drawer_id, frame)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    # -------------------------------------------------------------------------
+    # Internals (caller holds self.cond)
+    # -------------------------------------------------------------------------
+    def _set(self, op_id, drawer_id, steps):
+        key = (op_id, drawer_id)
+        previous = self.timelines.get(key)
+        timeline = {
+            'steps': steps,
+            'index': 0,
+            'generation': next(self.counter),
+            # Keep stacking order when a timeline is replaced in place
+            'order': previous['order'] if previous else next(self.counter)
+        }
+        self.timelines[key] = timeline
+        self._schedule(key, timeline)
+
+    def _schedule(self, key, timeline):
+        if not timeline['steps']:
+            return
+        duration = timeline['steps'][timeline['index']]['duration']
+        if duration is not None:
+            heapq.heappush(self.queue, (time.monotonic() + duration, next(self.counter),
+                                        key, timeline['generation']))
+            self.cond.notify()
+
+    def _compose(self, drawer_id):
+        merged = {}
+        active = sorted((t['order'], t) for k, t in self.timelines.items() if k[1] == drawer_id)
+        for _, timeline in active:
+            if timeline['steps']:
+                merged.update(timeline['steps'][timeline['index']]['leds'])
+        return [{"position": int(pos), **state} for pos, state in sorted(merged.items())]
+
+    def _render(self, drawer_id, force=False):
+        frame = self._compose(drawer_id)
+        if force or self.frames.get(drawer_id) != frame:
+            self.frames[drawer_id] = frame
+            self.publish(drawer_id, frame)
+
+    def run(self):
+        """Single scheduler thread advancing all timed steps"""
+        with self.cond:
+            while self.running:
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+
+                due, _, key, generation = self.queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+
+                heapq.heappop(self.queue)
+                timeline = self.timelines.get(key)
+                if not timeline or timeline['generation'] != generation:
+                    continue  # Replaced or cancelled meanwhile
+
+                timeline['index'] += 1
+                if timeline['index'] >= len(timeline['steps']):
+                    del self.timelines[key]
+                else:
+                    timeline['generation'] = next(self.counter)
+                    self._schedule(key, timeline)
+
+                try:
+                    self._render(key[1])
+                except Exception as e:
+                    print(f"[LED] Error publishing {key[1]}: {e}")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+WineFridge Lighting Command Coalescer
+
+Brightness sliders in the web UI fire a stream of set_brightness commands.
+Each target (one drawer or zone light of a controller) gets at most one
+command per MIN_INTERVAL: the first change goes out immediately, later ones within the window overwrite each
+other and only the latest value is published when the window closes.
+"""
+
+import threading
+import time
+
+# Minimum seconds between two lighting commands to the same controller
+MIN_INTERVAL = 0.25
+
+
+class CommandCoalescer:
+    def __init__(self, publish, min_interval=MIN_INTERVAL):
+        # publish(topic, payload) sends one command
+        self.publish = publish
+        self.min_interval = min_interval
+
+        self.cond = threading.Condition()
+        self.pending = {}       # key -> (topic, payload), latest wins
+        self.last_sent = {}     # key -> monotonic time of last publish
+
+        # Stats for the log
+        self.sent = 0
+        self.coalesced = 0
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key, topic, payload):
+        """Queue a command; key identifies what the command overwrites"""
+        with self.cond:
+            now = time.monotonic()
+            last = self.last_sent.get(key)
+            if key not in self.pending and (last is None or now - last >= self.min_interval):
+                self._send(key, topic, payload, now)
+                return
+
+            if key in self.pending:
+                self.coalesced += 1
+            self.pending[key] = (topic, payload)
+            self.cond.notify()
+
+    def flush(self):
+        """Send everything pending right away"""
+        with self.cond:
+            now = time.monotonic()
+            for key, (topic, payload) in list(self.pending.items()):
+                self._send(key, topic, payload, now)
+            self.pending.clear()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def _send(self, key, topic, payload, now):
+        self.last_sent[key] = now
+        self.sent += 1
+        self.pending.pop(key, None)
+        try:
+            self.publish(topic, payload)
+        except Exception as e:
+            print(f"[LIGHTING] Error publishing to {topic}: {e}")
+
+    def run(self):
+        with self.cond:
+            while self.running:
+                if not self.pending:
+                    self.cond.wait()
+                    continue
+
+                now = time.monotonic()
+                next_due = None
+                for key in list(self.pending):
+                    due = self.last_sent.get(key, now) + self.min_interval
+                    if due <= now:
+                        topic, payload = self.pending[key]
+                        self._send(key, topic, payload, now)
+                    elif next_due is None or due < next_due:
+                        next_due = due
+
+                if next_due is not None:
+                    self.cond.wait(next_due - now)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+WineFridge Device Liveness
+
+Tracks when every ESP32 was last heard from and flags it offline once it
+misses MISSED_BEATS heartbeats (drawers send every 60 s, lighting
+controllers every 90 s).
+
+Deadlines live in a heap of (deadline, device, seen stamp). A new message
+pushes a fresh deadline instead of searching for the old one; stale heap
+entries are recognised by their stamp and dropped when they surface, so
+each message and each expiry costs O(log n).
+"""
+
+import heapq
+import threading
+import time
+
+MISSED_BEATS = 2.5
+DRAWER_INTERVAL = 60
+LIGHTING_INTERVAL = 90
+
+
+class PresenceRegistry:
+    def __init__(self, on_change):
+        # on_change(device_id, online, last_seen) on every transition
+        self.on_change = on_change
+        self.cond = threading.Condition()
+        self.interval = {}      # device_id -> heartbeat interval (s)
+        self.last_seen = {}     # device_id -> epoch of last message
+        self.online = {}        # device_id -> True / False (absent = unknown)
+        self.heap = []          # (deadline, device_id, stamp)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def watch(self, device_id, interval, now=None):
+        """Expect messages from a device; offline if none arrive in time"""
+        now = time.time() if now is None else now
+        with self.cond:
+            self.interval[device_id] = interval
+            self._push(device_id, now, self.last_seen.get(device_id))
+
+    def seen(self, device_id, now=None):
+        """Any message from the device; returns True if it just came back online"""
+        now = time.time() if now is None else now
+        with self.cond:
+            self.last_seen[device_id] = now
+            self._push(device_id, now, now)
+            if self.online.get(device_id):
+                return False
+            self.online[device_id] = True
+            # Published under the lock so transitions go out in order
+            self.on_change(device_id, True, now)
+            return True
+
+    def is_offline(self, device_id):
+        """Only devices known to be down (never-seen devices get a chance)"""
+        with self.cond:
+            return self.online.get(device_id) is False
+
+    def offline(self):
+        with self.cond:
+            return sorted(d for d, state in self.online.items() if state is False)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def _push(self, device_id, now, stamp):
+        timeout = self.interval.get(device_id, DRAWER_INTERVAL) * MISSED_BEATS
+        heapq.heappush(self.heap, (now + timeout, device_id, stamp))
+        self.cond.notify()
+
+    def tick(self, now=None):
+        """Expire overdue devices; returns [device_id] that went offline"""
+        now = time.time() if now is None else now
+        expired = []
+        with self.cond:
+            while self.heap and self.heap[0][0] <= now:
+                _, device_id, stamp = heapq.heappop(self.heap)
+                if stamp != self.last_seen.get(device_id):
+                    continue    # Superseded by a newer message
+                if self.online.get(device_id) is not False:
+                    self.online[device_id] = False
+                    expired.append(device_id)
+                    self.on_change(device_id, False, self.last_seen.get(device_id))
+        return expired
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                delay = self.heap[0][0] - time.time() if self.heap else None
+                if delay is None or delay > 0:
+                    self.cond.wait(delay)
+                    continue
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[PRESENCE] Error: {e}")
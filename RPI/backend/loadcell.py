@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+WineFridge Load Cell Filter
+
+Drawer heartbeats carry one weight per position (weights[9]), latched by
+the firmware when the bottle was placed. Readings are noisy and the scale
+drifts with temperature (e.g. drawer_3 reporting a 301 g scale `weight`
+with a single 270.7 g bottle on it), which would skew fill percentages.
+
+Per drawer, all cells are filtered together on every heartbeat:
+  - a short median window per cell drops single-sample spikes
+  - an EMA smooths what is left
+  - drift = live scale total - sum of the occupied cells' filtered
+    weights, smoothed by DRIFT_ALPHA; it is shared out over the occupied
+    cells
+
+corrected[i] = ema[i] - drift / occupied cells (occupied cells only),
+never below 0.
+
+The live total is the heartbeat `weight` (older drawer firmware), or
+`total_weight` when it differs from the sum of the cells. The current
+drawer firmware reports only that sum, so it has no independent scale
+reading: drift stays None (unknown) and weights are only filtered.
+"""
+
+import threading
+from array import array
+from collections import deque
+
+CELLS = 9
+MEDIAN_WINDOW = 3
+EMA_ALPHA = 0.5
+DRIFT_ALPHA = 0.1
+# Readings above this are a bottle (firmware WEIGHT_THRESHOLD)
+BOTTLE_THRESHOLD = 100.0
+# A total within this of the sum of the cells is that sum (0.1 g rounding per cell)
+SUM_TOLERANCE = 1.0
+# Drawer drift worth a recalibration warning (grams)
+DRIFT_WARN = 20.0
+
+
+def scale_total(data, weights):
+    """Independent scale reading of a heartbeat, None when it has none"""
+    total = data.get('weight')
+    if isinstance(total, (int, float)):
+        return float(total)
+    total = data.get('total_weight')
+    cells = sum(w for w in weights if isinstance(w, (int, float)))
+    if isinstance(total, (int, float)) and abs(total - cells) > SUM_TOLERANCE:
+        return float(total)
+    return None
+
+
+class DrawerWeightFilter:
+    def __init__(self, cells=CELLS, window=MEDIAN_WINDOW):
+        self.cells = cells
+        self.window = deque(maxlen=window)     # recent raw rows
+        self.ema = array('d', bytes(8 * cells))
+        self.occupied = [0] * cells
+        self.drift = None
+        self.samples = 0
+
+    def update(self, weights, occupied=None, total=None):
+        """Feed one heartbeat (total: live scale reading or None); returns the corrected weights"""
+        n = self.cells
+        raw = [float(w) if isinstance(w, (int, float)) else 0.0 for w in weights[:n]]
+        raw += [0.0] * (n - len(raw))
+        if occupied is None:
+            occupied = [1 if w > BOTTLE_THRESHOLD else 0 for w in raw]
+        occupied = [1 if o else 0 for o in list(occupied)[:n]] + [0] * (n - len(occupied))
+
+        # Cells that changed state restart their filter on the new reading
+        changed = [i for i in range(n) if not self.samples or occupied[i] != self.occupied[i]]
+        for row in self.window:
+            for i in changed:
+                row[i] = raw[i]
+        self.window.append(raw)
+        self.occupied = occupied
+        self.samples += 1
+
+        columns = list(zip(*self.window))
+        middle = len(self.window) // 2
+        for i in range(n):
+            median = sorted(columns[i])[middle]
+            if i in changed:
+                self.ema[i] = median
+            else:
+                self.ema[i] += EMA_ALPHA * (median - self.ema[i])
+
+        if total is not None:
+            offset = total - sum(self.ema[i] for i in range(n) if occupied[i])
+            self.drift = offset if self.drift is None else self.drift + DRIFT_ALPHA * (offset - self.drift)
+
+        return self.corrected()
+
+    def share(self):
+        """Drift carried by each occupied cell"""
+        if self.drift is None:
+            return 0.0
+        return self.drift / max(1, sum(self.occupied))
+
+    def corrected(self):
+        share = self.share()
+        return [max(0.0, self.ema[i] - (share if self.occupied[i] else 0.0)) for i in range(self.cells)]
+
+    def correct(self, position, weight):
+        """Apply the drift to a one-off reading (bottle events)"""
+        if not 1 <= position <= self.cells:
+            return weight
+        return max(0.0, weight - self.share())
+
+
+class LoadCellRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.drawers = {}       # drawer_id -> DrawerWeightFilter
+        self.warned = set()     # drawers currently over DRIFT_WARN
+
+    def update(self, drawer_id, data):
+        """
+        Feed a heartbeat 'data' object. Returns corrected weights, or None if
+        the heartbeat has no per-position weights (old firmware).
+        """
+        weights = data.get('weights')
+        if not isinstance(weights, list) or not weights:
+            return None
+        total = scale_total(data, weights)
+        with self.lock:
+            drawer = self.drawers.get(drawer_id)
+            if drawer is None:
+                drawer = self.drawers[drawer_id] = DrawerWeightFilter()
+            corrected = drawer.update(weights, data.get('occupied'), total)
+
+            drifting = drawer.drift is not None and abs(drawer.drift) > DRIFT_WARN
+            if drifting and drawer_id not in self.warned:
+                self.warned.add(drawer_id)
+                print(f"[WEIGHT] ⚠ {drawer_id} tare drift {drawer.drift:+.1f}g - consider recalibrating")
+            elif not drifting and drawer_id in self.warned:
+                self.warned.discard(drawer_id)
+                print(f"[WEIGHT] ✔ {drawer_id} tare drift back to {drawer.drift:+.1f}g")
+            return corrected
+
+    def corrected(self, drawer_id, position=None):
+        """Filtered weights of a drawer (or one position), None if unknown"""
+        with self.lock:
+            drawer = self.drawers.get(drawer_id)
+            if drawer is None or not drawer.samples:
+                return None
+            weights = drawer.corrected()
+            return weights if position is None else weights[position - 1]
+
+    def correct(self, drawer_id, position, weight):
+        with self.lock:
+            drawer = self.drawers.get(drawer_id)
+            return weight if drawer is None else drawer.correct(position, weight)
+
+    def drift(self, drawer_id):
+        with self.lock:
+            drawer = self.drawers.get(drawer_id)
+            return drawer.drift if drawer else None
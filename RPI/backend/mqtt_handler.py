@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 """
 WineFridge MQTT Handler
-Version: 3.3.3
-Date: 21.11.2025
+Version: 3.4.0
+Date: 19.10.2026
 
 FIXES:
 1. ... (Historial de fixes) ...
@@ -17,6 +17,136 @@ FIXES:
 10. FIXED: Added delayed LED sync on startup to prevent green blinking LEDs.
     System now waits 3 seconds after MQTT connect, turns off all LEDs first,
     then sets gray LEDs for occupied positions.
+11. ADDED: LED effects run as timelines on a single LedScheduler
+    (led_timeline.py). Timelines are cancellable per operation and merged
+    per drawer, so fade-outs no longer blank positions lit by other ops.
+12. ADDED: Fridge topology (zones, drawers, controllers) is loaded from
+    database/fridge-topology.json and compiled at startup (topology.py).
+    Zone lighting, shutdown and LED sync route through it instead of
+    hard-coded drawer lists.
+13. ADDED: Lighting slider streams are coalesced per target (lighting.py):
+    for each drawer/zone light only the latest value is published, at
+    most every 250 ms. A grouped `set_lights` command per controller is
+    prepared behind `batch_lighting` (topology), off until the lighting
+    firmware handles it.
+14. ADDED: Device shadows (shadow.py) record what each ESP32 reports in
+    heartbeat/startup messages next to what the handler last commanded.
+    The reconciler re-sends only diverging fields, so a rebooted drawer
+    gets its LEDs/COB back on its next message. LED sync on connect only
+    sends drawers whose shadow differs from the inventory.
+15. MODIFIED: Startup LED sync no longer sleeps 3 s + 1 s. All drawers are
+    painted at once on connect (one composed command each) and each drawer
+    is confirmed/repainted when it is seen alive (startup message or first
+    heartbeat). Time-to-consistent per drawer is kept in sync_metrics.
+16. ADDED: Heartbeat telemetry (telemetry.py): temperature, humidity,
+    weights, occupancy, RSSI, uptime and lighting state are kept in
+    fixed-size array-backed ring buffers per device and metric.
+17. ADDED: Long-term drawer history in an embedded time-series store
+    (tsdb.py, database/tsdb/): compressed append-only segments with
+    background 1m/1h/1d min/max/avg rollups and per-resolution retention.
+18. ADDED: `query_telemetry` system command for dashboard charts. The
+    planner reads the finest stored resolution that keeps the range within
+    MAX_POINTS rows (30 days -> 1h, a year -> 1d), re-buckets it and answers with a compact `telemetry_result` (min/max/avg arrays).
+    Block headers carry their time range so queries skip unrelated blocks,
+    and decoded blocks are cached.
+19. ADDED: Per-position weight filter (loadcell.py) fed by heartbeat
+    `weights[]`: median + EMA per cell. Drawer drift (live scale total
+    minus the occupied cells) is smoothed, logged and subtracted from the
+    bottle weights before fill levels and identification use them; drawer
+    firmware that only reports the sum of its cells has no drift estimate.
+20. ADDED: Fill levels follow the filtered heartbeat weights, so a half
+    poured bottle put back no longer shows 100%. inventory.json is only
+    written when a percentage moves by FILL_HYSTERESIS (5%) or more, and
+    `inventory_updated` now names the changed slot.
+21. ADDED: Per-SKU bottle weight model (bottle_weights.py,
+    database/bottle-weights.json): full weight learned from the first
+    placement, empty weight from the catalog volume/alcohol. Percentages
+    use it (global constants only for unknown SKUs) and a drawer's
+    positions are computed in one lookup.
+22. ADDED: Occupancy reconciler (reconcile.py). Outside operations, each
+    heartbeat `occupied[]` bitmap (and each bottle event) is XORed with the
+    inventory bitmap of the drawer; new mismatches are published once as
+    `bottle_event` with type `unauthorized_removal` / `unknown_bottle`
+    (unauthorized-unload page). inventory.json is re-read when another
+    process (Node /remove-bottle) changed it.
+23. ADDED: Unknown bottles are identified by weight (identify.py) against
+    recently extracted bottles and learned SKU weights (sorted indexes,
+    bisect). A confident match against a weight measured when the bottle
+    left is relinked into the inventory without a rescan; otherwise the candidates go out with the unknown_bottle event.
+24. ADDED: Climate anomaly detection (anomaly.py) on drawer temperature
+    and humidity: setpoint deviation (EWMA vs. zone setpoint from
+    inventory.json), rate of change and stuck sensor (Welford). Alarms
+    have hysteresis and are published as `climate_alarm` on
+    winefridge/system/status when raised and when cleared.
+25. ADDED: Device liveness (liveness.py): last-seen index plus a deadline
+    heap per ESP32; a device missing 2.5 heartbeats is marked offline and
+    `device_status` online/offline transitions are published.
+    start_bottle_load skips offline drawers (rerouting to another
+    functional drawer) instead of waiting for the 60 s timeout.
+26. MODIFIED: `update_setting` no longer sleeps on the MQTT thread. Zone
+    setpoints (from the command or inventory.json) drive a closed-loop
+    controller per zone (climate.py): PID cooling duty + humidifier
+    hysteresis on heartbeat readings, stepped every 30 s on its own
+    thread. `set_climate` goes to the zone's `climate_actuator` (topology)
+    and `climate_status` reports converging/converged.
+27. ADDED: `get_ready_to_serve` system command (serving.py): estimated
+    temperature of every bottle (Newton cooling from placement, zone air
+    history from heartbeats) and time until it enters its catalog
+    serving_temp window, sorted soonest first. A zone's parameters are
+    refitted only when its temperature moves 0.5 °C or its bottles
+    change; temperatures and states are evaluated at each request. New
+    placements store `placed_at`; bottles written by the web client or
+    older handlers fall back to their `placed_date`.
+28. ADDED: Zone placement optimizer (placement.py). start_bottle_load picks
+    the drawer whose zone setpoint best fits the wine's catalog
+    serving_temp (min-cost flow over drawers with free slots; wine type
+    drawer only breaks ties) instead of the fixed type -> drawer map.
+    Slots reserved by pending loads are no longer handed out twice.
+    `plan_zones` publishes `zone_plan`: moves that lower the total
+    serving-temperature mismatch of the bottles already loaded.
+29. ADDED: Rearrangement engine (rearrange.py). `start_rearrange` takes
+    explicit moves (e.g. a zone_plan) or a drawer + order ("regroup
+    drawer_7 by vintage"), plans the minimal move sequence (chains +
+    cycles through a free slot or the user's hand), guides it step by
+    step with LEDs and validates each event against the expected slots.
+    Inventory is written once per completed move. The swap placement
+    phase runs on the same session (put-backs in either order).
+30. ADDED: Batch load (batch_load.py). `start_batch_load` collects scans
+    (or takes `barcodes`), `batch_place` plans every target at once with
+    the zone optimizer and lights them together, one colour per bottle.
+    Placements in any order are matched to pending bottles by drawer,
+    slot and learned weight; the inventory is written once at the end.
+31. ADDED: Batch unload pick list (picklist.py). `start_batch_unload`
+    resolves barcodes/slots to the fewest drawers, orders picks drawer by
+    drawer, lights every pick of the current drawer together and accepts
+    removals in any order. The inventory is written once per finished
+    drawer (`batch_unload_drawer_done`).
+32. ADDED: Inventory history (history.py). Every slot change is an
+    immutable event (placed / removed / moved / swapped / corrected) in
+    an append-only log with periodic snapshots; `inventory_at` answers
+    "what was in drawer_7 on Saturday at 20:00" from the nearest snapshot
+    plus the events after it. Bottle age (`age_days`) is derived when a
+    slot is read instead of being stored.
+33. ADDED: Operation analytics (analytics.py). Every load, unload, swap,
+    rearrangement and batch records start → LED lit → first bottle event
+    → completed / timeout / cancelled (monotonic) plus wrong placements,
+    into fixed-size log-bucket histograms per operation type and drawer.
+    `get_operation_stats` returns p50/p95/p99 and the wrong-placement and
+    timeout rates; stats are saved every few minutes.
+34. ADDED: Adaptive timeouts (timeouts.py). The fixed 60 s Timers of
+    load, unload, swap, rearrangement steps and batch idle waits are
+    OperationTimers whose limit is 1.5 x the rolling p95 wait for that
+    operation type and drawer (decaying log-bucket sketch), bounded to
+    15-90 s; 60 s until enough operations were seen.
+35. ADDED: Bottle event conditioning (debounce.py). bottle_event messages
+    are held per (drawer, position) until the slot is quiet for the
+    settle window (0.3 s, `set_event_settle`); flapping collapses into
+    the final state and repeats are dropped; placements with a weight no
+    bottle can have are delivered flagged `implausible`.
+    Suppressed counts go to the time-series store (`suppressed_events`
+    per heartbeat) and `get_event_stats`.
+    Settled events, operation timeouts and MQTT messages all run the
+    state machines under one lock (`state_lock`).
 """
 
 import json
@@ -26,22 +156,50 @@ import time
 from datetime import datetime
 import threading
 import re
-
-# Define functional drawers with sensors
-FUNCTIONAL_DRAWERS = ['drawer_3', 'drawer_5', 'drawer_7']
-
-# Wine type to drawer mapping
-WINE_TYPE_DRAWERS = {
-    'rose': 'drawer_3',
-    'white': 'drawer_5',
-    'red': 'drawer_7'
-}
-
-# Weight thresholds for bottle percentage
+import os
+
+from led_timeline import LedScheduler, led, step, GREEN, YELLOW, RED, GRAY, BATCH_COLORS
+from topology import FridgeTopology
+from lighting import CommandCoalescer
+from shadow import ShadowRegistry, light_field, light_target
+from telemetry import TelemetryStore, heartbeat_scalars
+from tsdb import TimeSeriesStore, downsample
+from loadcell import LoadCellRegistry
+from bottle_weights import BottleWeightModel
+from reconcile import OccupancyReconciler
+from identify import BottleMatcher
+from anomaly import AnomalyDetector
+from liveness import PresenceRegistry, DRAWER_INTERVAL, LIGHTING_INTERVAL
+from climate import ClimateController
+from serving import ServingModel
+from placement import ZoneOptimizer
+from rearrange import RearrangeSession, plan_moves, put_back, regroup, HAND
+from batch_load import BatchLoadSession
+from picklist import PickList, plan_picks
+from history import InventoryHistory, age_days, parse_time, placed_time
+from analytics import OperationAnalytics
+from timeouts import AdaptiveTimeouts, OperationTimer
+from debounce import EventConditioner
+
+INVENTORY_PATH = '/home/plasticlab/WineFridge/RPI/database/inventory.json'
+EXTRACTED_PATH = '/home/plasticlab/WineFridge/RPI/database/extracted.json'
+
+# Weight match confidence needed to relink a bottle without a rescan
+# (only against a measured removal weight, never an estimate)
+AUTO_RELINK_CONFIDENCE = 0.8
+
+# Plausible bottle weights (percentages use the per-SKU model,
+# these only apply to wines never placed before)
 MIN_FULL_BOTTLE_WEIGHT = 700
 MAX_FULL_BOTTLE_WEIGHT = 2000
 EMPTY_BOTTLE_WEIGHT = 300
 
+# Minimum change (in %) before a heartbeat rewrites a bottle's fill level
+FILL_HYSTERESIS = 5
+
+# start_rearrange orders: catalog field a drawer can be regrouped by
+REGROUP_FIELDS = {'vintage': 'vintage', 'name': 'name', 'type': 'type', 'winery': 'winery'}
+
 def find_serial_port():
     """Detect serial port automatically on RPI5"""
     import os
@@ -57,13 +215,26 @@ def find_serial_port():
                 continue
     return '/dev/ttyAMA0'
 
+def slot_label(slot):
+    """('drawer_7', 3) -> 'drawer_7 #3' (None is the user's hand)"""
+    return 'hand' if slot is HAND else f"{slot[0]} #{slot[1]}"
+
 class WineFridgeController:
     def __init__(self):
-        print("[INIT] Wine Fridge Controller v3.3.3")
+        print("[INIT] Wine Fridge Controller v3.4.0")
 
-        # Load databases
-        self.inventory = self.load_json('/home/plasticlab/WineFridge/RPI/database/inventory.json')
+        # Load fridge layout and databases
+        self.topology = FridgeTopology.load()
+        self.inventory = self.load_json(INVENTORY_PATH)
+        self.inventory_mtime = self.inventory_file_mtime()
         self.catalog = self.load_json('/home/plasticlab/WineFridge/RPI/database/wine-catalog.json')
+        self.bottle_weights = BottleWeightModel.load(self.catalog)
+        self.placement = ZoneOptimizer(self.catalog, self.get_wine_type)
+
+        # Startup LED sync: drawer -> {'started', 'painted'} (monotonic),
+        # and seconds until each drawer was consistent with the inventory
+        self.led_sync = {}
+        self.sync_metrics = {}
 
         # Track pending operations
         self.pending_operations = {}
@@ -72,10 +243,64 @@ class WineFridgeController:
         self.swap_operations = {
             'active': False,
             'bottles_removed': [],
-            'bottles_to_place': [],
+            'session': None,
             'start_time': None
         }
 
+        # Guided multi-bottle rearrangement (None when idle)
+        self.rearrangement = None
+
+        # Batch load: scanned bottles, then one placement session
+        self.batch_load = None
+
+        # Batch unload: pick list worked through drawer by drawer
+        self.batch_unload = None
+
+        # Lifecycle timings of guided operations (per type and drawer)
+        self.analytics = OperationAnalytics.load()
+        self.timeouts = AdaptiveTimeouts.load()
+
+        # Reported vs desired state per ESP32
+        self.shadows = ShadowRegistry()
+
+        # Online / offline per ESP32 (deadline heap)
+        self.presence = PresenceRegistry(self.publish_presence)
+
+        # Heartbeat history: recent samples in memory, months on disk
+        self.telemetry = TelemetryStore()
+        self.tsdb = TimeSeriesStore()
+        self.anomalies = AnomalyDetector()
+        self.serving = ServingModel(self.catalog)
+
+        # Filtered per-position weights (tare drift compensated)
+        self.load_cells = LoadCellRegistry()
+
+        # Immutable log of every slot change (time-travel queries)
+        self.history = InventoryHistory.load()
+        self.history.sync(self.inventory, 'startup')
+
+        # Sensed vs inventory occupancy per drawer
+        self.occupancy = OccupancyReconciler()
+        self.occupancy.load_inventory(self.inventory)
+
+        # One lock around the state machines: MQTT callbacks, settled bottle
+        # events and operation timeouts arrive on different threads
+        self.state_lock = threading.RLock()
+
+        # Flapping bottle events collapse per position before the state machines
+        self.conditioner = EventConditioner(self.locked(self.handle_drawer_status),
+                                            EMPTY_BOTTLE_WEIGHT, MAX_FULL_BOTTLE_WEIGHT)
+
+        # Weight-based identification of bottles put back without a scan
+        self.matcher = BottleMatcher(self.bottle_weights, self.catalog)
+        self.extracted_mtime = None
+
+        # LED timelines (one scheduler thread for all drawers)
+        self.leds = LedScheduler(self.publish_leds)
+
+        # Zone lighting commands, coalesced per target light
+        self.lighting = CommandCoalescer(self.publish_lighting)
+
         # Barcode scanner state
         self.barcode_buffer = ""
         self.last_barcode = ""
@@ -107,6 +332,11 @@ class WineFridgeController:
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
 
+        # Closed-loop climate per zone, setpoints from inventory.json
+        # (started once the client exists: the loop publishes)
+        self.climate = ClimateController(self.actuate_climate, self.report_climate)
+        self.load_climate_targets()
+
         print("[MQTT] Connecting to broker...")
         self.client.connect("localhost", 1883, 60)
 
@@ -116,6 +346,13 @@ class WineFridgeController:
             self.scanner_thread = threading.Thread(target=self.run_scanner, daemon=True)
             self.scanner_thread.start()
 
+    def locked(self, handler):
+        """Wrap a callback run off the MQTT thread so it holds state_lock"""
+        def run(*args, **kwargs):
+            with self.state_lock:
+                return handler(*args, **kwargs)
+        return run
+
     def load_json(self, filepath):
         try:
             with open(filepath, 'r') as f:
@@ -131,6 +368,64 @@ class WineFridgeController:
         except Exception as e:
             print(f"[ERROR] Saving {filepath}: {e}")
 
+    def save_inventory(self):
+        self.save_json(INVENTORY_PATH, self.inventory)
+        self.inventory_mtime = self.inventory_file_mtime()
+
+    def inventory_file_mtime(self):
+        try:
+            return os.path.getmtime(INVENTORY_PATH)
+        except OSError:
+            return None
+
+    def reload_inventory_if_changed(self):
+        """Pick up inventory.json edits made by the web server"""
+        mtime = self.inventory_file_mtime()
+        if mtime is None or mtime == self.inventory_mtime:
+            return
+        inventory = self.load_json(INVENTORY_PATH)
+        if inventory:
+            print(f"[DB] inventory.json changed on disk - reloaded")
+            self.inventory = inventory
+            self.history.sync(inventory, 'web')
+            self.occupancy.load_inventory(inventory)
+            self.load_climate_targets()
+        self.inventory_mtime = mtime
+
+    def publish_leds(self, drawer_id, positions):
+        """Send one composed set_leds frame to a drawer"""
+        if positions:
+            self.analytics.mark(drawer_id, 'led')
+        self.shadows.desire(drawer_id, 'leds', positions)
+        self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
+            "action": "set_leds",
+            "source": "mqtt_handler",
+            "data": {"positions": positions},
+            "timestamp": datetime.now().isoformat()
+        }))
+        self.shadows.applied(drawer_id, 'leds')
+
+    def publish_command(self, topic, payload):
+        """Stamp and publish a command payload"""
+        message = json.dumps({
+            **payload,
+            "timestamp": datetime.now().isoformat(),
+            "source": "mqtt_handler"
+        })
+        self.client.publish(topic, message)
+        print(f"[LIGHTING] → Enviado a {topic}: {message}")
+
+    def publish_lighting(self, topic, payload):
+        """Publish a lighting command and mark its targets as applied"""
+        self.publish_command(topic, payload)
+        device_id = topic.split('/')[1]
+        data = payload.get('data', {})
+        targets = data.get('targets')
+        if targets is None:
+            targets = [{k: v for k, v in data.items() if k in ('drawer', 'zone')}]
+        for target in targets:
+            self.shadows.applied(device_id, light_field(target))
+
     def is_valid_barcode(self, code):
         """Verify if a barcode seems valid"""
         code = code.strip()
@@ -140,19 +435,9 @@ class WineFridgeController:
             return False
         return True
 
-    def calculate_bottle_percentage(self, weight):
-        """Calculate bottle fill percentage based on weight"""
-        if weight < EMPTY_BOTTLE_WEIGHT:
-            return 0
-
-        if weight >= MIN_FULL_BOTTLE_WEIGHT:
-            return 100
-
-        wine_weight = weight - EMPTY_BOTTLE_WEIGHT
-        full_wine_weight = MIN_FULL_BOTTLE_WEIGHT - EMPTY_BOTTLE_WEIGHT
-        percentage = (wine_weight / full_wine_weight) * 100
-
-        return max(0, min(100, int(percentage)))
+    def calculate_bottle_percentage(self, weight, barcode=None):
+        """Calculate bottle fill percentage from the SKU's learned weights"""
+        return self.bottle_weights.percentage(barcode, weight)
 
     def get_wine_type(self, barcode):
         """Get wine type from catalog"""
@@ -242,65 +527,326 @@ class WineFridgeController:
         client.subscribe("winefridge/system/status")
         print("[MQTT] ✔ Subscribed to topics")
 
-        # Wait for ESP32s to connect and settle before syncing LEDs
-        def delayed_sync():
-            time.sleep(3)  # Wait 3 seconds for ESP32s to be ready
-            self.sync_leds_with_inventory()
-        
-        threading.Thread(target=delayed_sync, daemon=True).start()
+        for device_id in self.topology.controllers:
+            interval = DRAWER_INTERVAL if self.topology.is_functional(device_id) else LIGHTING_INTERVAL
+            self.presence.watch(device_id, interval)
+
+        # Paint drawers that are already up; the rest are synced when their
+        # startup message or first heartbeat arrives
+        self.sync_leds_with_inventory()
 
     def sync_leds_with_inventory(self):
-        """Synchronize drawer LEDs with current inventory state on startup"""
+        """
+        Set the desired LED state of every functional drawer from the
+        inventory (gray on occupied positions) and send it to the drawers
+        whose shadow does not already show it. Each drawer stays in
+        self.led_sync until it is seen alive (see handle_device_report).
+        """
         print("[SYNC] Synchronizing LEDs with inventory...")
+        started = time.monotonic()
+
+        for drawer_id in self.topology.functional_drawers:
+            self.led_sync[drawer_id] = {'started': started, 'painted': started}
+            positions_data = self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {})
+            led_positions = [
+                {"position": int(pos_str), **led(GRAY, 30)}
+                for pos_str, pos_data in sorted(positions_data.items(), key=lambda p: int(p[0]))
+                if pos_data.get("occupied", False)
+            ]
+
+            # set_leds replaces the whole drawer, no need to clear first
+            self.shadows.desire(drawer_id, 'leds', led_positions)
+            if self.shadows.get(drawer_id).reported.get('leds') != led_positions:
+                self.leds.show(drawer_id, led_positions)
+                self.led_sync[drawer_id]['painted'] = time.monotonic()
+                print(f"[SYNC] → {drawer_id}: {len(led_positions)} occupied positions")
+            else:
+                print(f"[SYNC] → {drawer_id}: already in sync")
+
+        print("[SYNC] ✔ LED frames sent, waiting for drawers to report\n")
+
+    def handle_device_report(self, device_id, action, message):
+        """Record a heartbeat/startup in the device shadow and reconcile"""
+        if action == 'heartbeat':
+            data = message.get('data', {}) or {}
+            self.telemetry.ingest(device_id, data)
+            if self.topology.is_functional(device_id):
+                self.reload_inventory_if_changed()
+                if self.load_cells.update(device_id, data) is not None:
+                    self.refresh_fill_levels(device_id, data)
+                self.reconcile_occupancy(device_id, data)
+                self.record_history(device_id, data)
+                self.check_climate(device_id, data)
+                values = heartbeat_scalars(data)
+                zone = self.topology.drawers[device_id]['zone']
+                self.climate.measure(zone, values.get('temperature'), values.get('humidity'))
+                if 'temperature' in values:
+                    self.serving.observe_zone(zone, values['temperature'])
+
+        rebooted = self.shadows.report(device_id, action, message)
+        if rebooted:
+            print(f"[SHADOW] {device_id} (re)started - firmware {message.get('firmware', '?')}")
+        self.reconcile_device(device_id)
+
+        # First sign of life since the LED sync: the drawer is consistent
+        # as of its last paint
+        sync = self.led_sync.pop(device_id, None)
+        if sync:
+            elapsed = sync['painted'] - sync['started']
+            self.sync_metrics[device_id] = round(elapsed, 3)
+            print(f"[SYNC] ✔ {device_id} consistent after {elapsed:.2f}s")
+
+    def record_history(self, device_id, data):
+        """Queue a drawer's climate and weight metrics for the time-series store"""
+        metrics = heartbeat_scalars(data)
+        metrics.pop('uptime', None)
+        for i, weight in enumerate(data.get('weights') or []):
+            if isinstance(weight, (int, float)):
+                metrics[f"weight_{i + 1}"] = weight
+        metrics['suppressed_events'] = float(self.conditioner.take_suppressed(device_id))
+        self.tsdb.record(device_id, metrics)
+
+    def refresh_fill_levels(self, device_id, data):
+        """Update stored percentages from filtered weights (hysteresis gated)"""
+        weights = self.load_cells.corrected(device_id)
+        occupied = data.get('occupied') or []
+        positions = self.inventory.get("drawers", {}).get(device_id, {}).get("positions", {})
+
+        candidates = []
+        for position_str, slot in positions.items():
+            if not slot.get("occupied"):
+                continue
+            position = int(position_str)
+            index = position - 1
+            if not 0 <= index < len(weights) or index >= len(occupied) or not occupied[index]:
+                continue  # Bottle out of its cell right now
+            if self.find_pending_op(device_id, position)[1] or self.swap_operations.get('active') \
+                    or self.rearranging(device_id) or self.batch_loading(device_id) \
+                    or self.batch_unloading(device_id):
+                continue  # Let the running operation write this slot
+            candidates.append((position, slot, round(weights[index], 1)))
+        if not candidates:
+            return
 
-        # First, turn off ALL LEDs in all functional drawers to clear any blinking
-        print("[SYNC] Step 1: Turning off all LEDs...")
-        for drawer_id in FUNCTIONAL_DRAWERS:
-            self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                "action": "set_leds",
-                "source": "mqtt_handler",
-                "data": {"positions": []},
-                "timestamp": datetime.now().isoformat()
-            }))
-        
-        # Wait for LEDs to clear
-        time.sleep(1)
-        
-        # Now set gray LEDs for occupied positions
-        print("[SYNC] Step 2: Setting gray LEDs for occupied positions...")
-        for drawer_id in FUNCTIONAL_DRAWERS:
-            if drawer_id in self.inventory.get("drawers", {}):
-                positions_data = self.inventory["drawers"][drawer_id].get("positions", {})
-                led_positions = []
-
-                # Add gray LEDs for occupied positions
-                for pos_str, pos_data in positions_data.items():
-                    if pos_data.get("occupied", False):
-                        led_positions.append({
-                            "position": int(pos_str),
-                            "color": "#808080",
-                            "brightness": 30
-                        })
-
-                # Send LED command for this drawer
-                if led_positions:
-                    self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                        "action": "set_leds",
-                        "source": "mqtt_handler",
-                        "data": {"positions": led_positions},
-                        "timestamp": datetime.now().isoformat()
-                    }))
-                    print(f"[SYNC] → {drawer_id}: {len(led_positions)} occupied positions")
+        percentages = self.bottle_weights.percentages([slot.get("barcode") for _, slot, _ in candidates],
+                                                      [weight for _, _, weight in candidates])
+        changed = []
+        for (position, slot, weight), percentage in zip(candidates, percentages):
+            if abs(percentage - slot.get("percentage", 100)) < FILL_HYSTERESIS:
+                continue
+
+            print(f"[DB] {device_id} pos {position}: {slot.get('percentage')}% → {percentage}% ({weight}g)")
+            slot["weight"] = weight
+            slot["percentage"] = percentage
+            slot["last_update"] = datetime.now().isoformat()
+            changed.append(position)
+        if not changed:
+            return
+
+        # One write per heartbeat, then one update per slot
+        self.save_inventory()
+        for position in changed:
+            self.publish_inventory_update(device_id, position)
+
+    def drawer_busy(self, drawer_id):
+        """A load/unload/swap/rearrangement may legitimately change this drawer's occupancy"""
+        return self.swap_operations.get('active') or self.rearranging(drawer_id) or \
+            self.batch_loading(drawer_id) or self.batch_unloading(drawer_id) or \
+            any(op.get('drawer') == drawer_id for op in self.pending_operations.values())
+
+    def batch_loading(self, drawer_id):
+        session = self.batch_load and self.batch_load['session']
+        return bool(session) and drawer_id in session.drawers()
+
+    def batch_unloading(self, drawer_id):
+        return self.batch_unload is not None and drawer_id in self.batch_unload['picks'].drawers()
+
+    def rearranging(self, drawer_id):
+        return self.rearrangement is not None and drawer_id in self.rearrangement['drawers']
+
+    def reconcile_occupancy(self, drawer_id, data):
+        """XOR the heartbeat occupancy bitmap with the inventory bitmap"""
+        occupied = data.get('occupied')
+        if occupied is None and isinstance(data.get('positions'), list):
+            occupied = [p.get('occupied') for p in data['positions']]
+        if not isinstance(occupied, list) or self.drawer_busy(drawer_id):
+            return
+        removed, unknown = self.occupancy.observe(drawer_id, occupied)
+        self.publish_occupancy_mismatches(drawer_id, removed, unknown)
+
+    def publish_occupancy_mismatches(self, drawer_id, removed, unknown, weight=None):
+        positions = self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {})
+        for position in removed:
+            slot = positions.get(str(position), {})
+            print(f"[RECONCILE] ⚠ {drawer_id} pos {position}: {slot.get('name', '?')[:30]} removed without unload")
+            self.matcher.remember(slot.get('barcode'), drawer_id, position, slot.get('weight'))
+            self.publish_bottle_event('removed', 'unauthorized_removal', drawer_id, position,
+                                      barcode=slot.get('barcode'), name=slot.get('name'))
+        for position in unknown:
+            sensed = self.load_cells.correct(drawer_id, position, weight) if weight is not None \
+                else self.load_cells.corrected(drawer_id, position)
+            candidates = self.identify_bottle(sensed) if sensed else []
+            if candidates and candidates[0]['source'] == 'extracted' and \
+                    candidates[0]['confidence'] >= AUTO_RELINK_CONFIDENCE:
+                self.relink_bottle(drawer_id, position, candidates[0], sensed)
+                continue
+            print(f"[RECONCILE] ⚠ {drawer_id} pos {position}: unknown bottle ({sensed}g), "
+                  f"{len(candidates)} candidate(s)")
+            self.publish_bottle_event('placed', 'unknown_bottle', drawer_id, position,
+                                      weight=sensed, candidates=candidates)
+
+    def identify_bottle(self, weight):
+        """Weight-signature candidates, re-indexed when extracted.json changed"""
+        try:
+            mtime = os.path.getmtime(EXTRACTED_PATH)
+        except OSError:
+            mtime = None
+        if self.matcher.dirty or mtime != self.extracted_mtime:
+            self.matcher.rebuild(self.load_json(EXTRACTED_PATH))
+            self.extracted_mtime = mtime
+        return self.matcher.match(weight)
+
+    def relink_bottle(self, drawer_id, position, match, weight):
+        """Put an identified bottle back in the inventory without a rescan"""
+        barcode = match['barcode']
+        name = match.get('name') or self.catalog.get('wines', {}).get(barcode, {}).get('name')
+        print(f"[RECONCILE] ✔ {drawer_id} pos {position}: identified {name[:30] if name else barcode} "
+              f"by weight ({match['confidence']:.0%})")
+
+        self.update_inventory(drawer_id, position, barcode, name, weight, kind='corrected')
+        if match.get('drawer'):
+            self.matcher.forget(barcode, match['drawer'], match['position'])
+            extracted = self.load_json(EXTRACTED_PATH)
+            if barcode in extracted:
+                locations = [loc for loc in extracted[barcode].get('locations', [])
+                             if (loc.get('drawer'), loc.get('position')) != (match['drawer'], match['position'])]
+                if locations:
+                    extracted[barcode]['locations'] = locations
                 else:
-                    print(f"[SYNC] → {drawer_id}: empty")
+                    del extracted[barcode]
+                self.save_json(EXTRACTED_PATH, extracted)
 
-        print("[SYNC] ✔ LED synchronization complete\n")
+        self.publish_bottle_event('placed', 'bottle_relinked', drawer_id, position,
+                                  barcode=barcode, name=name, confidence=match['confidence'],
+                                  previous={"drawer": match.get('drawer'), "position": match.get('position')})
+
+    def publish_bottle_event(self, event, event_type, drawer_id, position, **extra):
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "bottle_event",
+            "source": "mqtt_handler",
+            "data": {
+                "event": event,
+                "type": event_type,
+                "drawer": drawer_id,
+                "position": position,
+                **extra
+            },
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def publish_inventory_update(self, drawer_id, position):
+        """inventory_updated with the changed slot only"""
+        slot = self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {}).get(str(position))
+        if slot and slot.get("occupied"):
+            slot = {**slot, "age_days": age_days(slot)}
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "inventory_updated",
+            "source": "mqtt_handler",
+            "data": {
+                "drawer": drawer_id,
+                "position": position,
+                "slot": slot
+            },
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def check_climate(self, device_id, data):
+        """Feed temperature/humidity to the anomaly detector, publish alarm changes"""
+        now = time.time()
+        settings = self.inventory.get("drawers", {}).get(device_id, {})
+        values = heartbeat_scalars(data)
+        for metric in ('temperature', 'humidity'):
+            if metric not in values:
+                continue
+            setpoint = settings.get(metric)
+            setpoint = setpoint if isinstance(setpoint, (int, float)) else None
+            for alarm, raised, details in self.anomalies.update(device_id, metric, now, values[metric], setpoint):
+                state = 'raised' if raised else 'cleared'
+                print(f"[CLIMATE] {'⚠' if raised else '✔'} {device_id} {metric} {alarm} alarm {state}: {details}")
+                self.client.publish("winefridge/system/status", json.dumps({
+                    "action": "climate_alarm",
+                    "source": "mqtt_handler",
+                    "data": {
+                        "drawer": device_id,
+                        "zone": settings.get('zone'),
+                        "metric": metric,
+                        "alarm": alarm,
+                        "state": state,
+                        **details
+                    },
+                    "timestamp": datetime.now().isoformat()
+                }))
+
+    def publish_presence(self, device_id, online, last_seen):
+        state = 'online' if online else 'offline'
+        if online:
+            print(f"[PRESENCE] ✔ {device_id} online")
+        else:
+            gap = time.time() - last_seen if last_seen else None
+            print(f"[PRESENCE] ✗ {device_id} offline"
+                  f" (last seen {f'{gap:.0f}s ago' if gap is not None else 'never'})")
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "device_status",
+            "source": "mqtt_handler",
+            "data": {
+                "device": device_id,
+                "state": state,
+                "last_seen": datetime.fromtimestamp(last_seen).isoformat() if last_seen else None
+            },
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def reconcile_device(self, device_id):
+        """Re-send only the fields where the device diverges from the desired state"""
+        diverged = self.shadows.diverged(device_id)
+        if not diverged:
+            return
+
+        lights = {}
+        for field, value in diverged:
+            if field == 'leds':
+                print(f"[SHADOW] → {device_id}: re-sending LEDs ({len(value)} positions)")
+                self.publish_leds(device_id, value)
+                if device_id in self.led_sync:
+                    self.led_sync[device_id]['painted'] = time.monotonic()
+            elif field.startswith('light'):
+                key = (value['temperature'], value['brightness'])
+                lights.setdefault(key, []).append(light_target(field))
+
+        topic = f"winefridge/{device_id}/command"
+        for (temperature, brightness), targets in lights.items():
+            print(f"[SHADOW] → {device_id}: re-sending {len(targets)} light(s)")
+            if len(targets) > 1 and self.topology.batch_lighting:
+                self.publish_lighting(topic, {
+                    "action": "set_lights",
+                    "data": {"temperature": temperature, "brightness": brightness, "targets": targets}
+                })
+            else:
+                for target in targets:
+                    self.publish_lighting(topic, {
+                        "action": "set_zone_light" if 'zone' in target else "set_general_light",
+                        "data": {"temperature": temperature, "brightness": brightness, **target}
+                    })
 
     def on_disconnect(self, client, userdata, flags, rc, properties):
         if rc != 0:
             print(f"[MQTT] ✗ Disconnected (rc={rc}), reconnecting...")
 
     def on_message(self, client, userdata, msg):
+        with self.state_lock:
+            self.dispatch_message(msg)
+
+    def dispatch_message(self, msg):
         try:
             message = json.loads(msg.payload.decode())
             source = message.get('source', 'unknown')
@@ -326,8 +872,11 @@ class WineFridgeController:
 
             elif '/status' in msg.topic:
                 drawer_id = msg.topic.split('/')[1]
-                if action == 'bottle_event':
-                    self.handle_drawer_status(drawer_id, message)
+                self.presence.seen(drawer_id)
+                if action in ('heartbeat', 'startup'):
+                    self.handle_device_report(drawer_id, action, message)
+                elif action == 'bottle_event':
+                    self.conditioner.feed(drawer_id, message)
                 elif action == 'wrong_placement':
                     self.handle_wrong_placement(drawer_id, message)
 
@@ -360,6 +909,10 @@ class WineFridgeController:
         if wine_type:
             print(f"[BARCODE]   Type: {wine_type}")
 
+        if self.batch_load and self.batch_load['session'] is None:
+            self.add_batch_bottle(barcode)
+            return
+
         print(f"[BARCODE] Ready - waiting for frontend to call start_load")
 
     # MODIFIED: Now receives the 'data' object directly
@@ -391,20 +944,43 @@ class WineFridgeController:
             self.handle_fridge_lighting(data)
         elif action == 'shutdown':
             self.handle_shutdown()
+        elif action == 'query_telemetry':
+            self.handle_telemetry_query(data)
+        elif action == 'get_ready_to_serve':
+            self.handle_ready_to_serve(data)
+        elif action == 'plan_zones':
+            self.handle_zone_plan(data)
+        elif action == 'start_rearrange':
+            self.start_rearrange(data)
+        elif action == 'cancel_rearrange':
+            self.cancel_rearrange()
+        elif action == 'start_batch_load':
+            self.start_batch_load(data)
+        elif action == 'batch_place':
+            self.plan_batch_load()
+        elif action in ('finish_batch_load', 'cancel_batch_load'):
+            self.finish_batch_load('cancelled' if action == 'cancel_batch_load' else 'finished')
+        elif action == 'start_batch_unload':
+            self.start_batch_unload(data)
+        elif action == 'cancel_batch_unload':
+            self.end_batch_unload('cancelled')
+        elif action == 'inventory_at':
+            self.handle_inventory_at(data)
+        elif action == 'inventory_history':
+            self.handle_inventory_history(data)
+        elif action == 'get_operation_stats':
+            self.handle_operation_stats(data)
+        elif action == 'set_event_settle':
+            self.handle_event_settle(data)
+        elif action == 'get_event_stats':
+            self.publish_event_stats(data)
 
-    # =========================================================================
-    # FUNCIÓN CORREGIDA - Fixed routing for all zones
-    # =========================================================================
     def handle_zone_lighting(self, data):
         """
         Maneja los cambios de iluminación de la zona.
-        Esto es complejo porque una "zona" (ej. 'upper') controla
-        múltiples luces en diferentes tópicos de MQTT.
-        
-        ESTRUCTURA CORRECTA:
-        - Lower zone (zone 1): drawer 3 (functional) + drawers 1, 2 (lighting_2)
-        - Middle zone (zone 2): drawer 5 (functional) + drawers 4, 6 (lighting_6)
-        - Upper zone (zone 3): drawer 7 (functional) + drawers 8, 9 (lighting_8)
+        Una "zona" (ej. 'upper') controla múltiples luces en diferentes
+        tópicos de MQTT; las rutas salen de la topología compilada
+        (fridge-topology.json), p.ej. upper → drawer_7 + lighting_8 (8, 9, zona 3).
         """
         zone_name = data.get('zone') # 'upper', 'middle', 'lower'
         brightness_str = data.get('value', '0')
@@ -413,6 +989,11 @@ class WineFridgeController:
         print(f"[LIGHTING] Received command for {zone_name} zone: "
               f"Brightness={brightness_str}%, Temp={color_temp_name}")
 
+        batches = self.topology.zone_batches.get(zone_name)
+        if not batches:
+            print(f"[LIGHTING] ✗ Zona desconocida: {zone_name}")
+            return
+
         # 1. Convertir nombre de temp a valor Kelvin
         temp_map = {
             'warm_white': 2700,
@@ -429,135 +1010,279 @@ class WineFridgeController:
         except ValueError:
             brightness = 0
 
-        # 3. Definir payloads de comando
+        # 3. Un comando por luz (set_general_light / set_zone_light); el
+        #    coalescer se queda solo con el último valor del slider por luz.
+        #    Con batch_lighting, 'set_lights' agrupa los destinos de un
+        #    controlador multi-cajón (ej. lighting_8 → cajón 8, cajón 9,
+        #    zona 3); el firmware de iluminación aún no lo procesa.
+        for topic, targets in batches:
+            device_id = topic.split('/')[1]
+            for action, extra in targets:
+                self.shadows.desire(device_id, light_field(extra),
+                                    {"temperature": temperature, "brightness": brightness})
+
+            if len(targets) > 1 and self.topology.batch_lighting:
+                payload = {
+                    "action": "set_lights",
+                    "data": {
+                        "temperature": temperature,
+                        "brightness": brightness,
+                        "targets": [extra for action, extra in targets]
+                    }
+                }
+                self.lighting.submit(topic, topic, payload)
+            else:
+                for action, extra in targets:
+                    payload = {
+                        "action": action,
+                        "data": {"temperature": temperature, "brightness": brightness, **extra}
+                    }
+                    self.lighting.submit(f"{topic}:{action}:{json.dumps(extra)}", topic, payload)
+
+    # MODIFIED: Ahora recibe el 'data' object y funciona
+    def handle_zone_settings(self, data):
+        """
+        Maneja los ajustes de temperatura/humedad de la zona.
+        Solo fija las consignas; el lazo de control (climate.py) actúa en
+        su propio hilo.
+        """
+        zone = data.get('zone')
+        mode = data.get('mode')
+        target_temp = data.get('target')
+        humidity = data.get('humidity')
 
-        # Payload para controladores de cajón "independientes" (ej. drawer_7)
-        # (Basado en tu mosquitto_pub, no necesita 'drawer' key)
-        drawer_payload_data = {
-            "temperature": temperature,
-            "brightness": brightness
-        }
+        print(f"[SETTINGS] Recibidos ajustes para zona {zone}: "
+              f"Mode={mode}, Temp={target_temp}, Humidity={humidity}")
 
-        # Payload base para controladores "multi-cajón" (ej. lighting_8)
-        # (Necesitará 'drawer' o 'zone' key añadidas)
-        multi_controller_payload_data = {
-            "temperature": temperature,
-            "brightness": brightness
-        }
+        if zone not in self.topology.zone_drawers:
+            print(f"[SETTINGS] ✗ Unknown zone: {zone}")
+            return
+        try:
+            target_temp = float(target_temp)
+            humidity = float(humidity) if humidity not in (None, '') else None
+        except (TypeError, ValueError):
+            print(f"[SETTINGS] ✗ Invalid setpoint: {target_temp} / {humidity}")
+            return
 
-        commands_to_send = []
+        # inventory.json is the web server's (/update-inventory stores the
+        # same settings); the loop picks them up again from there on reload
+        self.climate.set_target(zone, target_temp, humidity)
 
-        if zone_name == 'upper':
-            # Zona 3, Cajones 7, 8, 9
-            # Cajón 7 -> drawer_7/command (FUNCTIONAL)
-            commands_to_send.append({
-                "topic": "winefridge/drawer_7/command",
-                "payload": {"action": "set_general_light", "data": drawer_payload_data}
-            })
-            # Cajón 8 -> lighting_8/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_8/command",
-                "payload": {"action": "set_general_light", "data": {**multi_controller_payload_data, "drawer": 8}}
-            })
-            # Cajón 9 -> lighting_8/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_8/command",
-                "payload": {"action": "set_general_light", "data": {**multi_controller_payload_data, "drawer": 9}}
-            })
-            # Zona 3 -> lighting_8/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_8/command",
-                "payload": {"action": "set_zone_light", "data": {**multi_controller_payload_data, "zone": 3}}
-            })
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "settings_updated",
+            "source": "mqtt_handler",
+            "timestamp": datetime.now().isoformat()
+        }))
+        print(f"[SETTINGS] ✔ Ajustes actualizados para {zone}")
 
-        elif zone_name == 'middle':
-            # Zona 2, Cajones 4, 5, 6
-            # Cajón 4 -> lighting_6/command (NOT drawer_4!)
-            commands_to_send.append({
-                "topic": "winefridge/lighting_6/command",
-                "payload": {"action": "set_general_light", "data": {**multi_controller_payload_data, "drawer": 4}}
-            })
-            # Cajón 5 -> drawer_5/command (FUNCTIONAL - direct command!)
-            commands_to_send.append({
-                "topic": "winefridge/drawer_5/command",
-                "payload": {"action": "set_general_light", "data": drawer_payload_data}
-            })
-            # Cajón 6 -> lighting_6/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_6/command",
-                "payload": {"action": "set_general_light", "data": {**multi_controller_payload_data, "drawer": 6}}
-            })
-            # Zona 2 -> lighting_6/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_6/command",
-                "payload": {"action": "set_zone_light", "data": {**multi_controller_payload_data, "zone": 2}}
-            })
+    def handle_telemetry_query(self, data):
+        """
+        Chart data for the dashboard.
+        data: {request_id, device (drawer id or zone name), metric,
+               start/end (epoch s) or range (s), step (s, optional)}
+        Answers on winefridge/system/status with 'telemetry_result'.
+        """
+        device_id = data.get('device', '')
+        metric = data.get('metric', 'temperature')
 
-        elif zone_name == 'lower':
-            # Zona 1, Cajones 1, 2, 3
-            # Cajón 3 -> drawer_3/command (FUNCTIONAL)
-            commands_to_send.append({
-                "topic": "winefridge/drawer_3/command",
-                "payload": {"action": "set_general_light", "data": drawer_payload_data}
-            })
-            # Cajón 1 -> lighting_2/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_2/command",
-                "payload": {"action": "set_general_light", "data": {**multi_controller_payload_data, "drawer": 1}}
-            })
-            # Cajón 2 -> lighting_2/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_2/command",
-                "payload": {"action": "set_general_light", "data": {**multi_controller_payload_data, "drawer": 2}}
-            })
-            # Zona 1 -> lighting_2/command
-            commands_to_send.append({
-                "topic": "winefridge/lighting_2/command",
-                "payload": {"action": "set_zone_light", "data": {**multi_controller_payload_data, "zone": 1}}
-            })
+        # A zone name charts the functional drawer of that zone
+        if device_id in self.topology.zone_drawers:
+            device_id = self.topology.zone_sensor(device_id) or device_id
 
-        else:
-            print(f"[LIGHTING] ✗ Zona desconocida: {zone_name}")
+        try:
+            end = float(data.get('end') or time.time())
+            start = float(data.get('start') or end - float(data.get('range', 86400)))
+            step = float(data.get('step') or 0)
+        except (TypeError, ValueError):
+            print(f"[TELEMETRY] ✗ Invalid query: {data}")
             return
 
-        # 4. Publicar todos los comandos
-        for cmd in commands_to_send:
-            # Añadir timestamp y source al payload final
-            # (fuera del objeto 'data')
-            final_payload = {
-                **cmd["payload"], # Esto incluye 'action' y 'data'
-                "timestamp": datetime.now().isoformat(),
-                "source": "mqtt_handler"
-            }
+        started = time.monotonic()
+        result = self.tsdb.chart(device_id, metric, start, end, step)
 
-            message = json.dumps(final_payload)
-            self.client.publish(cmd["topic"], message)
-            print(f"[LIGHTING] → Enviado a {cmd['topic']}: {message}")
+        # Devices not kept on disk (lighting controllers): last 24 h in memory
+        if all(v is None for v in result['avg']):
+            ring = self.telemetry.buffer(device_id, metric)
+            if ring is not None and ring.width == 1:
+                times, values = ring.since(start)
+                rows = [(t, v) for t, v in zip(times, values) if t <= end]
+                vmin, vmax, avg = downsample(rows, start, end, result['step'])
+                result.update(resolution='memory', min=vmin, max=vmax, avg=avg)
 
-    # =========================================================================
+        for key in ('min', 'max', 'avg'):
+            result[key] = [None if v is None else round(v, 2) for v in result[key]]
+        elapsed = (time.monotonic() - started) * 1000
 
-    # MODIFIED: Ahora recibe el 'data' object y funciona
-    def handle_zone_settings(self, data):
-        """Maneja los ajustes de temperatura/humedad de la zona"""
-        zone = data.get('zone')
-        mode = data.get('mode')
-        target_temp = data.get('target')
-        humidity = data.get('humidity')
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "telemetry_result",
+            "source": "mqtt_handler",
+            "data": {
+                "request_id": data.get('request_id'),
+                "device": device_id,
+                "metric": metric,
+                "start": start,
+                "end": end,
+                **result
+            },
+            "timestamp": datetime.now().isoformat()
+        }, separators=(',', ':')))
+        print(f"[TELEMETRY] ✔ {device_id}/{metric} {len(result['avg'])} points "
+              f"from {result['resolution']} in {elapsed:.1f}ms")
+
+    def zone_air_temperature(self, zone, since=None):
+        """(latest, mean since `since`) air temperature of a zone"""
+        ring = self.telemetry.buffer(self.topology.zone_sensor(zone), 'temperature')
+        latest = ring.latest() if ring is not None else None
+        if latest is None:
+            # No heartbeat yet: assume the zone sits at its setpoint
+            for drawer_id in self.topology.zone_drawers.get(zone, []):
+                setpoint = self.inventory.get("drawers", {}).get(drawer_id, {}).get("temperature")
+                if isinstance(setpoint, (int, float)):
+                    return setpoint, setpoint
+            return None, None
+        current = latest[1]
+        if since is None:
+            return current, current
+        _, values = ring.since(since)
+        return current, (sum(values) / len(values) if values else current)
+
+    def handle_ready_to_serve(self, data):
+        """Bottles sorted by time until they are at serving temperature"""
+        bottles_by_zone = {}
+        for drawer_id, drawer in self.inventory.get("drawers", {}).items():
+            zone = self.topology.drawers.get(drawer_id, {}).get('zone')
+            if not zone:
+                continue
+            for position, slot in sorted(drawer.get("positions", {}).items(), key=lambda p: int(p[0])):
+                if slot.get("occupied") and slot.get("barcode"):
+                    bottles_by_zone.setdefault(zone, []).append({
+                        "drawer": drawer_id,
+                        "position": int(position),
+                        "barcode": slot["barcode"],
+                        "name": slot.get("name"),
+                        "placed_at": placed_time(slot)
+                    })
 
-        print(f"[SETTINGS] Recibidos ajustes para zona {zone}: "
-              f"Mode={mode}, Temp={target_temp}, Humidity={humidity}")
-        #
-        # ... Añade tu lógica aquí para controlar temperatura/humedad ...
-        #
+        bottles = self.serving.view(bottles_by_zone, self.zone_air_temperature)
+        for bottle in bottles:
+            bottle.pop('ready_at')
+        ready = sum(1 for b in bottles if b['state'] == 'ready')
+        print(f"[SERVING] ✔ {ready}/{len(bottles)} bottles at serving temperature")
 
-        # Ejemplo: Confirmar actualización al cliente web
-        time.sleep(1) # Simulando trabajo
         self.client.publish("winefridge/system/status", json.dumps({
-            "action": "settings_updated",
+            "action": "ready_to_serve",
             "source": "mqtt_handler",
+            "data": {"request_id": data.get('request_id'), "bottles": bottles},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def handle_inventory_at(self, data):
+        """
+        Bottles in the fridge at a past moment.
+        data: {request_id, time (ISO or epoch s), drawer (optional)}
+        """
+        when = parse_time(data.get('time')) if data.get('time') is not None else time.time()
+        if when is None:
+            print(f"[HISTORY] ✗ Invalid time: {data.get('time')}")
+            return
+        drawer_id = data.get('drawer')
+        drawers = self.history.at(when, drawer_id)
+        for positions in drawers.values():
+            for bottle in positions.values():
+                bottle["age_days"] = age_days(bottle, when)
+        print(f"[HISTORY] ✔ {sum(len(p) for p in drawers.values())} bottles "
+              f"{'in ' + drawer_id if drawer_id else 'in the fridge'} at {datetime.fromtimestamp(when).isoformat()}")
+
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "inventory_at",
+            "source": "mqtt_handler",
+            "data": {"request_id": data.get('request_id'),
+                     "time": datetime.fromtimestamp(when).isoformat(),
+                     "drawers": drawers},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def handle_inventory_history(self, data):
+        """
+        Slot events in a time range.
+        data: {request_id, start/end (ISO or epoch s) or range (s), drawer (optional)}
+        """
+        end = parse_time(data.get('end')) if data.get('end') is not None else time.time()
+        start = parse_time(data.get('start')) if data.get('start') is not None else \
+            (end - float(data.get('range', 86400)) if end is not None else None)
+        if start is None or end is None:
+            print(f"[HISTORY] ✗ Invalid range: {data}")
+            return
+        events = self.history.between(start, end, data.get('drawer'))
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "inventory_history",
+            "source": "mqtt_handler",
+            "data": {"request_id": data.get('request_id'), "events": events},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def handle_operation_stats(self, data):
+        """p50/p95/p99 timings and rates, data: {request_id, type, drawer} (filters optional)"""
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "operation_stats",
+            "source": "mqtt_handler",
+            "data": {"request_id": data.get('request_id'),
+                     "stats": self.analytics.summary(data.get('type'), data.get('drawer'))},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def handle_event_settle(self, data):
+        """Settle window (s) for bottle events, 0 = no debouncing"""
+        try:
+            self.conditioner.set_settle(data.get('seconds'))
+        except (TypeError, ValueError):
+            print(f"[DEBOUNCE] ✗ Invalid settle window: {data.get('seconds')}")
+            return
+        print(f"[DEBOUNCE] ✔ Settle window {self.conditioner.settle}s")
+        self.publish_event_stats(data)
+
+    def publish_event_stats(self, data):
+        """Delivered and suppressed bottle events per drawer"""
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "event_stats",
+            "source": "mqtt_handler",
+            "data": {"request_id": data.get('request_id'), **self.conditioner.stats()},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def load_climate_targets(self):
+        """Zone setpoints from inventory.json (first drawer of the zone that has them)"""
+        drawers = self.inventory.get("drawers", {})
+        for zone, drawer_ids in self.topology.zone_drawers.items():
+            for drawer_id in drawer_ids:
+                settings = drawers.get(drawer_id, {})
+                if isinstance(settings.get("temperature"), (int, float)):
+                    humidity = settings.get("humidity")
+                    self.climate.set_target(zone, settings["temperature"],
+                                            humidity if isinstance(humidity, (int, float)) else None)
+                    break
+
+    def actuate_climate(self, zone, outputs):
+        """Called by the climate loop every step"""
+        actuator = self.topology.climate_actuators.get(zone)
+        if not actuator:
+            return  # No climate hardware on this zone yet: status reports only
+        self.client.publish(f"winefridge/{actuator}/command", json.dumps({
+            "action": "set_climate",
+            "source": "mqtt_handler",
+            "data": {"zone": self.topology.zone_numbers[zone], **outputs},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def report_climate(self, zone, report):
+        print(f"[CLIMATE] {zone}: {report['state']} ({report['temperature']}°C → "
+              f"{report['target_temperature']}°C, cooling {report['cooling']}%)")
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "climate_status",
+            "source": "mqtt_handler",
+            "data": report,
             "timestamp": datetime.now().isoformat()
         }))
-        print(f"[SETTINGS] ✔ Ajustes actualizados para {zone}")
 
     # MODIFIED: Ahora recibe el 'data' object y funciona
     def handle_fridge_lighting(self, data):
@@ -584,32 +1309,94 @@ class WineFridgeController:
             "timestamp": datetime.now().isoformat()
         }
 
-        for drawer in ['drawer_3', 'drawer_5', 'drawer_7', 'lighting_2', 'lighting_6', 'lighting_8']:
-            self.client.publish(f"winefridge/{drawer}/command", json.dumps(shutdown_msg))
+        for device_id in self.topology.controllers:
+            self.client.publish(f"winefridge/{device_id}/command", json.dumps(shutdown_msg))
 
+        self.analytics.save()
+        self.timeouts.save()
         print("[SHUTDOWN] Executing system shutdown in 3 seconds...")
         time.sleep(3)
 
         import subprocess
         subprocess.run(['sudo', 'shutdown', 'now'])
 
-    def find_empty_position(self, preferred_drawer=None):
-        """Find empty position, preferring specified drawer"""
-        if preferred_drawer and preferred_drawer in FUNCTIONAL_DRAWERS:
-            positions = self.inventory.get("drawers", {}).get(preferred_drawer, {}).get("positions", {})
-            for pos in range(1, 10):
-                if str(pos) not in positions or not positions[str(pos)].get("occupied", False):
-                    return preferred_drawer, pos
+    def reserved_positions(self):
+        """(drawer, position) targeted by pending load operations and batch loads"""
+        reserved = {(op['drawer'], op['position']) for op in self.pending_operations.values()
+                    if op.get('type') == 'load'}
+        if self.batch_load and self.batch_load['session']:
+            reserved |= {b['target'] for b in self.batch_load['session'].pending()}
+        return reserved
 
-        for drawer_id in FUNCTIONAL_DRAWERS:
-            if drawer_id == preferred_drawer:
+    def placement_drawers(self, free_only=True):
+        """
+        Online functional drawers for the optimizer: zone setpoint, reserved
+        wine type and slots (occupied ones too unless free_only; slots held
+        by pending loads never).
+        """
+        reserved = self.reserved_positions()
+        drawers = {}
+        for drawer_id in self.topology.functional_drawers:
+            if self.presence.is_offline(drawer_id):
                 continue
+            drawer = self.inventory.get("drawers", {}).get(drawer_id, {})
+            positions = drawer.get("positions", {})
+            slots = []
+            for pos in range(1, self.topology.drawers[drawer_id]['positions'] + 1):
+                if positions.get(str(pos), {}).get("occupied", False):
+                    if not free_only:
+                        slots.append(pos)
+                elif (drawer_id, pos) not in reserved:
+                    slots.append(pos)
+            drawers[drawer_id] = {
+                'temperature': drawer.get("temperature"),
+                'wine_type': self.topology.drawers[drawer_id]['wine_type'],
+                'positions': slots,
+                'capacity': len(slots)
+            }
+        return drawers
+
+    def find_load_position(self, barcode):
+        """Free slot in the drawer that best fits the wine (offline drawers are skipped)"""
+        drawers = self.placement_drawers()
+        drawer_id = self.placement.assign([barcode], drawers)[0]
+        if not drawer_id:
+            return None, None
+        off = self.placement.degrees(barcode, drawers[drawer_id])
+        print(f"[LOAD] Zone fit: {drawer_id} at {drawers[drawer_id]['temperature']}°C"
+              + (f" ({off:.1f}°C off serving temp)" if off else ""))
+        return drawer_id, drawers[drawer_id]['positions'][0]
+
+    def handle_zone_plan(self, data):
+        """Propose moves that bring loaded bottles closer to their serving temperature"""
+        drawers = self.placement_drawers(free_only=False)
+        bottles = []
+        for drawer_id in drawers:
             positions = self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {})
-            for pos in range(1, 10):
-                if str(pos) not in positions or not positions[str(pos)].get("occupied", False):
-                    return drawer_id, pos
+            for pos_str, slot in sorted(positions.items(), key=lambda p: int(p[0])):
+                if slot.get("occupied") and slot.get("barcode"):
+                    bottles.append({"barcode": slot["barcode"], "name": slot.get("name"),
+                                    "drawer": drawer_id, "position": int(pos_str)})
 
-        return None, None
+        moves, before, after = self.placement.rearrange(bottles, drawers)
+        print(f"[PLAN] {len(moves)} moves, mismatch {before:.1f}°C → {after:.1f}°C")
+
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": "zone_plan",
+            "source": "mqtt_handler",
+            "data": {
+                "request_id": data.get('request_id'),
+                "moves": [{
+                    "barcode": move['barcode'],
+                    "name": move['name'],
+                    "from": {"drawer": move['drawer'], "position": move['position']},
+                    "to": {"drawer": move['to_drawer'], "position": move['to_position']}
+                } for move in moves],
+                "mismatch_before": round(before, 1),
+                "mismatch_after": round(after, 1)
+            },
+            "timestamp": datetime.now().isoformat()
+        }))
 
     # MODIFIED: Now receives the 'data' object directly
     def start_bottle_load(self, data):
@@ -618,16 +1405,10 @@ class WineFridgeController:
         print(f"\n[LOAD] ═══════════════════════════════")
         print(f"[LOAD] Starting: {name[:40]}")
 
-        wine_type = self.get_wine_type(barcode)
-        preferred_drawer = WINE_TYPE_DRAWERS.get(wine_type) if wine_type else None
-
-        if wine_type:
-            print(f"[LOAD] Type: {wine_type} → Target: {preferred_drawer}")
-
-        drawer_id, position = self.find_empty_position(preferred_drawer)
+        drawer_id, position = self.find_load_position(barcode)
 
         if not drawer_id or not position:
-            print("[LOAD] ✗ No empty positions available")
+            print("[LOAD] ✗ No empty positions available (online drawers)")
             self.client.publish("winefridge/system/status", json.dumps({
                 "action": "load_error",
                 "source": "mqtt_handler",
@@ -649,13 +1430,9 @@ class WineFridgeController:
             'timestamp': time.time()
         }
 
+        self.analytics.begin(op_id, 'load', drawer_id)
         print(f"[LOAD] → LED: Green blinking at position {position}")
-        self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-            "action": "set_leds",
-            "source": "mqtt_handler",
-            "data": {"positions": [{"position": position, "color": "#00FF00", "brightness": 100, "blink": True}]},
-            "timestamp": datetime.now().isoformat()
-        }))
+        self.leds.play(op_id, drawer_id, [step({position: led(GREEN, 100, True)})])
 
         self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
             "action": "expect_bottle",
@@ -664,17 +1441,17 @@ class WineFridgeController:
             "timestamp": datetime.now().isoformat()
         }))
 
+        timer = OperationTimer(self.timeouts, 'load', drawer_id, self.locked(self.handle_timeout), [op_id])
         self.client.publish("winefridge/system/status", json.dumps({
             "action": "expect_bottle",
             "source": "mqtt_handler",
-            "data": {"drawer": drawer_id, "position": position, "wine_name": name},
+            "data": {"drawer": drawer_id, "position": position, "wine_name": name, "timeout": timer.interval},
             "timestamp": datetime.now().isoformat()
         }))
 
-        timer = threading.Timer(60, self.handle_timeout, [op_id])
         timer.start()
         self.pending_operations[op_id]['timer'] = timer
-        print(f"[LOAD] ⏱ Timeout timer started (60s)")
+        print(f"[LOAD] ⏱ Timeout timer started ({timer.interval}s)")
         print(f"[LOAD] ═══════════════════════════════\n")
 
     # MODIFIED: Now receives the 'data' object directly
@@ -734,7 +1511,7 @@ class WineFridgeController:
         drawer_id, position = bottle_location
         print(f"[UNLOAD] Position: {drawer_id} slot #{position}")
 
-        if drawer_id not in FUNCTIONAL_DRAWERS:
+        if drawer_id not in self.topology.functional_drawers:
             print(f"[UNLOAD] ✗ {drawer_id} has no sensors")
             self.client.publish("winefridge/system/status", json.dumps({
                 "action": "unload_error",
@@ -755,25 +1532,21 @@ class WineFridgeController:
             'timestamp': time.time()
         }
 
+        self.analytics.begin(op_id, 'unload', drawer_id)
         print(f"[UNLOAD] → LED: Green blinking at position {position}")
-        self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-            "action": "set_leds",
-            "source": "mqtt_handler",
-            "data": {"positions": [{"position": position, "color": "#00FF00", "brightness": 100, "blink": True}]},
-            "timestamp": datetime.now().isoformat()
-        }))
+        self.leds.play(op_id, drawer_id, [step({position: led(GREEN, 100, True)})])
 
+        timer = OperationTimer(self.timeouts, 'unload', drawer_id, self.locked(self.handle_timeout), [op_id])
         self.client.publish("winefridge/system/status", json.dumps({
             "action": "expect_removal",
             "source": "mqtt_handler",
-            "data": {"drawer": drawer_id, "position": position, "wine_name": name},
+            "data": {"drawer": drawer_id, "position": position, "wine_name": name, "timeout": timer.interval},
             "timestamp": datetime.now().isoformat()
         }))
 
-        timer = threading.Timer(60, self.handle_timeout, [op_id])
         timer.start()
         self.pending_operations[op_id]['timer'] = timer
-        print(f"[UNLOAD] ⏱ Timeout timer started (60s)")
+        print(f"[UNLOAD] ⏱ Timeout timer started ({timer.interval}s)")
         print(f"[UNLOAD] ═══════════════════════════════\n")
 
     def start_swap_bottles(self):
@@ -782,9 +1555,10 @@ class WineFridgeController:
         self.swap_operations = {
             'active': True,
             'bottles_removed': [],
-            'bottles_to_place': [],
+            'session': None,
             'start_time': time.time()
         }
+        self.analytics.begin('swap', 'swap')
         self.client.publish("winefridge/system/status", json.dumps({
             "action": "swap_started",
             "source": "mqtt_handler",
@@ -800,35 +1574,561 @@ class WineFridgeController:
             self.swap_operations['timer'].cancel()
             print("[SWAP] Timer cancelled")
 
-        # Turn off all LEDs
-        for bottle_info in self.swap_operations.get('bottles_removed', []):
-            drawer_id = bottle_info['drawer']
-            self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                "action": "set_leds",
-                "source": "mqtt_handler",
-                "data": {"positions": []}, # Turn off LEDs
-                "timestamp": datetime.now().isoformat()
-            }))
-
-        # Also clear LEDs for bottles_to_place
-        for target_info in self.swap_operations.get('bottles_to_place', []):
-            drawer_id = target_info.get('target_drawer')
-            if drawer_id:
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": []},
-                    "timestamp": datetime.now().isoformat()
-                }))
+        # Turn off all swap LEDs (removed bottles, targets, wrong positions)
+        self.leds.cancel('swap')
+        self.analytics.end('swap', 'cancelled')
 
         self.swap_operations = {
             'active': False,
             'bottles_removed': [],
-            'bottles_to_place': [],
+            'session': None,
             'start_time': None
         }
         print("[SWAP] Cancelled\n")
 
+    def publish_rearrange(self, action, data=None):
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": action,
+            "source": "mqtt_handler",
+            "data": data or {},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def rearrange_targets(self, data):
+        """{from slot: to slot} requested by a start_rearrange command"""
+        if data.get('moves'):
+            return {(m['from']['drawer'], int(m['from']['position'])): (m['to']['drawer'], int(m['to']['position']))
+                    for m in data['moves']}
+
+        drawer_id = data.get('drawer')
+        field = REGROUP_FIELDS.get(data.get('order', 'vintage'))
+        if not drawer_id or not field:
+            raise ValueError("Give either moves or a drawer and an order "
+                             f"({', '.join(REGROUP_FIELDS)})")
+        wines = self.catalog.get('wines', {})
+        bottles = {(drawer_id, int(pos)): slot for pos, slot in
+                   self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {}).items()
+                   if slot.get("occupied")}
+        # Bottles without the field go last
+        return regroup(bottles, lambda slot: (wines.get(slot.get("barcode"), {}).get(field) is None,
+                                              str(wines.get(slot.get("barcode"), {}).get(field, ''))))
+
+    def start_rearrange(self, data):
+        """Guide a multi-bottle rearrangement towards a target layout"""
+        print(f"\n[REARRANGE] ═══════════════════════════════")
+        if self.swap_operations.get('active') or self.rearrangement or self.pending_operations \
+                or self.batch_load or self.batch_unload:
+            print("[REARRANGE] ✗ Another operation is running")
+            self.publish_rearrange("rearrange_error", {"error": "Another operation is running"})
+            return
+
+        drawers = self.placement_drawers(free_only=False)
+        try:
+            targets = self.rearrange_targets(data)
+            positions = lambda d: self.inventory.get("drawers", {}).get(d, {}).get("positions", {})
+            occupied = lambda slot: positions(slot[0]).get(str(slot[1]), {}).get("occupied", False)
+            for frm, to in targets.items():
+                for slot in (frm, to):
+                    if slot[0] not in drawers or slot[1] not in drawers[slot[0]]['positions']:
+                        raise ValueError(f"{slot[0]} #{slot[1]} is not an online functional slot")
+                if not occupied(frm):
+                    raise ValueError(f"{frm[0]} #{frm[1]} is empty")
+                if occupied(to) and to not in targets:
+                    raise ValueError(f"{to[0]} #{to[1]} is taken by a bottle that does not move")
+            targets = {frm: to for frm, to in targets.items() if frm != to}
+            involved = {slot[0] for pair in targets.items() for slot in pair}
+            free = [(d, p) for d in involved for p in drawers[d]['positions'] if not occupied((d, p))]
+            moves = plan_moves(targets, free)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"[REARRANGE] ✗ {e}")
+            self.publish_rearrange("rearrange_error", {"error": str(e)})
+            return
+
+        if not moves:
+            print("[REARRANGE] ✔ Already in place")
+            self.publish_rearrange("rearrange_completed", {"success": True, "steps": 0})
+            return
+
+        bottles = {frm: dict(self.inventory["drawers"][frm[0]]["positions"][str(frm[1])]) for frm in targets}
+        self.rearrangement = {
+            'session': RearrangeSession(moves),
+            'bottles': bottles,
+            'drawers': involved,
+            'placed': [],
+            'timer': None
+        }
+        self.analytics.begin('rearrange', 'rearrange', next(iter(involved)) if len(involved) == 1 else None)
+        print(f"[REARRANGE] {len(targets)} bottles, {len(moves)} moves over {sorted(involved)}")
+        self.publish_rearrange("rearrange_started", {
+            "bottles": len(targets),
+            "steps": [self.describe_move(move) for move in moves]
+        })
+        self.next_rearrange_step()
+        print(f"[REARRANGE] ═══════════════════════════════\n")
+
+    def describe_move(self, move):
+        slot = lambda s: None if s is HAND else {"drawer": s[0], "position": s[1]}
+        return {
+            "name": self.rearrangement['bottles'][move['origin']].get("name"),
+            "from": slot(move['from']),
+            "to": slot(move['to'])
+        }
+
+    def next_rearrange_step(self):
+        """Announce the current move, light it and restart the step timeout"""
+        session = self.rearrangement['session']
+        if self.rearrangement['timer']:
+            self.rearrangement['timer'].satisfied()
+        move = session.moves[0]
+        drawer_id = (move['from'] or move['to'])[0]
+        self.rearrangement['timer'] = OperationTimer(self.timeouts, 'rearrange', drawer_id,
+                                                     self.locked(self.rearrange_timeout), [session])
+        self.rearrangement['timer'].start()
+
+        print(f"[REARRANGE] Step {session.step}/{session.total}: "
+              f"{slot_label(move['from'])} → {slot_label(move['to'])}")
+        self.publish_rearrange("rearrange_step", {
+            "step": session.step, "total": session.total, **self.describe_move(move)
+        })
+        self.show_rearrange_leds('rearrange', session, self.rearrangement['placed'])
+
+    def handle_rearrange_event(self, drawer_id, position, event):
+        if event not in ('placed', 'removed') or not isinstance(position, int):
+            return
+        session = self.rearrangement['session']
+        slot = (drawer_id, position)
+        expected = session.expected()
+        outcome, move = session.event(event, slot)
+
+        if outcome == 'moved':
+            print(f"[REARRANGE] ✔ Step {session.step - 1}/{session.total} done")
+            self.commit_move(move, self.rearrangement['bottles'][move['origin']])
+            placed = self.rearrangement['placed']
+            if move['from'] in placed:
+                placed.remove(move['from'])
+            if move['to'] is not HAND:
+                placed.append(move['to'])
+            if session.done:
+                self.finish_rearrange()
+            else:
+                self.next_rearrange_step()
+            return
+
+        if outcome == 'wrong':
+            print(f"[REARRANGE] ✗ Unexpected {event} at {drawer_id} #{position}")
+            self.analytics.wrong('rearrange')
+            self.publish_rearrange("rearrange_error", {
+                "error": "wrong_position" if event == 'placed' else "wrong_bottle_removed",
+                "drawer": drawer_id,
+                "position": position,
+                "expected": [{"drawer": d, "position": p, "event": e} for (d, p), e in expected.items()]
+            })
+        elif outcome == 'cleared':
+            print(f"[REARRANGE] → {drawer_id} #{position} undone")
+            self.publish_rearrange("rearrange_error_cleared", {"drawer": drawer_id, "position": position})
+        self.show_rearrange_leds('rearrange', session, self.rearrangement['placed'])
+
+    def finish_rearrange(self):
+        session = self.rearrangement['session']
+        self.rearrangement['timer'].satisfied()
+        print(f"[REARRANGE] ✔ Complete ({session.total} moves)")
+        # Gray on the new positions for 2 seconds, then release
+        self.show_rearrange_leds('rearrange', session, self.rearrangement['placed'], hold=2)
+        self.publish_rearrange("rearrange_completed", {"success": True, "steps": session.total})
+        self.analytics.end('rearrange', 'completed')
+        self.rearrangement = None
+
+    def rearrange_timeout(self, session):
+        if not self.rearrangement or self.rearrangement['session'] is not session:
+            return
+        print(f"[REARRANGE] ⏱ Timeout at step {session.step}/{session.total}")
+        self.leds.cancel('rearrange')
+        self.publish_rearrange("rearrange_timeout", {"completed": session.step - 1, "total": session.total})
+        self.analytics.end('rearrange', 'timeout')
+        self.rearrangement = None
+
+    def cancel_rearrange(self):
+        if not self.rearrangement:
+            return
+        print("\n[REARRANGE] Cancelling rearrangement...")
+        self.rearrangement['timer'].cancel()
+        self.leds.cancel('rearrange')
+        self.analytics.end('rearrange', 'cancelled')
+        self.rearrangement = None
+        print("[REARRANGE] Cancelled\n")
+
+    def publish_batch(self, action, data=None):
+        self.client.publish("winefridge/system/status", json.dumps({
+            "action": action,
+            "source": "mqtt_handler",
+            "data": data or {},
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    def start_batch_load(self, data):
+        """Open a batch load; bottles come from data['barcodes'] or the scanner"""
+        print(f"\n[BATCH] ═══════════════════════════════")
+        if self.batch_load or self.batch_unload or self.swap_operations.get('active') \
+                or self.rearrangement or self.pending_operations:
+            print("[BATCH] ✗ Another operation is running")
+            self.publish_batch("batch_load_error", {"error": "Another operation is running"})
+            return
+
+        self.batch_load = {'scanned': [], 'session': None, 'timer': None, 'wrong': set()}
+        for barcode in data.get('barcodes') or []:
+            self.add_batch_bottle(barcode)
+        if data.get('barcodes'):
+            self.plan_batch_load()
+        else:
+            print("[BATCH] Scan the bottles, then batch_place")
+            self.publish_batch("batch_load_scanning")
+
+    def add_batch_bottle(self, barcode):
+        wine = self.catalog.get('wines', {}).get(barcode)
+        if not wine:
+            print(f"[BATCH] ✗ {barcode} not in catalog")
+            return
+        scanned = self.batch_load['scanned']
+        scanned.append({"barcode": barcode, "name": wine.get('name', 'Unknown Wine')})
+        print(f"[BATCH] + {scanned[-1]['name'][:40]} ({len(scanned)} bottles)")
+        self.publish_batch("batch_scan", {"count": len(scanned), "bottles": scanned})
+
+    def plan_batch_load(self):
+        """Choose every target at once and light them all"""
+        if not self.batch_load or self.batch_load['session'] or not self.batch_load['scanned']:
+            return
+        scanned = self.batch_load['scanned']
+        drawers = self.placement_drawers()
+        assignment = self.placement.assign([b['barcode'] for b in scanned], drawers)
+
+        bottles, unplaced = [], []
+        for bottle, drawer_id in zip(scanned, assignment):
+            if drawer_id is None:
+                unplaced.append(bottle)
+                continue
+            barcode = bottle['barcode']
+            bottles.append({
+                **bottle,
+                'full': self.bottle_weights.bounds(barcode)[0] if self.bottle_weights.learned(barcode) else None,
+                'color': BATCH_COLORS[len(bottles) % len(BATCH_COLORS)],
+                'target': (drawer_id, drawers[drawer_id]['positions'].pop(0))
+            })
+
+        if not bottles:
+            print("[BATCH] ✗ No empty positions available (online drawers)")
+            self.publish_batch("batch_load_error", {"error": "No empty positions available"})
+            self.batch_load = None
+            return
+
+        session = self.batch_load['session'] = BatchLoadSession(bottles)
+        drawer_ids = session.drawers()
+        self.analytics.begin('batch_load', 'batch_load', next(iter(drawer_ids)) if len(drawer_ids) == 1 else None)
+        for b in bottles:
+            print(f"[BATCH] {b['name'][:30]} → {slot_label(b['target'])} ({b['color']})")
+        if unplaced:
+            print(f"[BATCH] ⚠ No room for {len(unplaced)} bottles")
+        self.publish_batch("batch_load_started", {
+            "bottles": [self.describe_batch_bottle(b) for b in bottles],
+            "unplaced": unplaced
+        })
+        self.show_batch_leds()
+        self.restart_batch_timer()
+        print(f"[BATCH] ═══════════════════════════════\n")
+
+    def describe_batch_bottle(self, bottle):
+        return {"barcode": bottle['barcode'], "name": bottle['name'], "color": bottle['color'],
+                "drawer": bottle['target'][0], "position": bottle['target'][1]}
+
+    def show_batch_leds(self, hold=None):
+        """Pending targets blink in their bottle's colour, placed ones gray, wrong ones red"""
+        session = self.batch_load['session']
+        frames = {drawer_id: {} for drawer_id in session.drawers()}
+        for bottle in session.bottles:
+            drawer_id, position = bottle['target']
+            if bottle['placed'] is None:
+                frames[drawer_id][position] = led(bottle['color'], 100, True)
+            else:
+                frames[drawer_id][position] = led(GRAY, 30)
+        for drawer_id, position in self.batch_load['wrong']:
+            frames.setdefault(drawer_id, {})[position] = led(RED)
+        self.leds.replace('batch_load', {d: [step(leds, hold)] for d, leds in frames.items()})
+
+    def restart_batch_timer(self):
+        if self.batch_load['timer']:
+            self.batch_load['timer'].satisfied()
+        self.batch_load['timer'] = OperationTimer(self.timeouts, 'batch_load', None,
+                                                  self.locked(self.finish_batch_load), ['timeout'])
+        self.batch_load['timer'].start()
+
+    def handle_batch_event(self, drawer_id, position, event, weight):
+        session = self.batch_load['session']
+        slot = (drawer_id, position)
+
+        if event == 'placed':
+            weight = self.load_cells.correct(drawer_id, position, weight)
+            bottle = session.place(slot, weight)
+            if bottle is None:
+                print(f"[BATCH] ✗ Unexpected bottle at {slot_label(slot)} ({weight}g)")
+                self.analytics.wrong('batch_load')
+                self.batch_load['wrong'].add(slot)
+                self.publish_batch("batch_load_error", {
+                    "error": "wrong_position",
+                    "drawer": drawer_id,
+                    "position": position,
+                    "expected": [self.describe_batch_bottle(b) for b in session.pending(drawer_id)]
+                })
+            else:
+                print(f"[BATCH] ✔ {bottle['name'][:30]} at {slot_label(slot)} ({weight}g)")
+                self.publish_batch("batch_bottle_placed", {
+                    **self.describe_batch_bottle(bottle),
+                    "remaining": len(session.pending())
+                })
+                if session.done:
+                    self.finish_batch_load('complete')
+                    return
+                self.restart_batch_timer()
+
+        elif event == 'removed':
+            if slot in self.batch_load['wrong']:
+                self.batch_load['wrong'].discard(slot)
+                print(f"[BATCH] → Bottle removed from wrong position {slot_label(slot)}")
+                self.publish_batch("batch_load_error_cleared", {"drawer": drawer_id, "position": position})
+            else:
+                bottle = session.unplace(slot)
+                if bottle is None:
+                    return
+                print(f"[BATCH] ← {bottle['name'][:30]} taken out of {slot_label(slot)}")
+                self.publish_batch("batch_bottle_removed", self.describe_batch_bottle(bottle))
+
+        self.show_batch_leds()
+
+    def finish_batch_load(self, reason):
+        """
+        End the batch (complete, finished, timeout or cancelled). Bottles
+        already placed are in the fridge either way: all of them are
+        written to the inventory at once.
+        """
+        batch = self.batch_load
+        if not batch:
+            return
+        self.batch_load = None
+        if batch['timer'] and reason == 'complete':
+            batch['timer'].satisfied()
+        elif batch['timer']:
+            batch['timer'].cancel()
+        session = batch['session']
+        placed = session.placed() if session else []
+        missing = session.pending() if session else batch['scanned']
+
+        learned = False
+        now = datetime.now().isoformat()
+        drawers = self.inventory.setdefault("drawers", {})
+        for bottle in placed:
+            drawer_id, position = bottle['target']
+            if self.bottle_weights.observe_placement(bottle['barcode'], bottle['placed']):
+                learned = True
+            drawers.setdefault(drawer_id, {}).setdefault("positions", {})[str(position)] = {
+                "occupied": True,
+                "barcode": bottle['barcode'],
+                "name": bottle['name'],
+                "weight": bottle['placed'],
+                "percentage": self.calculate_bottle_percentage(bottle['placed'], bottle['barcode']),
+                "placed_at": now,
+                "last_update": now
+            }
+        if placed:
+            self.save_inventory()
+            self.history.record('placed', {bottle['target']: drawers[bottle['target'][0]]["positions"][str(bottle['target'][1])]
+                                           for bottle in placed})
+            for bottle in placed:
+                self.occupancy.set_slot(*bottle['target'], True)
+                self.publish_inventory_update(*bottle['target'])
+        if learned:
+            self.bottle_weights.save()
+            self.matcher.dirty = True
+
+        if session:
+            # Gray on placed bottles for 2 seconds, then release
+            self.leds.replace('batch_load', {
+                drawer_id: [step({b['target'][1]: led(GRAY, 30) for b in placed if b['target'][0] == drawer_id}, 2)]
+                for drawer_id in {b['target'][0] for b in placed}
+            })
+        self.analytics.end('batch_load', reason if reason in ('timeout', 'cancelled') else 'completed')
+        print(f"[BATCH] {'✔' if reason == 'complete' else '⚠'} Batch {reason}: "
+              f"{len(placed)} placed, {len(missing)} missing")
+        self.publish_batch("batch_load_timeout" if reason == 'timeout' else "batch_load_completed", {
+            "reason": reason,
+            "placed": [self.describe_batch_bottle(b) for b in placed],
+            "missing": [{"barcode": b['barcode'], "name": b['name']} for b in missing]
+        })
+
+    def start_batch_unload(self, data):
+        """
+        Pick list for several bottles: data['bottles'] = [{'barcode'} or
+        {'drawer', 'position'}] (or plain 'barcodes' / 'slots' lists).
+        """
+        print(f"\n[PICK] ═══════════════════════════════")
+        if self.batch_unload or self.batch_load or self.swap_operations.get('active') \
+                or self.rearrangement or self.pending_operations:
+            print("[PICK] ✗ Another operation is running")
+            self.publish_batch("batch_unload_error", {"error": "Another operation is running"})
+            return
+
+        requests = list(data.get('bottles') or [])
+        requests += [{"barcode": barcode} for barcode in data.get('barcodes') or []]
+        requests += list(data.get('slots') or [])
+
+        bottles = {}
+        for drawer_id in self.topology.functional_drawers:
+            if self.presence.is_offline(drawer_id):
+                continue
+            for pos_str, slot in self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {}).items():
+                if slot.get("occupied"):
+                    bottles[(drawer_id, int(pos_str))] = slot.get("barcode")
+        slots, missing = plan_picks(requests, bottles)
+
+        if not slots:
+            print("[PICK] ✗ None of the bottles is in an online drawer")
+            self.publish_batch("batch_unload_error", {"error": "Bottles not found in inventory", "missing": missing})
+            return
+
+        positions = lambda d: self.inventory["drawers"][d]["positions"]
+        picks = PickList([{"slot": slot, "barcode": positions(slot[0])[str(slot[1])].get("barcode"),
+                           "name": positions(slot[0])[str(slot[1])].get("name")} for slot in slots])
+        self.batch_unload = {'picks': picks, 'wrong': set(), 'timer': None}
+        self.analytics.begin('batch_unload', 'batch_unload', picks.order[0] if len(picks.order) == 1 else None)
+
+        print(f"[PICK] {len(slots)} bottles in {len(picks.order)} drawers: {', '.join(picks.order)}")
+        if missing:
+            print(f"[PICK] ⚠ {len(missing)} not found")
+        self.publish_batch("batch_unload_started", {
+            "drawers": [{"drawer": d, "bottles": [self.describe_pick(p) for p in picks.pending(d)]}
+                        for d in picks.order],
+            "missing": missing
+        })
+        self.show_pick_leds()
+        self.restart_pick_timer()
+        print(f"[PICK] ═══════════════════════════════\n")
+
+    def describe_pick(self, pick):
+        return {"barcode": pick['barcode'], "name": pick['name'],
+                "drawer": pick['slot'][0], "position": pick['slot'][1]}
+
+    def show_pick_leds(self):
+        """Every pick of the current drawer blinks green, wrong removals are red"""
+        picks = self.batch_unload['picks']
+        frames = {}
+        if picks.current:
+            frames[picks.current] = {p['slot'][1]: led(GREEN, 100, True) for p in picks.pending(picks.current)}
+        for drawer_id, position in self.batch_unload['wrong']:
+            frames.setdefault(drawer_id, {})[position] = led(RED)
+        self.leds.replace('batch_unload', {d: [step(leds)] for d, leds in frames.items()})
+
+    def restart_pick_timer(self):
+        if self.batch_unload['timer']:
+            self.batch_unload['timer'].satisfied()
+        self.batch_unload['timer'] = OperationTimer(self.timeouts, 'batch_unload', self.batch_unload['picks'].current,
+                                                    self.locked(self.end_batch_unload), ['timeout'])
+        self.batch_unload['timer'].start()
+
+    def commit_picks(self, picks):
+        """Empty the slots of removed bottles (one inventory write)"""
+        drawers = self.inventory.setdefault("drawers", {})
+        for pick in picks:
+            drawer_id, position = pick['slot']
+            slot = drawers.setdefault(drawer_id, {}).setdefault("positions", {}).get(str(position), {})
+            if slot.get("occupied"):
+                self.matcher.remember(slot.get("barcode"), drawer_id, position, slot.get("weight"))
+            drawers[drawer_id]["positions"][str(position)] = {"occupied": False}
+        self.save_inventory()
+        self.history.record('removed', {pick['slot']: None for pick in picks})
+        for pick in picks:
+            self.occupancy.set_slot(*pick['slot'], False)
+            self.publish_inventory_update(*pick['slot'])
+        print(f"[DB] ✔ Emptied {len(picks)} positions")
+
+    def handle_batch_unload_event(self, drawer_id, position, event):
+        batch = self.batch_unload
+        picks = batch['picks']
+        slot = (drawer_id, position)
+
+        if event == 'removed':
+            pick, finished = picks.remove(slot)
+            if pick is None:
+                occupied = self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {}) \
+                    .get(str(position), {}).get("occupied", False)
+                if not occupied:
+                    return
+                print(f"[PICK] ✗ Wrong bottle removed at {slot_label(slot)}")
+                self.analytics.wrong('batch_unload')
+                batch['wrong'].add(slot)
+                self.publish_batch("batch_unload_error", {
+                    "error": "wrong_bottle_removed",
+                    "drawer": drawer_id,
+                    "position": position,
+                    "expected": [self.describe_pick(p) for p in picks.pending(drawer_id)]
+                })
+            else:
+                print(f"[PICK] ✔ {(pick['name'] or '?')[:30]} out of {slot_label(slot)}")
+                self.publish_batch("batch_bottle_picked", {**self.describe_pick(pick),
+                                                           "remaining": len(picks.pending())})
+                if finished:
+                    drawer_picks = picks.removed(drawer_id)
+                    self.commit_picks(drawer_picks)
+                    print(f"[PICK] ✔ {drawer_id} done" + (f", next {picks.current}" if picks.current else ""))
+                    self.publish_batch("batch_unload_drawer_done", {
+                        "drawer": drawer_id,
+                        "bottles": [self.describe_pick(p) for p in drawer_picks],
+                        "next_drawer": picks.current
+                    })
+                if picks.done:
+                    self.end_batch_unload('complete')
+                    return
+                self.restart_pick_timer()
+
+        elif event == 'placed':
+            if slot in batch['wrong']:
+                batch['wrong'].discard(slot)
+                print(f"[PICK] → Wrong bottle put back at {slot_label(slot)}")
+                self.publish_batch("batch_unload_error_cleared", {"drawer": drawer_id, "position": position})
+            elif picks.put_back(slot):
+                print(f"[PICK] ← Bottle put back at {slot_label(slot)}")
+                self.publish_batch("batch_bottle_returned", {"drawer": drawer_id, "position": position})
+            else:
+                return
+
+        self.show_pick_leds()
+
+    def end_batch_unload(self, reason):
+        """
+        Close the pick list (complete, timeout or cancelled). Bottles already
+        taken from unfinished drawers are written in one go.
+        """
+        batch = self.batch_unload
+        if not batch:
+            return
+        self.batch_unload = None
+        if reason == 'complete':
+            batch['timer'].satisfied()
+        else:
+            batch['timer'].cancel()
+        picks = batch['picks']
+
+        leftover = [p for p in picks.removed() if p['slot'][0] not in picks.committed]
+        if leftover:
+            self.commit_picks(leftover)
+        self.leds.cancel('batch_unload')
+
+        self.analytics.end('batch_unload', reason if reason in ('timeout', 'cancelled') else 'completed')
+        removed = picks.removed()
+        print(f"[PICK] {'✔' if reason == 'complete' else '⚠'} Pick list {reason}: "
+              f"{len(removed)}/{len(picks.picks)} bottles out")
+        self.publish_batch("batch_unload_timeout" if reason == 'timeout' else "batch_unload_completed", {
+            "reason": reason,
+            "removed": [self.describe_pick(p) for p in removed],
+            "remaining": [self.describe_pick(p) for p in picks.pending()]
+        })
+
     def cancel_load(self, data):
         """Cancel an ongoing load operation"""
         barcode = data.get('barcode', 'unknown')
@@ -847,14 +2147,10 @@ class WineFridgeController:
                     op['timer'].cancel()
 
                 # Turn off all LEDs for this operation
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": []},
-                    "timestamp": datetime.now().isoformat()
-                }))
+                self.leds.cancel(op_id)
 
                 # Remove the pending operation
+                self.analytics.end(op_id, 'cancelled')
                 del self.pending_operations[op_id]
                 print(f"[LOAD] ✔ Cancelled operation for {drawer_id} position {position}")
                 cancelled = True
@@ -882,14 +2178,10 @@ class WineFridgeController:
                     op['timer'].cancel()
 
                 # Turn off all LEDs for this operation
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": []},
-                    "timestamp": datetime.now().isoformat()
-                }))
+                self.leds.cancel(op_id)
 
                 # Remove the pending operation
+                self.analytics.end(op_id, 'cancelled')
                 del self.pending_operations[op_id]
                 print(f"[UNLOAD] ✔ Cancelled operation for {drawer_id} position {position}")
                 cancelled = True
@@ -901,7 +2193,7 @@ class WineFridgeController:
         print(f"[UNLOAD] ═══════════════════════════════\n")
 
     def find_bottle_in_inventory(self, barcode):
-        for drawer_id in FUNCTIONAL_DRAWERS:
+        for drawer_id in self.topology.functional_drawers:
             if drawer_id in self.inventory.get("drawers", {}):
                 drawer_data = self.inventory["drawers"][drawer_id]
                 for position, pos_data in drawer_data.get("positions", {}).items():
@@ -922,17 +2214,39 @@ class WineFridgeController:
         event = data.get('event')
         position = data.get('position')
         weight = data.get('weight', 0)
+        if event in ('placed', 'removed'):
+            self.analytics.mark(drawer_id, 'first_event')
+        if data.get('implausible'):
+            print(f"[DEBOUNCE] ⚠ {drawer_id} pos {position}: implausible weight {weight}g")
 
         # Process SWAP operations (highest priority)
         if self.swap_operations.get('active'):
             self.handle_swap_event(drawer_id, position, event, weight)
             return
 
+        if self.rearranging(drawer_id):
+            self.handle_rearrange_event(drawer_id, position, event)
+            return
+
+        if self.batch_loading(drawer_id) and isinstance(position, int):
+            self.handle_batch_event(drawer_id, position, event, weight)
+            return
+
+        if self.batch_unloading(drawer_id) and isinstance(position, int):
+            self.handle_batch_unload_event(drawer_id, position, event)
+            return
+
         # Check if there's any active LOAD/UNLOAD operation
         has_active_operation = len(self.pending_operations) > 0
 
-        # If no active operation, ignore all bottle events (ESP32 might be re-detecting existing bottles)
+        # No active operation: only check the event against the inventory
+        # (re-detected bottles match it and are ignored)
         if not has_active_operation:
+            if event in ('placed', 'removed') and isinstance(position, int):
+                self.reload_inventory_if_changed()
+                removed, unknown = self.occupancy.observe_position(drawer_id, position, event == 'placed')
+                sensed = weight if event == 'placed' and not data.get('implausible') else None
+                self.publish_occupancy_mismatches(drawer_id, removed, unknown, sensed)
             return
 
         # Process LOAD/UNLOAD operations
@@ -946,6 +2260,7 @@ class WineFridgeController:
         # Only process if there's an active operation
         if not self.pending_operations:
             return
+        self.analytics.mark(drawer_id, 'first_event')
 
         data = message.get('data', {})
         position = data.get('position')
@@ -968,6 +2283,7 @@ class WineFridgeController:
                     op['wrong_positions'] = []
                 if position not in op['wrong_positions']:
                     op['wrong_positions'].append(position)
+                self.analytics.wrong(op_id)
 
                 # Notify frontend
                 self.client.publish("winefridge/system/status", json.dumps({
@@ -982,409 +2298,189 @@ class WineFridgeController:
                 }))
 
                 # Update LEDs: GREEN BLINKING on correct position + RED SOLID on wrong positions
-                led_positions = [{
-                    "position": expected_position,
-                    "color": "#00FF00",
-                    "brightness": 100,
-                    "blink": True
-                }]
-
-                for wrong_pos in op['wrong_positions']:
-                    led_positions.append({
-                        "position": wrong_pos,
-                        "color": "#FF0000",
-                        "brightness": 100,
-                        "blink": False
-                    })
-
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": led_positions},
-                    "timestamp": datetime.now().isoformat()
-                }))
+                leds = {wrong_pos: led(RED) for wrong_pos in op['wrong_positions']}
+                leds[expected_position] = led(GREEN, 100, True)
+                self.leds.play(op_id, drawer_id, [step(leds)])
 
                 print(f"[LOAD] → LED: Red solid at {position}, Green blinking at {expected_position}")
                 break
 
-    def handle_swap_event(self, drawer_id, position, event, weight):
-        """Handle events during swap operation"""
-        if event == 'removed':
-            # Primero verificar si es una posición incorrecta registrada
-            wrong_positions = self.swap_operations.get('wrong_positions', [])
-            wrong_pos_info = next((wp for wp in wrong_positions if wp['drawer'] == drawer_id and wp['position'] == position), None)
-
-            if wrong_pos_info and len(self.swap_operations['bottles_to_place']) > 0:
-                # Botella levantada de posición incorrecta - limpiar LED rojo
-                print(f"[SWAP] → Bottle removed from wrong position {position}, clearing red LED")
-                wrong_positions.remove(wrong_pos_info)
-
-                # NO ACTUALIZAR INVENTARIO - nunca fue actualizado al colocar incorrectamente
-
-                # Notify frontend to close error modal
-                self.client.publish("winefridge/system/status", json.dumps({
-                    "action": "wrong_swap_bottle_removed",
-                    "source": "mqtt_handler",
-                    "data": {
-                        "drawer": drawer_id,
-                        "position": position
-                    },
-                    "timestamp": datetime.now().isoformat()
-                }))
+    def show_rearrange_leds(self, op_id, session, placed, hold=None):
+        """
+        Compose the LEDs of a rearrangement over every involved drawer:
+        gray on completed placements, yellow on bottles still to move,
+        green blinking where the next event is expected, red on wrong ones.
+        """
+        frames = {}
+
+        def put(slot, state):
+            frames.setdefault(slot[0], {})[slot[1]] = state
+
+        for slot in placed:
+            put(slot, led(GRAY, 30))
+        for slot in session.pending_sources():
+            put(slot, led(YELLOW))
+        for slot in session.expected():
+            put(slot, led(GREEN, 100, True))
+        for slot in session.wrong:
+            put(slot, led(RED))
+
+        self.leds.replace(op_id, {drawer: [step(leds, hold)] for drawer, leds in frames.items()})
+
+    def show_swap_leds(self, hold=None):
+        """Yellow on removed bottles until both are out, then the placement session"""
+        session = self.swap_operations.get('session')
+        if session is not None:
+            self.show_rearrange_leds('swap', session, self.swap_operations.get('placed', []), hold)
+            return
+        frames = {}
+        for bottle in self.swap_operations.get('bottles_removed', []):
+            frames.setdefault(bottle['drawer'], {})[bottle['position']] = led(YELLOW)
+        self.leds.replace('swap', {drawer: [step(leds, hold)] for drawer, leds in frames.items()})
 
-                # Actualizar LEDs: verde parpadeando en PRIMERA posición, amarillo en SEGUNDA
-                target_1 = self.swap_operations['bottles_to_place'][0]
-                target_2 = self.swap_operations['bottles_to_place'][1]
-
-                # LEDs rojos en posiciones incorrectas restantes
-                remaining_wrong = [wp for wp in wrong_positions if wp['drawer'] == drawer_id]
-
-                # Construir comando LED para cada drawer
-                drawers_to_update = set([target_1['target_drawer'], target_2['target_drawer']])
-                if remaining_wrong:
-                    drawers_to_update.add(drawer_id)
-
-                for update_drawer in drawers_to_update:
-                    led_positions = []
-
-                    # LED verde parpadeando en primera posición
-                    if target_1['target_drawer'] == update_drawer:
-                        led_positions.append({
-                            "position": target_1['target_position'],
-                            "color": "#00FF00",
-                            "brightness": 100,
-                            "blink": True
-                        })
-
-                    # LED amarillo en segunda posición
-                    if target_2['target_drawer'] == update_drawer:
-                        led_positions.append({
-                            "position": target_2['target_position'],
-                            "color": "#FFFF00",
-                            "brightness": 100
-                        })
-
-                    # LEDs rojos en posiciones incorrectas
-                    for wrong_pos in remaining_wrong:
-                        if wrong_pos['drawer'] == update_drawer:
-                            led_positions.append({
-                                "position": wrong_pos['position'],
-                                "color": "#FF0000",
-                                "brightness": 100,
-                                "blink": False
-                            })
-
-                    if led_positions:
-                        self.client.publish(f"winefridge/{update_drawer}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": led_positions},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-
-                print(f"[SWAP] → LED: Green blinking at {target_1['target_drawer']}:{target_1['target_position']}, Yellow at {target_2['target_drawer']}:{target_2['target_position']}")
-                return  # Salir temprano, no procesar como botella del inventario
-
-            # Si no es posición incorrecta, procesar como botella del inventario
-            bottle_info = None
-            if drawer_id in self.inventory.get("drawers", {}):
-                pos_data = self.inventory["drawers"][drawer_id].get("positions", {}).get(str(position))
-                if pos_data and pos_data.get("occupied"):
-                    bottle_info = {
-                        'drawer': drawer_id,
-                        'position': position,
-                        'barcode': pos_data.get('barcode'),
-                        'name': pos_data.get('name'),
-                        'weight': pos_data.get('weight', 0)
-                    }
+    def handle_swap_event(self, drawer_id, position, event, weight):
+        """
+        Handle events during swap operation: collect the two removed
+        bottles, then place them crosswise as a rearrangement session
+        (both put-backs accepted in either order).
+        """
+        session = self.swap_operations.get('session')
+        slot = (drawer_id, position)
 
-            if bottle_info:
-                already_removed = any(b['drawer'] == drawer_id and b['position'] == position
-                                      for b in self.swap_operations['bottles_removed'])
+        if session is None:
+            if event != 'removed':
+                return
+            pos_data = self.inventory.get("drawers", {}).get(drawer_id, {}).get("positions", {}).get(str(position))
+            if not pos_data or not pos_data.get("occupied"):
+                return
+            if any(b['drawer'] == drawer_id and b['position'] == position
+                   for b in self.swap_operations['bottles_removed']):
+                return
 
-                if not already_removed:
-                    self.swap_operations['bottles_removed'].append(bottle_info)
-                    bottle_num = len(self.swap_operations['bottles_removed'])
-                    print(f"[SWAP] Bottle {bottle_num} removed: {bottle_info['name'][:40]}")
+            bottle_info = {
+                'drawer': drawer_id,
+                'position': position,
+                'barcode': pos_data.get('barcode'),
+                'name': pos_data.get('name'),
+                'weight': pos_data.get('weight', 0),
+                'slot': dict(pos_data)
+            }
+            self.swap_operations['bottles_removed'].append(bottle_info)
+            bottle_num = len(self.swap_operations['bottles_removed'])
+            print(f"[SWAP] Bottle {bottle_num} removed: {bottle_info['name'][:40]}")
 
-                    # LED amarillo en posición de donde se retiró
-                    self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                        "action": "set_leds",
-                        "source": "mqtt_handler",
-                        "data": {"positions": [{"position": position, "color": "#FFFF00", "brightness": 100}]},
-                        "timestamp": datetime.now().isoformat()
-                    }))
+            self.client.publish("winefridge/system/status", json.dumps({
+                "action": "bottle_event",
+                "source": "mqtt_handler",
+                "data": {
+                    "event": "removed",
+                    "drawer": drawer_id,
+                    "position": position
+                },
+                "timestamp": datetime.now().isoformat()
+            }))
 
+            # Cuando se retiran 2 botellas, preparar intercambio
+            if bottle_num == 2:
+                print("[SWAP] Both bottles removed, ready for swap placement")
+                first, second = [(b['drawer'], b['position']) for b in self.swap_operations['bottles_removed']]
+                self.swap_operations['session'] = RearrangeSession(put_back({first: second, second: first}))
+
+                # Iniciar timer (límite aprendido por tipo de operación)
+                def swap_timeout():
+                    print("[SWAP] ⏱ Timeout! Cancelling swap operation")
+                    self.analytics.end('swap', 'timeout')
+                    self.cancel_swap()
                     self.client.publish("winefridge/system/status", json.dumps({
-                        "action": "bottle_event",
+                        "action": "swap_timeout",
                         "source": "mqtt_handler",
-                        "data": {
-                            "event": "removed",
-                            "drawer": drawer_id,
-                            "position": position
-                        },
                         "timestamp": datetime.now().isoformat()
                     }))
 
-                    # Cuando se retiran 2 botellas, preparar intercambio
-                    if len(self.swap_operations['bottles_removed']) == 2:
-                        print("[SWAP] Both bottles removed, ready for swap placement")
-                        bottle1 = self.swap_operations['bottles_removed'][0]
-                        bottle2 = self.swap_operations['bottles_removed'][1]
-
-                        self.swap_operations['bottles_to_place'] = [
-                            {'bottle': bottle1, 'target_drawer': bottle2['drawer'], 'target_position': bottle2['position']},
-                            {'bottle': bottle2, 'target_drawer': bottle1['drawer'], 'target_position': bottle1['position']}
-                        ]
-
-                        # Inicializar tracking de posiciones incorrectas
-                        self.swap_operations['wrong_positions'] = []
-
-                        # Iniciar timer de 60 segundos
-                        def swap_timeout():
-                            print("[SWAP] ⏱ Timeout! Cancelling swap operation")
-                            self.cancel_swap()
-                            self.client.publish("winefridge/system/status", json.dumps({
-                                "action": "swap_timeout",
-                                "source": "mqtt_handler",
-                                "timestamp": datetime.now().isoformat()
-                            }))
-
-                        self.swap_operations['timer'] = threading.Timer(60.0, swap_timeout)
-                        self.swap_operations['timer'].start()
-                        print("[SWAP] ⏱ Timeout timer started (60s)")
-
-                        # Actualizar LEDs: 1ª posición verde parpadeando, 2ª amarillo
-                        target_1 = self.swap_operations['bottles_to_place'][0]
-                        target_2 = self.swap_operations['bottles_to_place'][1]
-
-                        if target_1['target_drawer'] == target_2['target_drawer']:
-                            self.client.publish(f"winefridge/{target_1['target_drawer']}/command", json.dumps({
-                                "action": "set_leds",
-                                "source": "mqtt_handler",
-                                "data": {"positions": [
-                                    {"position": target_1['target_position'], "color": "#00FF00", "brightness": 100, "blink": True},
-                                    {"position": target_2['target_position'], "color": "#FFFF00", "brightness": 100}
-                                ]},
-                                "timestamp": datetime.now().isoformat()
-                            }))
-                        else:
-                            self.client.publish(f"winefridge/{target_1['target_drawer']}/command", json.dumps({
-                                "action": "set_leds",
-                                "source": "mqtt_handler",
-                                "data": {"positions": [
-                                    {"position": target_1['target_position'], "color": "#00FF00", "brightness": 100, "blink": True}
-                                ]},
-                                "timestamp": datetime.now().isoformat()
-                            }))
-                            self.client.publish(f"winefridge/{target_2['target_drawer']}/command", json.dumps({
-                                "action": "set_leds",
-                                "source": "mqtt_handler",
-                                "data": {"positions": [
-                                    {"position": target_2['target_position'], "color": "#FFFF00", "brightness": 100}
-                                ]},
-                                "timestamp": datetime.now().isoformat()
-                            }))
-
-        elif event == 'placed' and len(self.swap_operations['bottles_to_place']) > 0:
-            # Verificar si es la posición correcta
-            target_info = None
-            target_idx = -1
-
-            for i, target in enumerate(self.swap_operations['bottles_to_place']):
-                if target['target_drawer'] == drawer_id and target['target_position'] == position:
-                    target_info = target
-                    target_idx = i
-                    break
+                self.swap_operations['timer'] = OperationTimer(self.timeouts, 'swap', None, self.locked(swap_timeout))
+                self.swap_operations['timer'].start()
+                print(f"[SWAP] ⏱ Timeout timer started ({self.swap_operations['timer'].interval}s)")
 
-            if target_info:
-                # Colocación correcta - usar peso original del inventario, NO pesar de nuevo
-                print(f"[SWAP] ✔ Placed: {target_info['bottle']['name'][:40]} in correct position")
-
-                # Limpiar LEDs rojos de posiciones incorrectas si había
-                wrong_positions = self.swap_operations.get('wrong_positions', [])
-                if wrong_positions:
-                    print(f"[SWAP] → Clearing red LEDs from wrong positions: {wrong_positions}")
-                    for wrong_pos_info in wrong_positions:
-                        self.client.publish(f"winefridge/{wrong_pos_info['drawer']}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": []},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-                    self.swap_operations['wrong_positions'] = []
-
-                # Actualizar inventario con peso ORIGINAL de la botella (no pesar de nuevo)
-                original_weight = target_info['bottle']['weight']
-                print(f"[SWAP] → Using original weight from inventory: {original_weight}g (not re-weighing)")
+            # Amarillo en posiciones retiradas; con 2 botellas, verde
+            # parpadeando en ambos destinos
+            self.show_swap_leds()
+            return
 
-                self.update_inventory(
-                    drawer_id,
-                    position,
-                    target_info['bottle']['barcode'],
-                    target_info['bottle']['name'],
-                    original_weight  # Usar peso original, no el peso medido
-                )
+        # Placement phase: only placements and lifting a misplaced bottle count
+        if event == 'removed' and session.wrong.get(slot) != 'placed':
+            return
+        expected_positions = [p for d, p in session.expected() if d == drawer_id]
+        if event == 'placed' and not expected_positions:
+            return  # Not a swap drawer
 
-                self.swap_operations['bottles_to_place'].pop(target_idx)
-
-                if len(self.swap_operations['bottles_to_place']) == 1:
-                    # Queda 1 botella por colocar
-                    remaining_target = self.swap_operations['bottles_to_place'][0]
-                    print(f"[SWAP] Ready for final placement: {remaining_target['bottle']['name'][:40]}")
-
-                    # Construir comando LED completo para cada drawer
-                    if drawer_id == remaining_target['target_drawer']:
-                        # Ambas posiciones en el mismo drawer: gris + verde parpadeando
-                        self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": [
-                                {"position": position, "color": "#808080", "brightness": 30},
-                                {"position": remaining_target['target_position'], "color": "#00FF00", "brightness": 100, "blink": True}
-                            ]},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-                    else:
-                        # Posiciones en drawers diferentes
-                        self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": [{"position": position, "color": "#808080", "brightness": 30}]},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-                        self.client.publish(f"winefridge/{remaining_target['target_drawer']}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": [
-                                {"position": remaining_target['target_position'], "color": "#00FF00", "brightness": 100, "blink": True}
-                            ]},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-
-                elif len(self.swap_operations['bottles_to_place']) == 0:
-                    # Swap completado
-                    print("[SWAP] ✔ Swap complete!")
-
-                    # Cancelar timer
-                    if 'timer' in self.swap_operations and self.swap_operations['timer']:
-                        self.swap_operations['timer'].cancel()
-
-                    # Guardar información de las botellas antes de resetear
-                    bottle1 = self.swap_operations['bottles_removed'][0]
-                    bottle2 = self.swap_operations['bottles_removed'][1]
-
-                    # Obtener las posiciones finales (intercambiadas)
-                    final_pos_1 = {'drawer': bottle2['drawer'], 'position': bottle2['position']}
-                    final_pos_2 = {'drawer': bottle1['drawer'], 'position': bottle1['position']}
-
-                    # Enviar LEDs grises en ambas posiciones momentáneamente
-                    if final_pos_1['drawer'] == final_pos_2['drawer']:
-                        # Mismo drawer: enviar ambos LEDs grises juntos
-                        self.client.publish(f"winefridge/{final_pos_1['drawer']}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": [
-                                {"position": final_pos_1['position'], "color": "#808080", "brightness": 30},
-                                {"position": final_pos_2['position'], "color": "#808080", "brightness": 30}
-                            ]},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-                    else:
-                        # Drawers diferentes: enviar a cada uno
-                        self.client.publish(f"winefridge/{final_pos_1['drawer']}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": [{"position": final_pos_1['position'], "color": "#808080", "brightness": 30}]},
-                            "timestamp": datetime.now().isoformat()
-                        }))
-                        self.client.publish(f"winefridge/{final_pos_2['drawer']}/command", json.dumps({
-                            "action": "set_leds",
-                            "source": "mqtt_handler",
-                            "data": {"positions": [{"position": final_pos_2['position'], "color": "#808080", "brightness": 30}]},
-                            "timestamp": datetime.now().isoformat()
-                        }))
+        outcome, move = session.event(event, slot)
 
-                    self.client.publish("winefridge/system/status", json.dumps({
-                        "action": "swap_completed",
-                        "source": "mqtt_handler",
-                        "data": {"success": True},
-                        "timestamp": datetime.now().isoformat()
-                    }))
+        if outcome == 'cleared':
+            # Botella levantada de posición incorrecta - limpiar LED rojo
+            print(f"[SWAP] → Bottle removed from wrong position {position}, clearing red LED")
+            self.client.publish("winefridge/system/status", json.dumps({
+                "action": "wrong_swap_bottle_removed",
+                "source": "mqtt_handler",
+                "data": {
+                    "drawer": drawer_id,
+                    "position": position
+                },
+                "timestamp": datetime.now().isoformat()
+            }))
+            self.show_swap_leds()
 
-                    self.swap_operations = {'active': False, 'bottles_removed': [], 'bottles_to_place': [], 'start_time': None}
-
-                    # Apagar LEDs de ambos drawers después de 1 segundo
-                    def turn_off_leds():
-                        time.sleep(1)
-                        drawers_to_clear = set([final_pos_1['drawer'], final_pos_2['drawer']])
-                        for drawer in drawers_to_clear:
-                            self.client.publish(f"winefridge/{drawer}/command", json.dumps({
-                                "action": "set_leds",
-                                "source": "mqtt_handler",
-                                "data": {"positions": []},
-                                "timestamp": datetime.now().isoformat()
-                            }))
-                    threading.Thread(target=turn_off_leds).start()
-            else:
-                # Colocación incorrecta - detectar posiciones esperadas
-                expected_positions = [t['target_position'] for t in self.swap_operations['bottles_to_place'] if t['target_drawer'] == drawer_id]
-                if expected_positions:
-                    print(f"[SWAP] ✗ Wrong placement! Expected positions: {expected_positions}, got {position}")
-
-                    # Registrar posición incorrecta CON EL PESO (para detectar 'removed' después)
-                    wrong_pos_info = {'drawer': drawer_id, 'position': position, 'weight': weight}
-                    if 'wrong_positions' not in self.swap_operations:
-                        self.swap_operations['wrong_positions'] = []
-                    if not any(wp['drawer'] == drawer_id and wp['position'] == position for wp in self.swap_operations['wrong_positions']):
-                        self.swap_operations['wrong_positions'].append(wrong_pos_info)
-
-                    # NO ACTUALIZAR INVENTARIO - solo registrar en memoria
-                    print(f"[SWAP] → Registered wrong position {drawer_id} pos {position} (weight: {weight}g) WITHOUT updating inventory")
-
-                    # Notificar frontend
-                    self.client.publish("winefridge/system/status", json.dumps({
-                        "action": "swap_error",
-                        "source": "mqtt_handler",
-                        "data": {
-                            "error": "wrong_swap_position",
-                            "drawer": drawer_id,
-                            "wrong_position": position,
-                            "expected_positions": expected_positions
-                        },
-                        "timestamp": datetime.now().isoformat()
-                    }))
+        elif outcome == 'wrong':
+            # NO ACTUALIZAR INVENTARIO - solo registrar en memoria
+            print(f"[SWAP] ✗ Wrong placement! Expected positions: {expected_positions}, got {position} "
+                  f"({weight}g) - inventory untouched")
+            self.analytics.wrong('swap')
+            self.client.publish("winefridge/system/status", json.dumps({
+                "action": "swap_error",
+                "source": "mqtt_handler",
+                "data": {
+                    "error": "wrong_swap_position",
+                    "drawer": drawer_id,
+                    "wrong_position": position,
+                    "expected_positions": expected_positions
+                },
+                "timestamp": datetime.now().isoformat()
+            }))
+            self.show_swap_leds()
+
+        elif outcome == 'moved':
+            # Colocación correcta - datos originales del inventario, NO pesar de nuevo
+            bottle = next(b for b in self.swap_operations['bottles_removed']
+                          if (b['drawer'], b['position']) == move['origin'])
+            print(f"[SWAP] ✔ Placed: {bottle['name'][:40]} in correct position "
+                  f"(original weight {bottle['weight']}g)")
+            if session.wrong:
+                print(f"[SWAP] → Clearing red LEDs from wrong positions: {sorted(session.wrong)}")
+                session.wrong.clear()
+
+            self.commit_move(move, bottle['slot'], 'swapped')
+            self.swap_operations.setdefault('placed', []).append(slot)
+
+            if not session.done:
+                print(f"[SWAP] Ready for final placement")
+                self.show_swap_leds()
+                return
 
-                    # Actualizar LEDs: rojo fijo en posición incorrecta + verde parpadeando en correcta
-                    led_positions = []
-
-                    # LED verde parpadeando en posiciones esperadas
-                    for exp_pos in expected_positions:
-                        led_positions.append({
-                            "position": exp_pos,
-                            "color": "#00FF00",
-                            "brightness": 100,
-                            "blink": True
-                        })
-
-                    # LED rojo fijo en posiciones incorrectas
-                    for wrong_pos in self.swap_operations.get('wrong_positions', []):
-                        if wrong_pos['drawer'] == drawer_id:
-                            led_positions.append({
-                                "position": wrong_pos['position'],
-                                "color": "#FF0000",
-                                "brightness": 100,
-                                "blink": False
-                            })
-
-                    self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                        "action": "set_leds",
-                        "source": "mqtt_handler",
-                        "data": {"positions": led_positions},
-                        "timestamp": datetime.now().isoformat()
-                    }))
+            print("[SWAP] ✔ Swap complete!")
+            if self.swap_operations.get('timer'):
+                self.swap_operations['timer'].satisfied()
 
-                    print(f"[SWAP] → LED: Red solid at position {position}, Green blinking at {expected_positions}")
+            # LEDs grises en ambas posiciones durante 1 segundo, luego apagar
+            self.show_swap_leds(hold=1)
+            self.analytics.end('swap', 'completed')
+
+            self.client.publish("winefridge/system/status", json.dumps({
+                "action": "swap_completed",
+                "source": "mqtt_handler",
+                "data": {"success": True},
+                "timestamp": datetime.now().isoformat()
+            }))
+
+            self.swap_operations = {'active': False, 'bottles_removed': [], 'session': None, 'start_time': None}
 
     def handle_bottle_placed(self, drawer_id, position, weight):
         """Handle 'placed' event during active LOAD operations"""
@@ -1393,7 +2489,11 @@ class WineFridgeController:
         if op and op['type'] == 'load':
             print(f"[LOAD] ✔ Bottle placed in correct slot")
 
-            op['timer'].cancel()
+            op['timer'].satisfied()
+            weight = self.load_cells.correct(drawer_id, position, weight)
+            if self.bottle_weights.observe_placement(op['barcode'], weight):
+                self.bottle_weights.save()
+                self.matcher.dirty = True
             self.update_inventory(drawer_id, position, op['barcode'], op['name'], weight)
 
             self.client.publish("winefridge/system/status", json.dumps({
@@ -1407,47 +2507,16 @@ class WineFridgeController:
                 "timestamp": datetime.now().isoformat()
             }))
 
-            # Turn off all wrong position LEDs (if any) and set correct position to gray
+            # Drop wrong position LEDs (if any), gray on the correct position
+            # for 2 seconds, then release the drawer
             wrong_positions = op.get('wrong_positions', [])
-            led_positions = []
-
-            # Clear wrong positions
-            for wrong_pos in wrong_positions:
-                led_positions.append({
-                    "position": wrong_pos,
-                    "color": "#000000",
-                    "brightness": 0
-                })
-
-            # Set correct position to gray
-            led_positions.append({
-                "position": position,
-                "color": "#808080",
-                "brightness": 30
-            })
-
-            self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                "action": "set_leds",
-                "source": "mqtt_handler",
-                "data": {"positions": led_positions},
-                "timestamp": datetime.now().isoformat()
-            }))
+            self.leds.play(op_id, drawer_id, [step({position: led(GRAY, 30)}, 2)])
 
             if wrong_positions:
                 print(f"[LOAD] → Cleared red LEDs from wrong positions: {wrong_positions}")
 
+            self.analytics.end(op_id, 'completed')
             del self.pending_operations[op_id]
-
-            # Fade out LEDs after 2 seconds
-            def fade_out():
-                time.sleep(2)
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": []},
-                    "timestamp": datetime.now().isoformat()
-                }))
-            threading.Thread(target=fade_out).start()
             return
 
         # Case 2: Bottle placed back in wrong position during UNLOAD operation
@@ -1470,36 +2539,10 @@ class WineFridgeController:
                     }))
 
                     # Update LEDs: GREEN BLINKING on correct + GRAY on replaced + RED SOLID on remaining wrong positions
-                    led_positions = [{
-                        "position": existing_op['position'],
-                        "color": "#00FF00",
-                        "brightness": 100,
-                        "blink": True
-                    }]
-
-                    # Set gray LED on the position where bottle was placed back
-                    led_positions.append({
-                        "position": position,
-                        "color": "#808080",
-                        "brightness": 30,
-                        "blink": False
-                    })
-
-                    # Red LEDs on remaining wrong positions
-                    for wrong_pos in wrong_positions:
-                        led_positions.append({
-                            "position": wrong_pos,
-                            "color": "#FF0000",
-                            "brightness": 100,
-                            "blink": False
-                        })
-
-                    self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                        "action": "set_leds",
-                        "source": "mqtt_handler",
-                        "data": {"positions": led_positions},
-                        "timestamp": datetime.now().isoformat()
-                    }))
+                    leds = {wrong_pos: led(RED) for wrong_pos in wrong_positions}
+                    leds[position] = led(GRAY, 30)
+                    leds[existing_op['position']] = led(GREEN, 100, True)
+                    self.leds.play(existing_op_id, drawer_id, [step(leds)])
                     return
 
     def handle_bottle_removed(self, drawer_id, position):
@@ -1510,7 +2553,7 @@ class WineFridgeController:
         if op and op['type'] == 'unload':
             print(f"[UNLOAD] ✔ Bottle removed from correct slot")
 
-            op['timer'].cancel()
+            op['timer'].satisfied()
             self.update_inventory(drawer_id, position, None, None, 0, occupied=False)
 
             self.client.publish("winefridge/system/status", json.dumps({
@@ -1524,35 +2567,13 @@ class WineFridgeController:
                 "timestamp": datetime.now().isoformat()
             }))
 
-            # First, explicitly turn off wrong position LEDs (if any)
+            # Release this operation's LEDs (wrong position reds included)
             wrong_positions = op.get('wrong_positions', [])
-            led_positions = []
-
-            # Clear wrong positions explicitly with brightness=0
-            for wrong_pos in wrong_positions:
-                led_positions.append({
-                    "position": wrong_pos,
-                    "color": "#000000",
-                    "brightness": 0
-                })
-
-            if led_positions:
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": led_positions},
-                    "timestamp": datetime.now().isoformat()
-                }))
+            self.leds.cancel(op_id)
+            if wrong_positions:
                 print(f"[UNLOAD] → Cleared red LEDs from wrong positions: {wrong_positions}")
 
-            # Then turn off all LEDs
-            self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                "action": "set_leds",
-                "source": "mqtt_handler",
-                "data": {"positions": []},
-                "timestamp": datetime.now().isoformat()
-            }))
-
+            self.analytics.end(op_id, 'completed')
             del self.pending_operations[op_id]
             return
 
@@ -1566,6 +2587,7 @@ class WineFridgeController:
                     existing_op['wrong_positions'] = []
                 if position not in existing_op['wrong_positions']:
                     existing_op['wrong_positions'].append(position)
+                self.analytics.wrong(existing_op_id)
 
                 # Notify frontend
                 self.client.publish("winefridge/system/status", json.dumps({
@@ -1580,27 +2602,9 @@ class WineFridgeController:
                 }))
 
                 # Update LEDs: GREEN BLINKING on correct + RED SOLID on wrong positions
-                led_positions = [{
-                    "position": existing_op['position'],
-                    "color": "#00FF00",
-                    "brightness": 100,
-                    "blink": True
-                }]
-
-                for wrong_pos in existing_op['wrong_positions']:
-                    led_positions.append({
-                        "position": wrong_pos,
-                        "color": "#FF0000",
-                        "brightness": 100,
-                        "blink": False
-                    })
-
-                self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                    "action": "set_leds",
-                    "source": "mqtt_handler",
-                    "data": {"positions": led_positions},
-                    "timestamp": datetime.now().isoformat()
-                }))
+                leds = {wrong_pos: led(RED) for wrong_pos in existing_op['wrong_positions']}
+                leds[existing_op['position']] = led(GREEN, 100, True)
+                self.leds.play(existing_op_id, drawer_id, [step(leds)])
 
                 print(f"[UNLOAD] → LED: Red solid at {position}, Green blinking at {existing_op['position']}")
                 return
@@ -1614,27 +2618,9 @@ class WineFridgeController:
                     wrong_positions.remove(position)
 
                     # Update LEDs: GREEN BLINKING on correct + RED SOLID on remaining wrong positions
-                    led_positions = [{
-                        "position": existing_op['position'],
-                        "color": "#00FF00",
-                        "brightness": 100,
-                        "blink": True
-                    }]
-
-                    for wrong_pos in wrong_positions:
-                        led_positions.append({
-                            "position": wrong_pos,
-                            "color": "#FF0000",
-                            "brightness": 100,
-                            "blink": False
-                        })
-
-                    self.client.publish(f"winefridge/{drawer_id}/command", json.dumps({
-                        "action": "set_leds",
-                        "source": "mqtt_handler",
-                        "data": {"positions": led_positions},
-                        "timestamp": datetime.now().isoformat()
-                    }))
+                    leds = {wrong_pos: led(RED) for wrong_pos in wrong_positions}
+                    leds[existing_op['position']] = led(GREEN, 100, True)
+                    self.leds.play(existing_op_id, drawer_id, [step(leds)])
                     return
 
     def find_pending_op(self, drawer_id, position):
@@ -1654,12 +2640,7 @@ class WineFridgeController:
 
             print(f"[{op_type.upper()}] ✗ Timeout for {drawer} pos {position}")
 
-            self.client.publish(f"winefridge/{drawer}/command", json.dumps({
-                "action": "set_leds",
-                "source": "mqtt_handler",
-                "data": {"positions": []},
-                "timestamp": datetime.now().isoformat()
-            }))
+            self.leds.cancel(op_id)
 
             self.client.publish("winefridge/system/status", json.dumps({
                 "action": f"{op_type}_timeout",
@@ -1668,10 +2649,11 @@ class WineFridgeController:
                 "timestamp": datetime.now().isoformat()
             }))
 
+            self.analytics.end(op_id, 'timeout')
             del self.pending_operations[op_id]
 
-    def update_inventory(self, drawer_id, position, barcode, name, weight, occupied=True):
-        """Update the inventory.json file"""
+    def update_inventory(self, drawer_id, position, barcode, name, weight, occupied=True, kind=None):
+        """Update the inventory.json file (kind: history event, placed/removed by default)"""
         print(f"[DB] Updating {drawer_id} pos {position}...")
 
         if "drawers" not in self.inventory:
@@ -1684,30 +2666,54 @@ class WineFridgeController:
         position_str = str(position)
 
         if occupied:
-            percentage = self.calculate_bottle_percentage(weight)
+            percentage = self.calculate_bottle_percentage(weight, barcode)
             self.inventory["drawers"][drawer_id]["positions"][position_str] = {
                 "occupied": True,
                 "barcode": barcode,
                 "name": name,
                 "weight": weight,
                 "percentage": percentage,
+                "placed_at": datetime.now().isoformat(),
                 "last_update": datetime.now().isoformat()
             }
             print(f"[DB] ✔ Occupied by {name[:30]} ({weight}g, {percentage}%)")
         else:
             if position_str in self.inventory["drawers"][drawer_id]["positions"]:
+                slot = self.inventory["drawers"][drawer_id]["positions"][position_str]
+                if slot.get("occupied"):
+                    self.matcher.remember(slot.get("barcode"), drawer_id, position, slot.get("weight"))
                 self.inventory["drawers"][drawer_id]["positions"][position_str] = {
                     "occupied": False
                 }
                 print(f"[DB] ✔ Emptied")
 
-        self.save_json('/home/plasticlab/WineFridge/RPI/database/inventory.json', self.inventory)
+        self.save_inventory()
+        self.history.record(kind or ('placed' if occupied else 'removed'),
+                            {(drawer_id, position): self.inventory["drawers"][drawer_id]["positions"].get(position_str)})
+        self.occupancy.set_slot(drawer_id, position, occupied)
+        self.publish_inventory_update(drawer_id, position)
+
+    def commit_move(self, move, bottle, kind='moved'):
+        """Write one completed move of a swap/rearrangement (single save)"""
+        drawers = self.inventory.setdefault("drawers", {})
+        changed = []
+        if move['from'] is not HAND:
+            drawer_id, position = move['from']
+            drawers.setdefault(drawer_id, {}).setdefault("positions", {})[str(position)] = {"occupied": False}
+            changed.append((drawer_id, position, False))
+        if move['to'] is not HAND:
+            drawer_id, position = move['to']
+            drawers.setdefault(drawer_id, {}).setdefault("positions", {})[str(position)] = {
+                **bottle, "occupied": True, "last_update": datetime.now().isoformat()
+            }
+            changed.append((drawer_id, position, True))
+        print(f"[DB] Moved {(bottle.get('name') or '?')[:30]}: {slot_label(move['from'])} → {slot_label(move['to'])}")
 
-        self.client.publish("winefridge/system/status", json.dumps({
-            "action": "inventory_updated",
-            "source": "mqtt_handler",
-            "timestamp": datetime.now().isoformat()
-        }))
+        self.save_inventory()
+        self.history.record(kind, {(d, p): drawers[d]["positions"][str(p)] for d, p, _ in changed})
+        for drawer_id, position, occupied in changed:
+            self.occupancy.set_slot(drawer_id, position, occupied)
+            self.publish_inventory_update(drawer_id, position)
 
     # MODIFIED: Now receives the 'data' object directly
     def retry_placement(self, data):
@@ -1725,14 +2731,17 @@ class WineFridgeController:
             op['timer'].cancel()
 
             if op['type'] == 'load':
+                # No weight reading: assume a full bottle of this SKU
+                full_weight, _ = self.bottle_weights.bounds(op['barcode'])
                 self.update_inventory(
                     op['drawer'],
                     op['position'],
                     op['barcode'],
                     op['name'],
-                    MIN_FULL_BOTTLE_WEIGHT
+                    full_weight
                 )
 
+            self.analytics.end(op_id, 'completed')
             del self.pending_operations[op_id]
 
     def run(self):
@@ -1742,6 +2751,12 @@ class WineFridgeController:
         except KeyboardInterrupt:
             print("\n[MQTT] Shutting down...")
             self.running = False
+            self.tsdb.close()
+            self.analytics.save()
+            self.timeouts.save()
+            self.presence.stop()
+            self.conditioner.stop()
+            self.climate.stop()
             if self.serial:
                 self.serial.close()
             self.client.disconnect()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+WineFridge Batch Unload Pick List
+
+Several bottles taken out in one session (e.g. an event's wine list).
+Opening a drawer is the expensive step, so picks are resolved and ordered
+to open as few drawers as possible, one drawer at a time:
+
+  - slots asked for explicitly are taken as they are
+  - each barcode goes to a drawer already on the list when it has that
+    wine, otherwise to the drawer holding most of the wanted bottles
+
+All picks of the current drawer are lit together and may be taken in
+any order; a removal from a later drawer on the list is accepted too.
+"""
+
+from topology import drawer_number
+
+
+def plan_picks(requests, bottles):
+    """
+    requests: [{'drawer', 'position'} or {'barcode'}]
+    bottles:  {slot: barcode} of every bottle that can be picked
+    Returns (slots ordered drawer by drawer, unresolved requests).
+    """
+    chosen = set()
+    missing = []
+    wanted = []
+    for request in requests:
+        if request.get('drawer') and request.get('position'):
+            slot = (request['drawer'], int(request['position']))
+            if slot in bottles and slot not in chosen:
+                chosen.add(slot)
+            else:
+                missing.append(request)
+        elif request.get('barcode'):
+            wanted.append(request)
+        else:
+            missing.append(request)
+
+    wanted_barcodes = {r['barcode'] for r in wanted}
+    for request in wanted:
+        candidates = [slot for slot, barcode in bottles.items()
+                      if barcode == request['barcode'] and slot not in chosen]
+        if not candidates:
+            missing.append(request)
+            continue
+        drawers = {slot[0] for slot in chosen}
+        # Wanted bottles still available per drawer
+        density = {}
+        for slot, barcode in bottles.items():
+            if barcode in wanted_barcodes and slot not in chosen:
+                density[slot[0]] = density.get(slot[0], 0) + 1
+        chosen.add(min(candidates, key=lambda s: (s[0] not in drawers, -density.get(s[0], 0),
+                                                  drawer_number(s[0]), s[1])))
+
+    return sorted(chosen, key=lambda s: (drawer_number(s[0]), s[1])), missing
+
+
+class PickList:
+    def __init__(self, picks):
+        # picks: [{'slot': (drawer, position), 'barcode', 'name', ...}] in pick order
+        self.picks = picks
+        self.order = []
+        for pick in picks:
+            if pick['slot'][0] not in self.order:
+                self.order.append(pick['slot'][0])
+        for pick in picks:
+            pick['removed'] = False
+        self.committed = set()      # drawers whose picks are all out and written
+        self.current = self.order[0] if self.order else None
+
+    @property
+    def done(self):
+        return all(pick['removed'] for pick in self.picks)
+
+    def drawers(self):
+        return set(self.order)
+
+    def pending(self, drawer_id=None):
+        return [p for p in self.picks if not p['removed']
+                and (drawer_id is None or p['slot'][0] == drawer_id)]
+
+    def removed(self, drawer_id=None):
+        return [p for p in self.picks if p['removed']
+                and (drawer_id is None or p['slot'][0] == drawer_id)]
+
+    def remove(self, slot):
+        """
+        A bottle left `slot`. Returns (pick, drawer finished) - pick is
+        None when the slot is not on the list.
+        """
+        pick = next((p for p in self.picks if p['slot'] == slot and not p['removed']), None)
+        if pick is None:
+            return None, False
+        pick['removed'] = True
+        drawer_id = slot[0]
+        finished = not self.pending(drawer_id)
+        if finished:
+            self.committed.add(drawer_id)
+            self.current = next((d for d in self.order if self.pending(d)), None)
+        else:
+            self.current = drawer_id
+        return pick, finished
+
+    def put_back(self, slot):
+        """A picked bottle went back before its drawer was finished"""
+        pick = next((p for p in self.picks if p['slot'] == slot and p['removed']), None)
+        if pick is None or slot[0] in self.committed:
+            return None
+        pick['removed'] = False
+        return pick
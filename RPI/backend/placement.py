@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+WineFridge Zone Placement Optimizer
+
+Chooses drawers for bottles by their catalog `serving_temp` instead of the
+fixed wine type -> drawer map. Each (bottle, drawer) pair costs how far
+the zone setpoint lies outside the bottle's serving window; ties go to the
+drawer of the bottle's wine type, then to the setpoint closest to the
+window centre.
+
+Bottles are assigned to drawers as a min-cost flow:
+
+  source -> bottles -> drawer (cost) -> sink (free slots)
+
+so capacity is respected and the total mismatch is minimal. Slots inside
+a drawer are interchangeable and bottles with identical costs share one
+node, which keeps the graph at a few dozen x drawers edges: a few hundred
+slots solve in milliseconds.
+
+rearrange() runs the same flow over the bottles already in the fridge,
+with a MOVE_PENALTY for leaving the current drawer, and returns the moves
+worth doing.
+"""
+
+import heapq
+
+DEFAULT_SERVING = (12, 16)
+# Cost units: mismatch dominates, then wine type, then centring
+MISMATCH_WEIGHT = 1000     # per °C outside the serving window
+TYPE_PENALTY = 50          # drawer reserved for another wine type
+CENTRE_WEIGHT = 10         # per °C between setpoint and window centre
+# A move must save at least 0.5 °C of mismatch
+MOVE_PENALTY = 500
+
+
+def serving_window(wine):
+    serving = wine.get('serving_temp') or {}
+    return serving.get('min', DEFAULT_SERVING[0]), serving.get('max', DEFAULT_SERVING[1])
+
+
+def mismatch(window, temperature):
+    """°C between a temperature and a (min, max) window, 0 inside it"""
+    low, high = window
+    return max(0, low - temperature, temperature - high)
+
+
+def min_cost_flow(n, edges, source, sink):
+    """
+    Successive shortest paths with Dijkstra on reduced costs.
+    edges: [(u, v, capacity, cost)] with cost >= 0. Returns the flow on
+    each edge, in order.
+    """
+    graph = [[] for _ in range(n)]
+    # Edge record: [to, capacity, cost, index of the reverse edge]
+    handles = []
+    for u, v, capacity, cost in edges:
+        handles.append((u, len(graph[u])))
+        graph[u].append([v, capacity, cost, len(graph[v])])
+        graph[v].append([u, 0, -cost, len(graph[u]) - 1])
+
+    potential = [0] * n
+    while True:
+        dist = [None] * n
+        prev = [None] * n
+        dist[source] = 0
+        queue = [(0, source)]
+        while queue:
+            d, u = heapq.heappop(queue)
+            if d > dist[u]:
+                continue
+            for i, (v, capacity, cost, _) in enumerate(graph[u]):
+                if capacity <= 0:
+                    continue
+                nd = d + cost + potential[u] - potential[v]
+                if dist[v] is None or nd < dist[v]:
+                    dist[v] = nd
+                    prev[v] = (u, i)
+                    heapq.heappush(queue, (nd, v))
+        if dist[sink] is None:
+            break
+        for v in range(n):
+            if dist[v] is not None:
+                potential[v] += dist[v]
+
+        push, v = None, sink
+        while v != source:
+            u, i = prev[v]
+            push = graph[u][i][1] if push is None else min(push, graph[u][i][1])
+            v = u
+        v = sink
+        while v != source:
+            u, i = prev[v]
+            edge = graph[u][i]
+            edge[1] -= push
+            graph[v][edge[3]][1] += push
+            v = u
+
+    flows = []
+    for u, i in handles:
+        v, _, _, back = graph[u][i]
+        flows.append(graph[v][back][1])
+    return flows
+
+
+class ZoneOptimizer:
+    def __init__(self, catalog, wine_type):
+        # wine_type(barcode) -> 'rose' / 'white' / 'red' / None
+        self.wines = catalog.get('wines', {})
+        self.wine_type = wine_type
+
+    def cost(self, barcode, drawer):
+        """drawer: {'temperature': setpoint or None, 'wine_type': reserved type}"""
+        wine = self.wines.get(barcode, {})
+        cost = 0
+        temperature = drawer.get('temperature')
+        if temperature is not None and wine:
+            window = serving_window(wine)
+            cost += MISMATCH_WEIGHT * mismatch(window, temperature)
+            cost += CENTRE_WEIGHT * abs(temperature - sum(window) / 2)
+        wine_type = self.wine_type(barcode)
+        if drawer.get('wine_type') and wine_type and drawer['wine_type'] != wine_type:
+            cost += TYPE_PENALTY
+        return int(round(cost))
+
+    def degrees(self, barcode, drawer):
+        """°C the drawer setpoint lies outside the bottle's serving window"""
+        wine = self.wines.get(barcode)
+        if not wine or drawer.get('temperature') is None:
+            return 0
+        return mismatch(serving_window(wine), drawer['temperature'])
+
+    def assign(self, barcodes, drawers, current=None):
+        """
+        Drawer for each barcode (None when the fridge is full).
+
+        drawers: {drawer_id: {'temperature', 'wine_type', 'capacity'}}
+        current: optional drawer each bottle is in now (moves cost MOVE_PENALTY)
+        """
+        drawer_ids = [d for d in drawers if drawers[d].get('capacity', 0) > 0]
+        # Bottles with the same cost to every drawer (same serving window
+        # and type, same current drawer) are one node
+        groups = {}
+        for b, barcode in enumerate(barcodes):
+            costs = tuple(self.cost(barcode, drawers[d]) +
+                          (MOVE_PENALTY if current is not None and current[b] != d else 0)
+                          for d in drawer_ids)
+            groups.setdefault(costs, []).append(b)
+        keys = list(groups)
+
+        source, sink = 0, len(keys) + len(drawer_ids) + 1
+        edges = [(source, 1 + g, len(groups[key]), 0) for g, key in enumerate(keys)]
+        choice = []
+        for g, costs in enumerate(keys):
+            for k, drawer_id in enumerate(drawer_ids):
+                choice.append((g, drawer_id))
+                edges.append((1 + g, 1 + len(keys) + k, len(groups[costs]), costs[k]))
+        for k, drawer_id in enumerate(drawer_ids):
+            edges.append((1 + len(keys) + k, sink, drawers[drawer_id]['capacity'], 0))
+
+        flow = min_cost_flow(sink + 1, edges, source, sink)
+        result = [None] * len(barcodes)
+        for (g, drawer_id), used in zip(choice, flow[len(keys):len(keys) + len(choice)]):
+            members = groups[keys[g]]
+            for b in members[:used]:
+                result[b] = drawer_id
+            del members[:used]
+        return result
+
+    def rearrange(self, bottles, drawers):
+        """
+        Moves that lower the total mismatch of the bottles in `drawers`.
+
+        bottles: [{'barcode', 'drawer', 'position', ...}]
+        drawers: {drawer_id: {'temperature', 'wine_type', 'positions': [all slots]}}
+        Returns (moves, mismatch before, mismatch after) with the total
+        mismatch in °C; each move is the bottle
+        dict plus 'to_drawer' / 'to_position'. Bottles keep their slot
+        unless they change drawer; incoming bottles take the slots that
+        are free once the outgoing ones left.
+        """
+        capacities = {d: {**info, 'capacity': len(info['positions'])} for d, info in drawers.items()}
+        barcodes = [b['barcode'] for b in bottles]
+        current = [b['drawer'] for b in bottles]
+        target = self.assign(barcodes, capacities, current)
+
+        before = sum(self.degrees(b['barcode'], drawers[b['drawer']]) for b in bottles)
+        after = sum(self.degrees(b['barcode'], drawers[t or b['drawer']]) for b, t in zip(bottles, target))
+
+        staying = {d: set() for d in drawers}
+        for bottle, drawer_id in zip(bottles, target):
+            if drawer_id == bottle['drawer']:
+                staying[drawer_id].add(bottle['position'])
+        free = {d: sorted(p for p in info['positions'] if p not in staying[d])
+                for d, info in drawers.items()}
+
+        moves = []
+        for bottle, drawer_id in zip(bottles, target):
+            if drawer_id is None or drawer_id == bottle['drawer']:
+                continue
+            moves.append({**bottle, 'to_drawer': drawer_id, 'to_position': free[drawer_id].pop(0)})
+        return moves, before, after
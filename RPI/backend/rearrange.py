@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+WineFridge Bottle Rearrangement
+
+Plans and tracks guided moves of bottles between slots. A slot is a
+(drawer_id, position) tuple.
+
+Planning: the bottles that change slot form a partial permutation
+{from: to}. Chains ending in a free slot run back to front, one move per
+bottle. Every remaining cycle needs one bottle parked first - in a free
+slot (the cycle's own drawer preferred) or, with none left, in the
+user's hand - so a cycle of k bottles takes k + 1 moves, which is the
+minimum.
+
+Session: a move is a pick ('removed' at `from`) then a place ('placed'
+at `to`). Parking in hand has no place, taking a bottle from the hand
+has no pick, and consecutive hand put-backs may happen in any order
+(that is the two-bottle swap). Each event is looked up in the index of
+expected {slot: event}; anything else is a wrong position until the user
+undoes it.
+"""
+
+import itertools
+
+HAND = None
+
+
+def plan_moves(targets, free=()):
+    """
+    targets: {from slot: to slot} for every bottle that changes slot
+    free:    empty slots usable as buffers
+    Returns [{'from', 'to', 'origin'}] in execution order; HAND (None)
+    stands for the user's hand and origin is the bottle's starting slot.
+    """
+    if len(set(targets.values())) != len(targets):
+        raise ValueError("Two bottles share a target slot")
+    sources = set(targets)
+    pred = {to: frm for frm, to in targets.items()}
+    moves = []
+    done = set()
+
+    # Chains: start at a target that nobody leaves and walk back
+    for end in sorted(to for to in targets.values() if to not in sources):
+        slot = end
+        while slot in pred:
+            frm = pred[slot]
+            moves.append({'from': frm, 'to': slot, 'origin': frm})
+            done.add(frm)
+            slot = frm
+
+    # Free once the chains ran: unused free slots plus vacated chain heads
+    buffers = sorted(set(free) - set(targets.values()) |
+                     {frm for frm in done if frm not in pred})
+
+    for start in sorted(sources - done):
+        if start in done:
+            continue
+        cycle_drawer = start[0]
+        buffer = next((b for b in buffers if b[0] == cycle_drawer), buffers[0] if buffers else HAND)
+        moves.append({'from': start, 'to': buffer, 'origin': start})
+        done.add(start)
+        slot = start
+        while pred[slot] != start:
+            frm = pred[slot]
+            moves.append({'from': frm, 'to': slot, 'origin': frm})
+            done.add(frm)
+            slot = frm
+        moves.append({'from': buffer, 'to': slot, 'origin': start})
+    return moves
+
+
+def regroup(bottles, key):
+    """
+    Targets that sort the bottles of one drawer by key into positions
+    1..n, group after group. Bottles already inside their group's range
+    stay where they are.
+    bottles: {slot: bottle}, key(bottle) -> sortable
+    """
+    ordered = sorted(bottles, key=lambda slot: (key(bottles[slot]), slot))
+    targets = {}
+    first = 1
+    for _, group in itertools.groupby(ordered, key=lambda slot: key(bottles[slot])):
+        group = list(group)
+        span = range(first, first + len(group))
+        first += len(group)
+        free = sorted(set(span) - {slot[1] for slot in group})
+        for slot in group:
+            if slot[1] not in span:
+                targets[slot] = (slot[0], free.pop(0))
+    return targets
+
+
+def put_back(targets):
+    """Moves for bottles already in the user's hand: {origin slot: to slot}"""
+    return [{'from': HAND, 'to': to, 'origin': origin} for origin, to in targets.items()]
+
+
+class RearrangeSession:
+    def __init__(self, moves):
+        self.moves = list(moves)    # pending, in order
+        self.total = len(self.moves)
+        self.lifted = False         # bottle of the current move picked up
+        self.wrong = {}             # slot -> unexpected event seen there
+
+    @property
+    def done(self):
+        return not self.moves
+
+    @property
+    def step(self):
+        """1-based number of the current move"""
+        return self.total - len(self.moves) + 1
+
+    def expected(self):
+        """{slot: event} accepted right now"""
+        if not self.moves:
+            return {}
+        current = self.moves[0]
+        if current['from'] is not HAND and not self.lifted:
+            return {current['from']: 'removed'}
+        expected = {}
+        for move in self.moves:
+            if move is not current and move['from'] is not HAND:
+                break
+            expected[move['to']] = 'placed'
+        return expected
+
+    def pending_sources(self):
+        """Slots still holding a bottle that has to move"""
+        return [m['from'] for m in self.moves if m['from'] is not HAND]
+
+    def event(self, event, slot):
+        """
+        Feed one bottle event. Returns (outcome, move):
+          'picked'   bottle of the current move lifted
+          'moved'    move completed (commit it)
+          'returned' lifted bottle put back where it was
+          'cleared'  a wrong event was undone
+          'wrong'    unexpected event, recorded in self.wrong
+        """
+        undo = 'removed' if event == 'placed' else 'placed'
+        if self.wrong.get(slot) == undo:
+            del self.wrong[slot]
+            return 'cleared', None
+
+        if self.expected().get(slot) == event:
+            current = self.moves[0]
+            if event == 'removed':
+                if current['to'] is HAND:
+                    self.moves.pop(0)
+                    return 'moved', current
+                self.lifted = True
+                return 'picked', current
+            move = next(m for m in self.moves
+                        if m['to'] == slot and (m is current or m['from'] is HAND))
+            self.moves.remove(move)
+            self.lifted = False
+            return 'moved', move
+
+        if event == 'placed' and self.lifted and slot == self.moves[0]['from']:
+            self.lifted = False
+            return 'returned', self.moves[0]
+
+        self.wrong[slot] = event
+        return 'wrong', None
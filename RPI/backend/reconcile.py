@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+WineFridge Occupancy Reconciler
+
+Compares what each functional drawer senses (heartbeat `occupied[]`, or a
+single bottle event) with what inventory.json says, as one bitmap per
+drawer (bit N-1 = position N):
+
+  removed = inventory & ~sensed    bottle gone without an unload
+  unknown = sensed & ~inventory    bottle present that was never loaded
+
+Each mismatch is reported once, until it clears. A heartbeat whose bitmap
+and inventory are unchanged since the last check costs one comparison.
+"""
+
+import threading
+
+
+def pack_bits(occupied):
+    """[0, 1, 0, ...] -> int bitmap"""
+    bits = 0
+    for i, value in enumerate(occupied):
+        if value:
+            bits |= 1 << i
+    return bits
+
+
+def bit_positions(bits):
+    """int bitmap -> [positions] (1-based)"""
+    positions = []
+    while bits:
+        low = bits & -bits
+        positions.append(low.bit_length())
+        bits ^= low
+    return positions
+
+
+class DrawerOccupancy:
+    def __init__(self):
+        self.inventory = 0      # bitmap from inventory.json
+        self.sensed = None      # bitmap from the drawer
+        self.checked = None     # (sensed, inventory) at the last check
+        self.removed = 0        # mismatches already reported
+        self.unknown = 0
+
+
+class OccupancyReconciler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.drawers = {}
+
+    def _drawer(self, drawer_id):
+        if drawer_id not in self.drawers:
+            self.drawers[drawer_id] = DrawerOccupancy()
+        return self.drawers[drawer_id]
+
+    # -------------------------------------------------------------------------
+    # Inventory side
+    # -------------------------------------------------------------------------
+    def load_inventory(self, inventory):
+        """(Re)build every drawer's inventory bitmap"""
+        with self.lock:
+            for drawer in self.drawers.values():
+                drawer.inventory = 0
+            for drawer_id, drawer_data in inventory.get("drawers", {}).items():
+                bits = 0
+                for position, slot in drawer_data.get("positions", {}).items():
+                    if slot.get("occupied"):
+                        bits |= 1 << (int(position) - 1)
+                self._drawer(drawer_id).inventory = bits
+
+    def set_slot(self, drawer_id, position, occupied):
+        with self.lock:
+            drawer = self._drawer(drawer_id)
+            if occupied:
+                drawer.inventory |= 1 << (position - 1)
+            else:
+                drawer.inventory &= ~(1 << (position - 1))
+
+    # -------------------------------------------------------------------------
+    # Sensed side
+    # -------------------------------------------------------------------------
+    def observe(self, drawer_id, occupied):
+        """
+        Heartbeat bitmap. Returns (removed, unknown) positions that newly
+        disagree with the inventory.
+        """
+        with self.lock:
+            drawer = self._drawer(drawer_id)
+            drawer.sensed = pack_bits(occupied)
+            return self._check(drawer)
+
+    def observe_position(self, drawer_id, position, occupied):
+        """Single bottle event (placed / removed) on one position"""
+        with self.lock:
+            drawer = self._drawer(drawer_id)
+            if drawer.sensed is None:
+                drawer.sensed = drawer.inventory
+            if occupied:
+                drawer.sensed |= 1 << (position - 1)
+            else:
+                drawer.sensed &= ~(1 << (position - 1))
+            return self._check(drawer)
+
+    def _check(self, drawer):
+        state = (drawer.sensed, drawer.inventory)
+        if state == drawer.checked:
+            return [], []
+        drawer.checked = state
+
+        removed = drawer.inventory & ~drawer.sensed
+        unknown = drawer.sensed & ~drawer.inventory
+        new_removed = removed & ~drawer.removed
+        new_unknown = unknown & ~drawer.unknown
+        # Cleared mismatches may be reported again if they come back
+        drawer.removed = removed
+        drawer.unknown = unknown
+        return bit_positions(new_removed), bit_positions(new_unknown)
+
+    def mismatches(self, drawer_id):
+        """Current (removed, unknown) positions of a drawer"""
+        with self.lock:
+            drawer = self._drawer(drawer_id)
+            return bit_positions(drawer.removed), bit_positions(drawer.unknown)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+WineFridge Serving Temperature Model
+
+Estimates the temperature of every bottle and how long until it is inside
+its catalog `serving_temp` window, with Newton cooling per bottle:
+
+  T(t) = Ta + (T0 - Ta) * exp(-t / tau)
+
+  T0   room temperature at placement (ROOM_TEMP)
+  Ta   zone air temperature: its mean since placement (heartbeat history)
+       for the current estimate, the latest reading for the prediction
+  tau  BOTTLE_TAU for 750 ml, scaled with the bottle size
+
+tau is a fixed constant: heartbeats measure the zone air, never a bottle,
+so the history has no bottle curve to fit it to.
+
+Per zone, the parameters that do not depend on the clock (tau, serving
+window, placement time, mean air since placement) are kept as flat
+columns and only refitted when the zone temperature moved by ZONE_DELTA
+or its bottles changed. Temperature, state and ready time are evaluated
+from `now` on every view.
+"""
+
+import math
+import threading
+import time
+
+from bottle_weights import volume_ml
+
+ROOM_TEMP = 22.0
+BOTTLE_TAU = 2.5 * 3600     # seconds, 750 ml bottle in still air
+ZONE_DELTA = 0.5            # °C change that triggers a recompute
+DEFAULT_SERVING = (12, 16)
+
+
+class ServingModel:
+    def __init__(self, catalog):
+        self.wines = catalog.get('wines', {})
+        self.lock = threading.Lock()
+        self.zone_temps = {}    # zone -> air temperature of the last compute
+        self.signatures = {}    # zone -> bottles of the last compute
+        self.columns = {}       # zone -> time-independent parameters
+        self.dirty = set()
+
+    def observe_zone(self, zone, temperature):
+        """Heartbeat reading; marks the zone for recompute if it moved enough"""
+        with self.lock:
+            last = self.zone_temps.get(zone)
+            if last is None or abs(temperature - last) >= ZONE_DELTA:
+                self.dirty.add(zone)
+
+    def view(self, bottles_by_zone, ambient, now=None):
+        """
+        Ready-to-serve list, soonest first.
+
+        bottles_by_zone: zone -> [{drawer, position, barcode, name, placed_at}]
+        ambient(zone, since) -> (current air temp, mean air temp since `since`)
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            for zone, bottles in bottles_by_zone.items():
+                signature = tuple((b['drawer'], b['position'], b['barcode'], b['placed_at']) for b in bottles)
+                if zone in self.dirty or self.signatures.get(zone) != signature:
+                    current, _ = ambient(zone, None)
+                    if current is None:
+                        continue
+                    self.columns[zone] = self._fit(bottles, current, ambient, zone)
+                    self.zone_temps[zone] = current
+                    self.signatures[zone] = signature
+                    self.dirty.discard(zone)
+            for zone in [z for z in self.columns if z not in bottles_by_zone]:
+                del self.columns[zone]
+            rows = [row for zone, columns in self.columns.items() for row in self._evaluate(zone, columns, now)]
+
+        for row in rows:
+            if row['ready_at'] is None:
+                row['ready_in_min'] = None
+            else:
+                row['ready_in_min'] = max(0, round((row['ready_at'] - now) / 60))
+        rows.sort(key=lambda r: (r['ready_in_min'] is None, r['ready_in_min'] or 0, r['drawer'], r['position']))
+        return rows
+
+    def _fit(self, bottles, current, ambient, zone):
+        """One zone's parameters, column-wise"""
+        wines = [self.wines.get(b['barcode'], {}) for b in bottles]
+        mean_air = [ambient(zone, b['placed_at'])[1] if b['placed_at'] else current for b in bottles]
+        return {
+            "bottles": bottles,
+            "current": current,
+            "tau": [BOTTLE_TAU * (volume_ml(w.get('volume')) / 750) ** (1 / 3) for w in wines],
+            "low": [(w.get('serving_temp') or {}).get('min', DEFAULT_SERVING[0]) for w in wines],
+            "high": [(w.get('serving_temp') or {}).get('max', DEFAULT_SERVING[1]) for w in wines],
+            "placed_at": [b['placed_at'] for b in bottles],
+            "mean_air": [current if m is None else m for m in mean_air]
+        }
+
+    def _evaluate(self, zone, columns, now):
+        """Bottle temperatures and states of one zone at `now`"""
+        current, tau, mean_air = columns['current'], columns['tau'], columns['mean_air']
+        elapsed = [now - placed if placed else math.inf for placed in columns['placed_at']]
+
+        # Current bottle temperature estimate
+        temp = [mean_air[i] + (ROOM_TEMP - mean_air[i]) * math.exp(-elapsed[i] / tau[i])
+                for i in range(len(elapsed))]
+
+        rows = []
+        for i, bottle in enumerate(columns['bottles']):
+            t, lo, hi = temp[i], columns['low'][i], columns['high'][i]
+            if lo <= t <= hi:
+                state, ready_at = 'ready', now
+            else:
+                target = hi if t > hi else lo
+                # The zone never takes the bottle into its window
+                if (t > hi and current >= hi) or (t < lo and current <= lo):
+                    state, ready_at = 'never', None
+                else:
+                    state = 'cooling' if t > hi else 'warming'
+                    ready_at = now + tau[i] * math.log((t - current) / (target - current))
+            rows.append({
+                "drawer": bottle['drawer'],
+                "position": bottle['position'],
+                "barcode": bottle['barcode'],
+                "name": bottle.get('name'),
+                "zone": zone,
+                "estimated_temp": round(t, 1),
+                "serving_temp": [lo, hi],
+                "state": state,
+                "ready_at": ready_at
+            })
+        return rows
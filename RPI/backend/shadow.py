@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+WineFridge Device Shadows
+
+Keeps, per ESP32, the state it last reported (heartbeat / startup) next to
+the state the handler last commanded. The reconciler only re-sends the
+fields where both differ, so a rebooted controller is corrected on its
+first message without re-painting the whole fridge.
+
+Fields:
+  'leds'               composed set_leds frame (functional drawers)
+  'light'              own COB light {'temperature', 'brightness'}
+  'light:drawer:N'     drawer N COB on a lighting controller
+  'light:zone:N'       zone N COB on a lighting controller
+Reported-only fields: 'occupied', 'weights', 'total_weight', 'temperature',
+'humidity', 'wifi', 'firmware', 'uptime'.
+"""
+
+import re
+import threading
+import time
+
+# Ignore divergence on fields commanded less than GRACE seconds ago
+# (the heartbeat may have been sent before the command arrived)
+GRACE = 2.0
+
+LIGHT_PATTERN = re.compile(r'(\d+)K\s+(\d+)%')
+
+
+def light_field(extra):
+    """Shadow field for a lighting target ({}, {'drawer': 8}, {'zone': 3})"""
+    if 'drawer' in extra:
+        return f"light:drawer:{extra['drawer']}"
+    if 'zone' in extra:
+        return f"light:zone:{extra['zone']}"
+    return 'light'
+
+
+def light_target(field):
+    """Inverse of light_field: 'light:zone:3' -> {'zone': 3}"""
+    parts = field.split(':')
+    return {parts[1]: int(parts[2])} if len(parts) == 3 else {}
+
+
+def parse_light(value):
+    """'4000K 35%' -> {'temperature': 4000, 'brightness': 35}"""
+    match = LIGHT_PATTERN.search(value or '')
+    if not match:
+        return None
+    return {"temperature": int(match.group(1)), "brightness": int(match.group(2))}
+
+
+class DeviceShadow:
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.reported = {}
+        self.desired = {}
+        self.desired_at = {}
+        self.last_seen = None
+        self.boots = 0
+
+
+class ShadowRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}
+
+    def get(self, device_id):
+        with self.lock:
+            return self._shadow(device_id)
+
+    def _shadow(self, device_id):
+        if device_id not in self.devices:
+            self.devices[device_id] = DeviceShadow(device_id)
+        return self.devices[device_id]
+
+    # -------------------------------------------------------------------------
+    # Desired side
+    # -------------------------------------------------------------------------
+    def desire(self, device_id, field, value):
+        with self.lock:
+            shadow = self._shadow(device_id)
+            shadow.desired[field] = value
+            shadow.desired_at[field] = time.monotonic()
+
+    def applied(self, device_id, field):
+        """Command for a field was published; assume the device took it"""
+        with self.lock:
+            shadow = self._shadow(device_id)
+            if field in shadow.desired:
+                shadow.reported[field] = shadow.desired[field]
+
+    def diverged(self, device_id):
+        """[(field, desired value)] that the device does not reflect"""
+        with self.lock:
+            shadow = self._shadow(device_id)
+            now = time.monotonic()
+            return [(field, value) for field, value in shadow.desired.items()
+                    if shadow.reported.get(field) != value
+                    and now - shadow.desired_at.get(field, 0) >= GRACE]
+
+    # -------------------------------------------------------------------------
+    # Reported side
+    # -------------------------------------------------------------------------
+    def report(self, device_id, action, message):
+        """
+        Record a heartbeat or startup message.
+        Returns True if the device (re)booted since it was last seen.
+        """
+        data = message.get('data', {}) or {}
+        with self.lock:
+            shadow = self._shadow(device_id)
+            shadow.last_seen = time.time()
+            reported = shadow.reported
+
+            if message.get('firmware'):
+                reported['firmware'] = message['firmware']
+
+            uptime = data.get('uptime')
+            rebooted = action == 'startup'
+            if uptime is not None:
+                if reported.get('uptime') is not None and uptime < reported['uptime']:
+                    rebooted = True
+                reported['uptime'] = uptime
+
+            if rebooted:
+                shadow.boots += 1
+                # Firmware boots with position LEDs off and COB at 4000K 0%
+                reported['leds'] = []
+                for field in list(reported):
+                    if field.startswith('light'):
+                        reported[field] = {"temperature": 4000, "brightness": 0}
+
+            if action == 'heartbeat':
+                self._parse_heartbeat(reported, data)
+
+            return rebooted
+
+    def _parse_heartbeat(self, reported, data):
+        # Functional drawers (old and new firmware key names)
+        if 'occupied' in data:
+            reported['occupied'] = list(data['occupied'])
+        elif 'positions' in data:
+            reported['occupied'] = [1 if p.get('occupied') else 0 for p in data['positions']]
+        if 'weights' in data:
+            reported['weights'] = list(data['weights'])
+        for key, field in (('total_weight', 'total_weight'), ('weight', 'total_weight'),
+                           ('temperature', 'temperature'), ('temp', 'temperature'),
+                           ('humidity', 'humidity'), ('humid', 'humidity'),
+                           ('wifi_rssi', 'wifi'), ('wifi', 'wifi')):
+            if key in data:
+                reported[field] = data[key]
+
+        light = parse_light(data.get('cob_light') or data.get('light'))
+        if light:
+            reported['light'] = light
+
+        # Lighting controllers: drawer1 / drawer2 / zone blocks
+        for key in ('drawer1', 'drawer2', 'zone'):
+            block = data.get(key)
+            if isinstance(block, dict) and 'id' in block:
+                target = {"zone": block['id']} if key == 'zone' else {"drawer": block['id']}
+                reported[light_field(target)] = {
+                    "temperature": block.get('temperature'),
+                    "brightness": block.get('brightness')
+                }
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+WineFridge Heartbeat Telemetry
+
+Parses drawer and lighting heartbeats into fixed-size ring buffers, one per
+device and metric. Samples are stored in flat array('d') columns (no
+per-sample dicts), so memory per device is constant however long the
+handler runs.
+
+Drawer metrics:   temperature, humidity, total_weight, wifi_rssi, uptime,
+                  weights (9 wide), occupied (9 wide)
+Lighting metrics: wifi_rssi, uptime, free_heap,
+                  drawer_N_brightness / drawer_N_temperature,
+                  zone_N_brightness / zone_N_temperature
+"""
+
+import threading
+import time
+from array import array
+
+# 24 h of 60 s heartbeats
+DEFAULT_CAPACITY = 1440
+
+# canonical metric -> heartbeat keys (new firmware first, then old)
+SCALAR_KEYS = {
+    'temperature': ('temperature', 'temp'),
+    'humidity': ('humidity', 'humid'),
+    'total_weight': ('total_weight', 'weight'),
+    'wifi_rssi': ('wifi_rssi', 'wifi'),
+    'uptime': ('uptime',),
+    'free_heap': ('free_heap',),
+}
+VECTOR_KEYS = ('weights', 'occupied')
+
+
+def heartbeat_scalars(data):
+    """{metric: float} of the scalar metrics in a heartbeat 'data' object"""
+    values = {}
+    for metric, keys in SCALAR_KEYS.items():
+        for key in keys:
+            value = data.get(key)
+            if isinstance(value, (int, float)):
+                values[metric] = float(value)
+                break
+    return values
+
+
+class RingBuffer:
+    """Fixed-capacity time series of `width` floats per sample"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, width=1):
+        self.capacity = capacity
+        self.width = width
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity * width))
+        self.head = 0       # next slot to write
+        self.count = 0
+
+    def append(self, t, value):
+        i = self.head
+        self.times[i] = t
+        if self.width == 1:
+            self.values[i] = value
+        else:
+            base = i * self.width
+            for j in range(self.width):
+                self.values[base + j] = value[j] if j < len(value) else 0.0
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _index(self, n):
+        """Slot of the n-th oldest sample"""
+        return (self.head - self.count + n) % self.capacity
+
+    def _value(self, i):
+        if self.width == 1:
+            return self.values[i]
+        base = i * self.width
+        return self.values[base:base + self.width]
+
+    def latest(self):
+        """(t, value) of the newest sample, or None"""
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.capacity
+        return self.times[i], self._value(i)
+
+    def first_index_since(self, t):
+        """Binary search (samples are time ordered) for the first t_i >= t"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._index(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def since(self, t=0):
+        """(times, values) arrays of samples with timestamp >= t, oldest first"""
+        times = array('d')
+        values = array('d')
+        for n in range(self.first_index_since(t), self.count):
+            i = self._index(n)
+            times.append(self.times[i])
+            if self.width == 1:
+                values.append(self.values[i])
+            else:
+                values.extend(self._value(i))
+        return times, values
+
+    def __len__(self):
+        return self.count
+
+
+class TelemetryStore:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.buffers = {}   # (device_id, metric) -> RingBuffer
+        self.samples = 0
+
+    def buffer(self, device_id, metric):
+        return self.buffers.get((device_id, metric))
+
+    def metrics(self, device_id):
+        return sorted(m for d, m in self.buffers if d == device_id)
+
+    def _append(self, device_id, metric, t, value, width=1):
+        key = (device_id, metric)
+        ring = self.buffers.get(key)
+        if ring is None:
+            ring = self.buffers[key] = RingBuffer(self.capacity, width)
+        ring.append(t, value)
+
+    def ingest(self, device_id, data, t=None):
+        """Store every known metric of one heartbeat 'data' object"""
+        t = time.time() if t is None else t
+        with self.lock:
+            self.samples += 1
+            for metric, value in heartbeat_scalars(data).items():
+                self._append(device_id, metric, t, value)
+
+            for metric in VECTOR_KEYS:
+                value = data.get(metric)
+                if isinstance(value, list) and value:
+                    self._append(device_id, metric, t, [float(v or 0) for v in value], len(value))
+
+            # Old drawer firmware: positions [{position, occupied}]
+            positions = data.get('positions')
+            if 'occupied' not in data and isinstance(positions, list) and positions:
+                occupied = [1.0 if p.get('occupied') else 0.0 for p in positions]
+                self._append(device_id, 'occupied', t, occupied, len(occupied))
+
+            # Lighting controllers: drawer1 / drawer2 / zone blocks
+            for key in ('drawer1', 'drawer2', 'zone'):
+                block = data.get(key)
+                if isinstance(block, dict) and 'id' in block:
+                    prefix = f"zone_{block['id']}" if key == 'zone' else f"drawer_{block['id']}"
+                    for field in ('brightness', 'temperature'):
+                        if isinstance(block.get(field), (int, float)):
+                            self._append(device_id, f"{prefix}_{field}", t, float(block[field]))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+WineFridge Adaptive Operation Timeouts
+
+How long a guided operation waits for the user is learned per operation
+type and drawer instead of a fixed 60 s:
+
+  timeout = clamp(TIMEOUT_MARGIN x p95 of recent waits, FLOOR, CEILING)
+
+Each (type, drawer) keeps one LogHistogram (analytics.py) whose counts
+decay by DECAY on every new sample - a rolling quantile sketch of about
+the last 1 / (1 - DECAY) operations in constant memory. Drawers with too
+few samples fall back to all drawers of the type, then to
+DEFAULT_TIMEOUT.
+
+A wait that expires is learned too, as a sample at the limit: when more
+than 5 % of the users need longer, the p95 climbs and the timeout with it.
+
+The waits are what each timer guards: a load/unload from start to the
+bottle event, one rearrangement step, the gap between two batch
+placements or picks, the swap put-back phase.
+"""
+
+import json
+import threading
+import time
+
+from analytics import LogHistogram, SAVE_INTERVAL
+
+TIMEOUTS_PATH = '/home/plasticlab/WineFridge/RPI/database/operation-timeouts.json'
+
+DEFAULT_TIMEOUT = 60
+TIMEOUT_FLOOR = 15
+TIMEOUT_CEILING = 90
+TIMEOUT_QUANTILE = 0.95
+TIMEOUT_MARGIN = 1.5
+DECAY = 0.97
+MIN_SAMPLES = 5
+
+
+class AdaptiveTimeouts:
+    def __init__(self, filepath=TIMEOUTS_PATH):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.sketches = {}          # (op type, drawer) -> decaying LogHistogram
+        self.last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, filepath=TIMEOUTS_PATH):
+        model = cls(filepath)
+        try:
+            with open(filepath, 'r') as f:
+                for key, counts in json.load(f).get('sketches', {}).items():
+                    op_type, drawer_id = key.split('|', 1)
+                    model.sketches[(op_type, drawer_id)] = LogHistogram.from_json(counts)
+            print(f"[TIMEOUT] ✔ Loaded {len(model.sketches)} timeout sketches")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[TIMEOUT] ✗ Error loading {filepath}: {e}")
+        return model
+
+    def save(self):
+        with self.lock:
+            sketches = {f"{t}|{d}": sketch.to_json() for (t, d), sketch in self.sketches.items()}
+            self.last_save = time.monotonic()
+        try:
+            with open(self.filepath, 'w') as f:
+                json.dump({"version": 1, "sketches": sketches}, f, separators=(',', ':'))
+        except Exception as e:
+            print(f"[TIMEOUT] ✗ Error saving {self.filepath}: {e}")
+
+    def observe(self, op_type, drawer_id, seconds):
+        """A wait of `seconds` (or one that expired at that limit)"""
+        with self.lock:
+            sketch = self.sketches.setdefault((op_type, drawer_id or 'all'), LogHistogram())
+            for i, count in enumerate(sketch.counts):
+                if count:
+                    sketch.counts[i] = count * DECAY
+            sketch.add(seconds)
+            due = time.monotonic() - self.last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def timeout(self, op_type, drawer_id=None):
+        """Seconds to wait for this operation type on this drawer"""
+        with self.lock:
+            sketch = self.sketches.get((op_type, drawer_id or 'all'))
+            if sketch is None or sketch.count < MIN_SAMPLES:
+                sketch = LogHistogram()
+                for (t, _), other in self.sketches.items():
+                    if t == op_type:
+                        sketch.merge(other)
+            if sketch.count < MIN_SAMPLES:
+                return DEFAULT_TIMEOUT
+            wait = sketch.quantile(TIMEOUT_QUANTILE) * TIMEOUT_MARGIN
+        return round(min(TIMEOUT_CEILING, max(TIMEOUT_FLOOR, wait)), 1)
+
+
+class OperationTimer(threading.Timer):
+    """
+    threading.Timer with the learned timeout. satisfied() stops it and
+    learns the wait; cancel() stops it without learning (user cancel);
+    expiring learns the limit, then calls the function.
+    """
+
+    def __init__(self, model, op_type, drawer_id, function, args=None):
+        super().__init__(model.timeout(op_type, drawer_id), function, args)
+        self.model = model
+        self.op_type = op_type
+        self.drawer_id = drawer_id
+        self.started = None
+        self.expired = False
+
+    def start(self):
+        self.started = time.monotonic()
+        super().start()
+
+    def satisfied(self):
+        if self.finished.is_set() or self.expired or self.started is None:
+            return
+        self.cancel()
+        self.model.observe(self.op_type, self.drawer_id, time.monotonic() - self.started)
+
+    def run(self):
+        self.finished.wait(self.interval)
+        if not self.finished.is_set():
+            self.expired = True
+            self.model.observe(self.op_type, self.drawer_id, self.interval)
+            self.function(*self.args, **self.kwargs)
+        self.finished.set()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+WineFridge Topology
+
+Loads the fridge layout (zones, drawers, controller per drawer, functional
+vs display) from database/fridge-topology.json and compiles it once at
+startup into the lookup tables used by the lighting, shutdown and sync
+paths. Supporting a new fridge model only needs a new topology file.
+"""
+
+import json
+import os
+
+TOPOLOGY_PATH = '/home/plasticlab/WineFridge/RPI/database/fridge-topology.json'
+
+# Copy shipped with the code, used when the configured file is missing or broken
+SHIPPED_TOPOLOGY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     '..', 'database', 'fridge-topology.json')
+
+
+def drawer_number(drawer_id):
+    """'drawer_7' -> 7"""
+    return int(drawer_id.rsplit('_', 1)[1])
+
+
+class FridgeTopology:
+    def __init__(self, config):
+        self.model = config.get('model', 'unknown')
+        zones = config['zones']
+        drawers = config['drawers']
+
+        # drawer_id -> {'zone', 'zone_number', 'controller', 'functional', ...}
+        self.drawers = {}
+        # zone name ('lower'...) -> zone number / drawer ids
+        self.zone_numbers = {}
+        self.zone_drawers = {}
+        # zone name -> [(topic, action, extra data)] for lighting changes
+        self.zone_routes = {}
+        # zone name -> [(topic, [(action, extra data)])], one entry per controller
+        self.zone_batches = {}
+        # Grouped set_lights per controller (no lighting firmware parses it yet)
+        self.batch_lighting = config.get('batch_lighting', False)
+        # Functional drawers (sensors + position LEDs), in config order
+        self.functional_drawers = []
+        # wine type -> preferred drawer
+        self.wine_type_drawers = {}
+        # Every ESP32 that accepts commands (shutdown, sync)
+        self.controllers = []
+        # zone name -> device taking set_climate commands (None = not fitted)
+        self.climate_actuators = {}
+
+        for zone_name, zone in zones.items():
+            self.zone_numbers[zone_name] = zone['zone']
+            self.zone_drawers[zone_name] = list(zone['drawers'])
+            self.climate_actuators[zone_name] = zone.get('climate_actuator')
+            routes = []
+
+            for drawer_id in zone['drawers']:
+                if drawer_id not in drawers:
+                    raise ValueError(f"Zone {zone_name} references unknown {drawer_id}")
+                drawer = drawers[drawer_id]
+                controller = drawer.get('controller', drawer_id)
+                functional = drawer.get('type') == 'functional'
+
+                self.drawers[drawer_id] = {
+                    'zone': zone_name,
+                    'zone_number': zone['zone'],
+                    'controller': controller,
+                    'functional': functional,
+                    'positions': drawer.get('positions', 9),
+                    'wine_type': drawer.get('wine_type')
+                }
+
+                if functional:
+                    self.functional_drawers.append(drawer_id)
+                    if drawer.get('wine_type'):
+                        self.wine_type_drawers[drawer['wine_type']] = drawer_id
+
+                # A drawer driving its own COB needs no 'drawer' key
+                extra = {} if controller == drawer_id else {"drawer": drawer_number(drawer_id)}
+                routes.append((f"winefridge/{controller}/command", "set_general_light", extra))
+                self._add_controller(controller)
+
+            if zone.get('controller'):
+                routes.append((f"winefridge/{zone['controller']}/command", "set_zone_light",
+                               {"zone": zone['zone']}))
+                self._add_controller(zone['controller'])
+
+            self.zone_routes[zone_name] = routes
+
+            batches = {}
+            for topic, action, extra in routes:
+                batches.setdefault(topic, []).append((action, extra))
+            self.zone_batches[zone_name] = list(batches.items())
+
+    def _add_controller(self, device_id):
+        if device_id not in self.controllers:
+            self.controllers.append(device_id)
+
+    def is_functional(self, drawer_id):
+        return self.drawers.get(drawer_id, {}).get('functional', False)
+
+    def zone_sensor(self, zone_name):
+        """Functional drawer whose sensors stand for the zone (None if none)"""
+        for drawer_id in self.zone_drawers.get(zone_name, []):
+            if self.is_functional(drawer_id):
+                return drawer_id
+        return None
+
+    @classmethod
+    def load(cls, filepath=TOPOLOGY_PATH):
+        try:
+            with open(filepath, 'r') as f:
+                topology = cls(json.load(f))
+            print(f"[TOPOLOGY] ✔ Loaded {topology.model}")
+            return topology
+        except Exception as e:
+            if os.path.abspath(filepath) == os.path.abspath(SHIPPED_TOPOLOGY_PATH):
+                raise
+            print(f"[TOPOLOGY] ✗ Error loading {filepath}: {e} - using the shipped layout")
+            return cls.load(SHIPPED_TOPOLOGY_PATH)
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+WineFridge Time-Series Store
+
+Embedded, append-only store for heartbeat metrics (temperature, humidity,
+weights...) kept for months on the Pi's SD card.
+
+Layout:
+  {root}/{resolution}/{device}/{metric}/{segment_start}.seg
+
+  resolution  'raw' samples, or '1m' / '1h' / '1d' rollups (min/max/avg)
+  segment     append-only file covering SEGMENT_SPAN[resolution] seconds,
+              made of compressed columnar blocks
+
+Block format (little endian):
+  b'WFTS' | uint16 count | uint8 columns | uint32 payload bytes |
+  int64 first ms | int64 last ms | payload
+  payload = bitstream: timestamps (ms, delta-of-delta) followed by each
+            value column (Gorilla XOR float compression)
+
+Raw samples go through a background worker which folds them into the 1m
+rollup, 1m rows into 1h and 1h rows into 1d. Rows are buffered in memory
+and appended as a block every FLUSH_INTERVAL seconds or BLOCK_SIZE rows.
+Segments older than RETENTION[resolution] are deleted.
+
+Reads skip blocks outside the requested range using the header timestamps
+and keep decoded blocks in an LRU cache. chart() plans the resolution for
+a chart step and re-buckets the rows for the dashboard.
+"""
+
+import os
+import queue
+from collections import OrderedDict
+import struct
+import threading
+import time
+
+TSDB_PATH = '/home/plasticlab/WineFridge/RPI/database/tsdb'
+
+RESOLUTIONS = ['raw', '1m', '1h', '1d']
+BUCKET = {'1m': 60, '1h': 3600, '1d': 86400}
+ROLLUP_OF = {'raw': '1m', '1m': '1h', '1h': '1d'}
+SEGMENT_SPAN = {'raw': 86400, '1m': 7 * 86400, '1h': 90 * 86400, '1d': 3650 * 86400}
+# Seconds of history kept per resolution (None = forever)
+RETENTION = {'raw': 7 * 86400, '1m': 90 * 86400, '1h': 2 * 365 * 86400, '1d': None}
+
+# Upper bound on points returned by one chart query
+MAX_POINTS = 1000
+
+BLOCK_SIZE = 256
+FLUSH_INTERVAL = 300
+# Close a rollup bucket this many seconds after its end if no sample came
+BUCKET_GRACE = 5
+
+MAGIC = b'WFTS'
+HEADER = struct.Struct('<4sHBIqq')
+# Decoded blocks kept in memory (blocks never change once written)
+BLOCK_CACHE_SIZE = 512
+
+
+# =============================================================================
+# Bit-level codecs
+# =============================================================================
+class BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.nbits = 0
+
+    def write(self, bits, n):
+        self.value = (self.value << n) | (bits & ((1 << n) - 1))
+        self.nbits += n
+
+    def to_bytes(self):
+        pad = (-self.nbits) % 8
+        return (self.value << pad).to_bytes((self.nbits + pad) // 8, 'big')
+
+
+class BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n):
+        # Only touch the bytes holding bits [pos, pos + n)
+        pos = self.pos
+        last = (pos + n + 7) >> 3
+        chunk = int.from_bytes(self.data[pos >> 3:last], 'big')
+        self.pos = pos + n
+        return (chunk >> ((last << 3) - pos - n)) & ((1 << n) - 1)
+
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def float_bits(x):
+    return struct.unpack('<Q', struct.pack('<d', x))[0]
+
+
+def bits_float(b):
+    return struct.unpack('<d', struct.pack('<Q', b))[0]
+
+
+# (prefix, prefix length, value bits) for delta-of-delta buckets
+DOD_BUCKETS = [(0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12)]
+
+
+def encode_timestamps(writer, times):
+    """Delta-of-delta encoding of integer millisecond timestamps"""
+    prev, prev_delta = None, 0
+    for i, t in enumerate(times):
+        if i == 0:
+            writer.write(t, 64)
+        elif i == 1:
+            prev_delta = t - prev
+            writer.write(zigzag(prev_delta), 64)
+        else:
+            delta = t - prev
+            dod = delta - prev_delta
+            prev_delta = delta
+            if dod == 0:
+                writer.write(0, 1)
+            else:
+                for prefix, plen, nbits in DOD_BUCKETS:
+                    if -(1 << (nbits - 1)) <= dod < (1 << (nbits - 1)):
+                        writer.write(prefix, plen)
+                        writer.write(zigzag(dod), nbits)
+                        break
+                else:
+                    writer.write(0b1111, 4)
+                    writer.write(zigzag(dod), 64)
+        prev = t
+
+
+def decode_timestamps(reader, count):
+    times = []
+    read = reader.read
+    prev, delta = 0, 0
+    for i in range(count):
+        if i == 0:
+            t = read(64)
+        elif i == 1:
+            delta = unzigzag(read(64))
+            t = prev + delta
+        else:
+            if read(1) == 0:
+                dod = 0
+            elif read(1) == 0:
+                dod = unzigzag(read(7))
+            elif read(1) == 0:
+                dod = unzigzag(read(9))
+            elif read(1) == 0:
+                dod = unzigzag(read(12))
+            else:
+                dod = unzigzag(read(64))
+            delta += dod
+            t = prev + delta
+        times.append(t)
+        prev = t
+    return times
+
+
+def encode_floats(writer, values):
+    """Gorilla XOR compression of a float column"""
+    prev = None
+    lead, trail = 65, 0
+    for x in values:
+        bits = float_bits(x)
+        if prev is None:
+            writer.write(bits, 64)
+        else:
+            xor = bits ^ prev
+            if xor == 0:
+                writer.write(0, 1)
+            else:
+                writer.write(1, 1)
+                new_lead = min(64 - xor.bit_length(), 31)
+                new_trail = (xor & -xor).bit_length() - 1
+                if new_lead >= lead and new_trail >= trail:
+                    # Fits in the previous meaningful window
+                    writer.write(0, 1)
+                    writer.write(xor >> trail, 64 - lead - trail)
+                else:
+                    lead, trail = new_lead, new_trail
+                    length = 64 - lead - trail
+                    writer.write(1, 1)
+                    writer.write(lead, 5)
+                    writer.write(length - 1, 6)
+                    writer.write(xor >> trail, length)
+        prev = bits
+
+
+def decode_floats(reader, count):
+    words = []
+    read = reader.read
+    prev = 0
+    lead, trail = 0, 0
+    for i in range(count):
+        if i == 0:
+            bits = read(64)
+        elif read(1) == 0:
+            bits = prev
+        else:
+            if read(1) == 1:
+                lead = read(5)
+                length = read(6) + 1
+                trail = 64 - lead - length
+            bits = prev ^ (read(64 - lead - trail) << trail)
+        words.append(bits)
+        prev = bits
+    # Reinterpret all 64-bit words as doubles in one go
+    return list(struct.unpack(f'<{count}d', struct.pack(f'<{count}Q', *words)))
+
+
+def encode_block(times, columns):
+    writer = BitWriter()
+    encode_timestamps(writer, times)
+    for column in columns:
+        encode_floats(writer, column)
+    payload = writer.to_bytes()
+    return HEADER.pack(MAGIC, len(times), len(columns), len(payload),
+                       times[0], times[-1]) + payload
+
+
+def decode_block(payload, count, ncols):
+    reader = BitReader(payload)
+    times = decode_timestamps(reader, count)
+    columns = [decode_floats(reader, count) for _ in range(ncols)]
+    return times, columns
+
+
+def read_blocks(filepath, start_ms=None, end_ms=None, cache=None):
+    """
+    Yield (times_ms, columns) for the blocks of a segment file that overlap
+    [start_ms, end_ms]; other blocks are skipped without decoding.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        magic, count, ncols, size, first, last = HEADER.unpack_from(data, offset)
+        block_offset = offset
+        offset += HEADER.size
+        if magic != MAGIC or offset + size > len(data):
+            print(f"[TSDB] ✗ Truncated or corrupt block in {filepath}")
+            return
+        payload_offset = offset
+        offset += size
+        if (start_ms is not None and last < start_ms) or (end_ms is not None and first > end_ms):
+            continue
+
+        key = (filepath, block_offset)
+        block = cache.get(key) if cache is not None else None
+        if block is None:
+            block = decode_block(data[payload_offset:offset], count, ncols)
+            if cache is not None:
+                cache[key] = block
+                if len(cache) > BLOCK_CACHE_SIZE:
+                    cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        yield block
+
+
+# =============================================================================
+# Store
+# =============================================================================
+def plan_resolution(start, end, step=0, now=None):
+    """
+    Stored resolutions worth reading for [start, end], best first.
+
+    The first one is the finest whose rows over the span stay within
+    MAX_POINTS (30 days -> '1h', a year -> '1d'), or a coarser one when
+    `step` asks for wider buckets. Resolutions whose retention no longer
+    covers `start` are skipped; the finer ones follow as a fallback for
+    ranges the coarse rollups do not cover yet.
+    """
+    now = time.time() if now is None else now
+    need = max(end - start, 1) / MAX_POINTS
+
+    def covers(res):
+        return RETENTION[res] is None or start >= now - RETENTION[res]
+
+    bounded = [res for res in RESOLUTIONS if BUCKET.get(res, 1) >= need and covers(res)]
+    if not bounded:
+        bounded = [res for res in reversed(RESOLUTIONS) if covers(res)][:1] or [RESOLUTIONS[-1]]
+    fitting = [res for res in bounded if BUCKET.get(res, 1) <= step]
+    best = fitting[-1] if fitting else bounded[0]
+    finer = [res for res in reversed(RESOLUTIONS[:RESOLUTIONS.index(best)]) if covers(res)]
+    return [best] + finer
+
+
+def downsample(rows, start, end, step):
+    """
+    Re-bucket raw (t, v) or rollup (t, min, max, avg, count) rows into
+    fixed `step` second buckets from `start`. Returns (min, max, avg) lists
+    with None for empty buckets.
+    """
+    n = max(1, int((end - start) // step) + 1)
+    vmin = [None] * n
+    vmax = [None] * n
+    vsum = [0.0] * n
+    count = [0] * n
+    for row in rows:
+        i = int((row[0] - start) // step)
+        if not 0 <= i < n:
+            continue
+        if len(row) == 2:
+            lo = hi = row[1]
+            total, c = row[1], 1
+        else:
+            lo, hi, avg, c = row[1], row[2], row[3], int(row[4])
+            total = avg * c
+        if vmin[i] is None or lo < vmin[i]:
+            vmin[i] = lo
+        if vmax[i] is None or hi > vmax[i]:
+            vmax[i] = hi
+        vsum[i] += total
+        count[i] += c
+    avg = [vsum[i] / count[i] if count[i] else None for i in range(n)]
+    return vmin, vmax, avg
+
+
+class Rollup:
+    """Open aggregation bucket of one series at one rollup resolution"""
+    __slots__ = ('start', 'min', 'max', 'sum', 'count')
+
+    def __init__(self, start):
+        self.start = start
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, vmin, vmax, vsum, count):
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+        self.sum += vsum
+        self.count += count
+
+
+class TimeSeriesStore:
+    def __init__(self, root=TSDB_PATH):
+        self.root = root
+        self.lock = threading.Lock()
+        # (device, metric, resolution) -> (times_ms list, [column lists])
+        self.buffers = {}
+        # (device, metric, resolution) -> Rollup
+        self.rollups = {}
+        # (segment path, offset) -> decoded block, LRU
+        self.block_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+        self.queue = queue.Queue()
+        self.last_flush = time.time()
+        self.last_retention = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # -------------------------------------------------------------------------
+    # Writing
+    # -------------------------------------------------------------------------
+    def record(self, device_id, metrics, t=None):
+        """Queue one heartbeat worth of {metric: value} samples"""
+        self.queue.put((device_id, metrics, time.time() if t is None else t))
+
+    def run(self):
+        while self.running:
+            try:
+                device_id, metrics, t = self.queue.get(timeout=1)
+                with self.lock:
+                    for metric, value in metrics.items():
+                        self._ingest(device_id, metric, t, float(value))
+            except queue.Empty:
+                pass
+            except Exception as e:
+                print(f"[TSDB] Error ingesting sample: {e}")
+
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[TSDB] Error in background tick: {e}")
+
+    def _ingest(self, device_id, metric, t, value):
+        self._append((device_id, metric, 'raw'), t, [value])
+        self._fold(device_id, metric, '1m', t, value, value, value, 1)
+
+    def _fold(self, device_id, metric, resolution, t, vmin, vmax, vsum, count):
+        """Feed an aggregate into a rollup level, closing the bucket if needed"""
+        key = (device_id, metric, resolution)
+        start = int(t // BUCKET[resolution]) * BUCKET[resolution]
+        bucket = self.rollups.get(key)
+        if bucket is not None and start > bucket.start:
+            self._close(key, bucket)
+            bucket = None
+        if bucket is None:
+            bucket = self.rollups[key] = Rollup(start)
+        bucket.add(vmin, vmax, vsum, count)
+
+    def _close(self, key, bucket):
+        device_id, metric, resolution = key
+        avg = bucket.sum / bucket.count
+        self._append(key, bucket.start, [bucket.min, bucket.max, avg, bucket.count])
+        self.rollups.pop(key, None)
+        upper = ROLLUP_OF.get(resolution)
+        if upper:
+            self._fold(device_id, metric, upper, bucket.start,
+                       bucket.min, bucket.max, bucket.sum, bucket.count)
+
+    def _append(self, key, t, row):
+        times, columns = self.buffers.setdefault(key, ([], [[] for _ in row]))
+        times.append(int(round(t * 1000)))
+        for column, value in zip(columns, row):
+            column.append(value)
+        if len(times) >= BLOCK_SIZE:
+            self._flush_key(key)
+
+    def tick(self, now=None):
+        """Close stale rollup buckets, flush buffers, apply retention"""
+        now = time.time() if now is None else now
+        with self.lock:
+            # Lowest resolution first so closed rows cascade upwards
+            for resolution in ('1m', '1h', '1d'):
+                for key, bucket in list(self.rollups.items()):
+                    if key[2] == resolution and now >= bucket.start + BUCKET[resolution] + BUCKET_GRACE:
+                        self._close(key, bucket)
+
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self._flush_all()
+                self.last_flush = now
+
+        if now - self.last_retention >= 3600:
+            self.last_retention = now
+            self.apply_retention(now)
+
+    def flush(self):
+        with self.lock:
+            self._flush_all()
+
+    def _flush_all(self):
+        for key in list(self.buffers):
+            self._flush_key(key)
+
+    def _flush_key(self, key):
+        times, columns = self.buffers.pop(key, ([], []))
+        device_id, metric, resolution = key
+        span = SEGMENT_SPAN[resolution] * 1000
+        # A block never straddles two segments
+        i = 0
+        while i < len(times):
+            segment = times[i] // span * span
+            j = i
+            while j < len(times) and times[j] // span * span == segment:
+                j += 1
+            directory = os.path.join(self.root, resolution, device_id, metric)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, f"{segment // 1000}.seg"), 'ab') as f:
+                    f.write(encode_block(times[i:j], [c[i:j] for c in columns]))
+            except Exception as e:
+                print(f"[TSDB] ✗ Error writing {key}: {e}")
+            i = j
+
+    def apply_retention(self, now=None):
+        """Delete segments entirely older than the resolution's retention"""
+        now = time.time() if now is None else now
+        for resolution in RESOLUTIONS:
+            keep = RETENTION[resolution]
+            base = os.path.join(self.root, resolution)
+            if keep is None or not os.path.isdir(base):
+                continue
+            for directory, _, files in os.walk(base):
+                for name in files:
+                    if not name.endswith('.seg'):
+                        continue
+                    segment_end = int(name[:-4]) + SEGMENT_SPAN[resolution]
+                    if segment_end < now - keep:
+                        os.remove(os.path.join(directory, name))
+                        print(f"[TSDB] Retention: removed {resolution}/{name}")
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=2)
+        self.flush()
+
+    # -------------------------------------------------------------------------
+    # Reading
+    # -------------------------------------------------------------------------
+    def segments(self, device_id, metric, resolution, start, end):
+        """Segment files of a series overlapping [start, end] (seconds)"""
+        directory = os.path.join(self.root, resolution, device_id, metric)
+        if not os.path.isdir(directory):
+            return []
+        span = SEGMENT_SPAN[resolution]
+        found = []
+        for name in os.listdir(directory):
+            if name.endswith('.seg'):
+                segment = int(name[:-4])
+                if segment <= end and segment + span > start:
+                    found.append((segment, os.path.join(directory, name)))
+        return [path for _, path in sorted(found)]
+
+    def query(self, device_id, metric, start, end, resolution='raw'):
+        """
+        Rows of one series in [start, end] at one resolution, oldest first.
+        raw rows: (t, value); rollup rows: (t, min, max, avg, count)
+        """
+        rows = []
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        with self.cache_lock:
+            for path in self.segments(device_id, metric, resolution, start, end):
+                for times, columns in read_blocks(path, start_ms, end_ms, self.block_cache):
+                    for i, t in enumerate(times):
+                        if start_ms <= t <= end_ms:
+                            rows.append((t / 1000, *(c[i] for c in columns)))
+
+        with self.lock:
+            times, columns = self.buffers.get((device_id, metric, resolution), ([], []))
+            for i, t in enumerate(times):
+                if start_ms <= t <= end_ms:
+                    rows.append((t / 1000, *(c[i] for c in columns)))
+
+        rows.sort(key=lambda r: r[0])
+        return rows
+
+    def chart(self, device_id, metric, start, end, step=None, now=None):
+        """
+        Chart-ready series: reads the coarsest stored resolution that keeps
+        the span within MAX_POINTS rows (a finer one only when it has no
+        rows there) and re-buckets it. step is at least that bucket.
+        """
+        span = max(end - start, 1)
+        for resolution in plan_resolution(start, end, step or 0, now):
+            rows = self.query(device_id, metric, start, end, resolution)
+            if rows:
+                break
+        step = max(step or 0, span / MAX_POINTS, BUCKET.get(resolution, 1))
+        vmin, vmax, avg = downsample(rows, start, end, step)
+        return {"resolution": resolution, "step": step,
+                "min": vmin, "max": vmax, "avg": avg}
+
+    def series(self):
+        """[(device, metric)] with data on disk or in memory"""
+        found = set((d, m) for d, m, _ in self.buffers)
+        base = os.path.join(self.root, 'raw')
+        if os.path.isdir(base):
+            for device_id in os.listdir(base):
+                for metric in os.listdir(os.path.join(base, device_id)):
+                    found.add((device_id, metric))
+        return sorted(found)